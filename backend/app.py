@@ -1,28 +1,92 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
+import io
+import sys
+import atexit
+import signal
+import csv
 import json
+import base64
+import uuid
+import math
+import queue
+import config
 import model_utils
-import torch
+import inference_backends
+import timing
+from metrics import registry, render_prometheus
+from sampling_profiler import slow_request_profiler
+from model_registry import model_registry, ModelUnavailable
+from explanations import deferred_explanations, ExplanationQueueFull
+from result_cache import result_cache
+from incident_sink import IncidentSink, configure_sqlite
+from incident_stats import IncidentStats
+from report_pipeline import ReportPipeline
+from event_hub import event_hub, TooManySubscribers
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=["Server-Timing", "ETag"])  # Enable CORS for all routes
+
+# --- Request timing ---
+# Every request gets a trace that model_utils, ThreatIntel and the handlers add stage
+# timings to; it is returned as a Server-Timing header (and a `timings` field on request).
+@app.before_request
+def start_request_trace():
+    g.trace_token = timing.begin(request.endpoint or "unmatched")
+    slow_request_profiler.begin()
+
+@app.after_request
+def finish_request_trace(response):
+    trace = timing.current()
+    if trace is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed_ms = trace.elapsed_ms()
+    registry.histogram("http_request_duration_ms", {"endpoint": endpoint},
+                       help_text="Time to produce a response (streamed bodies excluded).").observe(elapsed_ms)
+    registry.counter("http_requests_total", {"endpoint": endpoint, "status": str(response.status_code)},
+                     help_text="Responses sent.").inc()
+    if config.SERVER_TIMING_HEADER and trace.stages:
+        response.headers["Server-Timing"] = trace.server_timing()
+    slow_request_profiler.end(f"{request.method} {request.path}", elapsed_ms)
+    return response
+
+@app.teardown_request
+def end_request_trace(_error):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        timing.end(token)
+
+def wants_timings(data, args=None):
+    """True when the client asked for the stage breakdown in the body (`"debug": "timing"` or `?debug=timing`).
+    `args` defaults to the Flask request's query string."""
+    debug = data.get('debug') or (request.args if args is None else args).get('debug')
+    return debug is True or str(debug).lower() in ("timing", "timings", "true", "1")
 
 # Database Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE_DIR, 'incident_logs.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + config.DATABASE_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_sqlite(db.engine)
 
 # Database Model
 class Incident(db.Model):
+    __table_args__ = (
+        # Keyset pagination walks (timestamp, id) newest first
+        db.Index('ix_incident_timestamp_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    type = db.Column(db.String(50), nullable=False)
+    type = db.Column(db.String(50), nullable=False, index=True)
     target = db.Column(db.String(500), nullable=False)
-    prediction = db.Column(db.String(50), nullable=False)
+    prediction = db.Column(db.String(50), nullable=False, index=True)
     confidence = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.now)
 
@@ -36,21 +100,235 @@ class Incident(db.Model):
             "timestamp": self.timestamp.strftime("%Y-%m-%d %H:%M:%S")
         }
 
+class CertSubmission(db.Model):
+    """Index of indicators reported to CERT; the STIX bundles live in the report archive."""
+    __table_args__ = (
+        db.Index('ix_cert_submission_submitted_id', 'submitted_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.String(36), nullable=False, unique=True)
+    indicator_id = db.Column(db.String(64), nullable=False)
+    bundle_id = db.Column(db.String(64), nullable=False, index=True)
+    type = db.Column(db.String(50), nullable=False, index=True)
+    content = db.Column(db.String(500), nullable=False)
+    campaign = db.Column(db.String(100), index=True)
+    group_key = db.Column(db.String(300), nullable=False)
+    submitted_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    segment = db.Column(db.String(100), nullable=False)
+    offset = db.Column(db.Integer, nullable=False)
+
+    def to_dict(self):
+        return {
+            "submission_id": self.submission_id,
+            "indicator_id": self.indicator_id,
+            "bundle_id": self.bundle_id,
+            "type": self.type,
+            "content": self.content,
+            "campaign": self.campaign,
+            "group": self.group_key,
+            "submitted_at": self.submitted_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "archived_at": self.archived_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "status": "archived",
+        }
+
+class IncidentRollup(db.Model):
+    """Incident counts per time bucket, type, verdict and confidence bin (see incident_stats)."""
+    __table_args__ = (
+        # Also serves the (granularity, bucket) range scans of /api/incident-stats
+        db.UniqueConstraint('granularity', 'bucket', 'type', 'prediction', 'confidence_bin',
+                            name='uq_incident_rollup_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(6), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    prediction = db.Column(db.String(50), nullable=False)
+    confidence_bin = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    confidence_sum = db.Column(db.Float, nullable=False)
+
+class IncidentTargetSketch(db.Model):
+    """Counters of one day's Space-Saving sketch of repeated targets (see incident_stats)."""
+    __table_args__ = (
+        db.UniqueConstraint('day', 'type', 'target', name='uq_incident_target_sketch_key'),
+        # Per-day floors (smallest counter) and the counters above them, without touching the rows
+        db.Index('ix_incident_target_sketch_day_count', 'day', 'count'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    target = db.Column(db.String(500), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Integer, nullable=False)
+
 # Initialize Database
 with app.app_context():
     db.create_all()
+    # create_all() skips existing tables, so add indexes missing from older databases
+    for index in Incident.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+# Dashboard statistics come from rollup tables the incident writer keeps current;
+# databases from before the rollups existed are aggregated once here
+incident_stats = IncidentStats(Incident, IncidentRollup, IncidentTargetSketch)
+with app.app_context():
+    incident_stats.backfill(db.session)
+
+# Write-behind incident logging: handlers enqueue, a background writer commits in batches
+incident_sink = IncidentSink(app, db, rollups=incident_stats)
+atexit.register(incident_sink.shutdown)
+
+# CERT reports are queued, grouped into STIX bundles and archived by a background writer
+report_pipeline = ReportPipeline(app, db, CertSubmission)
+atexit.register(report_pipeline.shutdown)
+
+def email_target(text):
+    """Short preview of an email body stored as the incident target."""
+    return text[:50] + "..." if len(text) > 50 else text
 
 # Load Models
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 EMAIL_MODEL_PATH = os.path.join(PROJECT_ROOT, "email")
 URL_MODEL_PATH = os.path.join(PROJECT_ROOT, "url")
 
-print(f"Loading Email Model from {EMAIL_MODEL_PATH}...")
-email_model, email_tokenizer = model_utils.load_model(EMAIL_MODEL_PATH)
+inference_backends.configure_threads()
+
+# Models are registered here and loaded per CEREBRO_MODEL_WARMUP (background threads by
+# default), so Flask starts serving before the weights are in memory; see /api/ready.
+# Inference backends (int8/TorchScript/compile/ONNX) serve predictions; the fp32
+# models stay loaded for explanations, which need gradients.
+model_registry.register("email", EMAIL_MODEL_PATH)
+model_registry.register("url", URL_MODEL_PATH)
+if config.INFERENCE_WORKERS > 0:
+    # Inference runs in worker processes; this process only tokenizes, batches and routes
+    atexit.register(model_registry.start_pool().stop)
+model_registry.warm_up()
+
+
+EXPLAIN_REQUEST_MODES = model_utils.EXPLAIN_MODES + ("deferred",)
+
+def requested_explain_mode(data, args=None):
+    """Explanation mode from the JSON body or query string (`args`, default the Flask
+    request's), falling back to the configured default."""
+    args = request.args if args is None else args
+    mode = (data.get('explain') or args.get('explain') or config.EXPLAIN_DEFAULT_MODE).lower()
+    if mode not in EXPLAIN_REQUEST_MODES:
+        raise ValueError(f"Invalid explain mode '{mode}'. Expected one of: {', '.join(EXPLAIN_REQUEST_MODES)}")
+    return mode
+
+def analyze_with_cache(text, handle, explain_mode, windowing=None):
+    """Prediction and explanation for `text` with the loaded model `handle`, reusing cached results for identical inputs.
+    Deferred explanations are queued and come back empty with an ID to poll.
+    `windowing` ({"aggregation", "positive_class"}) classifies texts longer than
+    the model limit in overlapping windows instead of truncating them.
+    Returns (pred_idx, confidence, attributions, explanation_info, window_info).
+    On a miss the text is tokenized once and the encoding shared by prediction and attribution."""
+    tokenizer, batcher = handle.tokenizer, handle.batcher
+    model_id = handle.model_id
+    if windowing:
+        model_id = f"{model_id}:window:{windowing['aggregation']}"
+    with timing.stage("cache"):
+        cache_key = result_cache.make_key(model_id, text)
+        cached = result_cache.get(cache_key)
+    encoding = None
+    if cached is None:
+        # Either way the text is tokenized once: encode_windows hands back a text that
+        # fits in one window as an ordinary encoding
+        encoding = model_utils.encode_windows(text, tokenizer) if windowing else model_utils.encode_one(text, tokenizer)
+        if isinstance(encoding, model_utils.WindowedEncoding):
+            with timing.stage("predict"):
+                pred_idx, confidence, window_info = model_utils.classify_windows(
+                    encoding, batcher.predict_many, windowing["positive_class"], aggregation=windowing["aggregation"])
+        else:
+            with timing.stage("predict"):
+                pred_idx, confidence = batcher.predict(text, encoding=encoding)
+            window_info = None
+        entry = {"pred_idx": pred_idx, "confidence": confidence, "attributions": {}, "windows": window_info}
+        changed = True
+    else:
+        entry = dict(cached, attributions=dict(cached["attributions"]))
+        changed = False
+        if entry.get("windows"):
+            # Explanations must cover the same windows the cached verdict was based on
+            encoding = model_utils.encode_windows(text, tokenizer)
+            # The window settings may have changed since; then explain the text as it is now split
+            if isinstance(encoding, model_utils.WindowedEncoding):
+                encoding.evaluated = min(entry["windows"]["evaluated"], len(encoding.windows))
+
+    target_class = entry["pred_idx"]
+    compute_mode = config.EXPLAIN_DEFERRED_MODE if explain_mode == "deferred" else explain_mode
+
+    if explain_mode == "none":
+        attributions, explanation = [], {"mode": explain_mode, "status": "skipped"}
+    elif compute_mode in entry["attributions"]:
+        attributions = entry["attributions"][compute_mode]
+        explanation = {"mode": explain_mode, "status": "done", "cached": True}
+    elif explain_mode == "deferred":
+        def remember(computed):
+            result_cache.put(cache_key, dict(entry, attributions=dict(entry["attributions"], **{compute_mode: computed})))
+
+        try:
+            explanation_id = deferred_explanations.submit(
+                text, handle, target_class, mode=compute_mode, on_done=remember, encoding=encoding)
+            attributions, explanation = [], {"mode": explain_mode, "status": "pending", "id": explanation_id}
+        except ExplanationQueueFull as e:
+            # The verdict still goes out, just without an explanation
+            attributions, explanation = [], {"mode": explain_mode, "status": "busy", "error": str(e)}
+    else:
+        attributions, _ = handle.explain(text, target_class=target_class, mode=compute_mode, encoding=encoding)
+        entry["attributions"][compute_mode] = attributions
+        changed = True
+        explanation = {"mode": explain_mode, "status": "done"}
 
-print(f"Loading URL Model from {URL_MODEL_PATH}...")
-url_model, url_tokenizer = model_utils.load_model(URL_MODEL_PATH)
+    if changed:
+        result_cache.put(cache_key, entry)
+    return entry["pred_idx"], entry["confidence"], attributions, explanation, entry.get("windows")
 
+def requested_windowing(data):
+    """Long-email handling from the request body: None to truncate, else the windowing
+    options for analyze_with_cache. Raises ValueError for unknown modes."""
+    long_text = (data.get('long_text') or config.EMAIL_LONG_TEXT_MODE).lower()
+    aggregation = (data.get('aggregate') or config.WINDOW_AGGREGATION).lower()
+    if long_text not in ("window", "truncate"):
+        raise ValueError(f"Invalid long_text mode '{long_text}'. Expected one of: window, truncate")
+    if aggregation not in model_utils.WINDOW_AGGREGATIONS:
+        raise ValueError(f"Invalid aggregate '{aggregation}'. Expected one of: {', '.join(model_utils.WINDOW_AGGREGATIONS)}")
+    # Long emails are split into overlapping windows; Spam (1) is the class the windows vote for
+    return {"aggregation": aggregation, "positive_class": 1} if long_text == "window" else None
+
+def analyze_email_text(text, explain_mode, windowing):
+    """Verdict and explanation for one email, logged as an incident. Shared by the Flask
+    handler and the ASGI server (asgi.py); raises ModelUnavailable while the model loads."""
+    email = model_registry.get("email")
+
+    # Predict + Explain (served from the result cache for repeated content)
+    pred_idx, confidence, attributions, explanation, windows = analyze_with_cache(
+        text, email, explain_mode, windowing)
+    label = "Spam" if pred_idx == 1 else "Legitimate"
+
+    result = {
+        "prediction": label,
+        "confidence": confidence,
+        "attributions": attributions,
+        "explanation": explanation
+    }
+    if windows:
+        result["windows"] = windows
+
+    # Log Incident to DB
+    new_incident = Incident(
+        type="Email Analysis",
+        target=email_target(text),
+        prediction=label,
+        confidence=confidence
+    )
+    with timing.stage("incident_enqueue"):
+        incident_sink.submit(new_incident)
+    return result
 
 @app.route('/api/analyze/email', methods=['POST'])
 def analyze_email():
@@ -59,38 +337,80 @@ def analyze_email():
     if not text:
         return jsonify({"error": "No text provided"}), 400
 
-    if not email_model:
-         return jsonify({"error": "Email model not loaded"}), 500
+    try:
+        explain_mode = requested_explain_mode(data)
+        windowing = requested_windowing(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        # Predict
-        pred_idx, confidence, _ = model_utils.predict(text, email_model, email_tokenizer)
-        label = "Spam" if pred_idx == 1 else "Legitimate" 
-        
-        # Explain
-        attributions, _ = model_utils.explain_prediction(text, email_model, email_tokenizer, target_class=pred_idx)
-        
-        result = {
-            "prediction": label,
-            "confidence": confidence,
-            "attributions": attributions
-        }
-        
-        # Log Incident to DB
-        new_incident = Incident(
-            type="Email Analysis",
-            target=text[:50] + "..." if len(text) > 50 else text,
-            prediction=label,
-            confidence=confidence
-        )
-        db.session.add(new_incident)
-        db.session.commit()
-        
+        result = analyze_email_text(text, explain_mode, windowing)
+        if wants_timings(data):
+            result["timings"] = timing.current().as_dict()
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 from threat_intel import threat_intel
+from feed_table import page_query
+from url_prefilter import url_prefilter
+
+def hybrid_url_verdict(ti_result, pred_idx, confidence):
+    """Combines threat-intel status with the URL model output.
+    Returns (model_label, final_label, final_confidence)."""
+    model_label = "Phishing" if pred_idx == 0 else "Safe"
+
+    if ti_result['status'] == 'Malicious':
+        return model_label, "Phishing", 0.99
+    if ti_result['status'] == 'Clean' and ti_result['source'] == 'Allowed List':
+        return model_label, "Safe", 0.99
+    return model_label, model_label, confidence
+
+def analyze_url_with_intel(url, explain_mode, ti_result):
+    """Model verdict for `url` combined with its threat-intel result (steps 2-3 of a
+    scan), logged as an incident. Shared by the Flask handler and the ASGI server
+    (asgi.py), which await the threat-intel step themselves."""
+    # 2. The lexical prefilter settles confident URLs; the uncertain band (and audit
+    #    samples) go to the model, served from the result cache for repeated URLs
+    verdict, escalate = url_prefilter.plan([url])[0]
+    if escalate:
+        url_handle = model_registry.get("url")
+        pred_idx, confidence, attributions, explanation, _ = analyze_with_cache(
+            url, url_handle, explain_mode)
+        url_prefilter.observe(verdict, pred_idx)
+        tier = "transformer"
+    else:
+        pred_idx, confidence = verdict
+        if explain_mode == "none":
+            attributions, explanation = [], {"mode": explain_mode, "status": "skipped"}
+        else:
+            attributions = url_prefilter.explain(url, pred_idx)
+            explanation = {"mode": "lexical", "status": "done"}
+        tier = "prefilter"
+
+    # 3. Hybrid Decision Logic
+    model_label, final_label, final_confidence = hybrid_url_verdict(ti_result, pred_idx, confidence)
+
+    result = {
+        "prediction": final_label,
+        "confidence": final_confidence,
+        "attributions": attributions,
+        "explanation": explanation,
+        "third_party_analysis": ti_result,
+        "raw_model_prediction": model_label,
+        "tier": tier
+    }
+
+    # Log Incident to DB
+    new_incident = Incident(
+        type="URL Scan",
+        target=url,
+        prediction=final_label,
+        confidence=final_confidence
+    )
+    with timing.stage("incident_enqueue"):
+        incident_sink.submit(new_incident)
+    return result
 
 @app.route('/api/analyze/url', methods=['POST'])
 def analyze_url():
@@ -99,102 +419,594 @@ def analyze_url():
     if not url:
         return jsonify({"error": "No URL provided"}), 400
 
-    if not url_model:
-         return jsonify({"error": "URL model not loaded"}), 500
+    try:
+        explain_mode = requested_explain_mode(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         # 1. Threat Intelligence Check
-        ti_result = threat_intel.check_url(url)
-        
-        # 2. Model Prediction
-        pred_idx, confidence, _ = model_utils.predict(url, url_model, url_tokenizer)
-        
-        model_label = "Phishing" if pred_idx == 0 else "Safe"
-        
-        # 3. Hybrid Decision Logic
-        final_label = model_label
-        final_confidence = confidence
-
-        if ti_result['status'] == 'Malicious':
-            final_label = "Phishing"
-            final_confidence = 0.99 
-        elif ti_result['status'] == 'Clean' and ti_result['source'] == 'Allowed List':
-            final_label = "Safe"
-            final_confidence = 0.99
-        else:
-             final_label = model_label
-             final_confidence = confidence
-        
-        # Explain
-        attributions, _ = model_utils.explain_prediction(url, url_model, url_tokenizer, target_class=pred_idx)
-        
+        with timing.stage("threat_intel"):
+            ti_result = threat_intel.check_url(url)
+
+        result = analyze_url_with_intel(url, explain_mode, ti_result)
+        if wants_timings(data):
+            result["timings"] = timing.current().as_dict()
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- Bulk analysis ---
+# Thread pool shared by bulk scans for concurrent ThreatIntel.check_url lookups
+bulk_intel_pool = ThreadPoolExecutor(max_workers=config.BULK_INTEL_WORKERS, thread_name_prefix="bulk-intel")
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+class TooManyBulkItems(ValueError):
+    """A bulk request carries more than BULK_MAX_ITEMS items (answered with 413)."""
+
+def read_bulk_items(field):
+    """Parses a bulk request body (JSON array or NDJSON stream) into a list of strings.
+    Each item may be a bare string or an object carrying `field`. An NDJSON stream is
+    read only up to the item past the limit, then rejected with TooManyBulkItems."""
+    too_many = TooManyBulkItems(f"Too many items (limit is {config.BULK_MAX_ITEMS})")
+    if request.mimetype in NDJSON_MIMETYPES:
+        raw_items = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                raw_items.append(json.loads(line))
+                if len(raw_items) > config.BULK_MAX_ITEMS:
+                    raise too_many
+    else:
+        raw_items = request.get_json()
+        if isinstance(raw_items, dict):
+            raw_items = raw_items.get('items')
+        if not isinstance(raw_items, list):
+            raise ValueError("Expected a JSON array or an NDJSON stream")
+        if len(raw_items) > config.BULK_MAX_ITEMS:
+            raise too_many
+
+    items = []
+    for raw in raw_items:
+        value = raw.get(field, '') if isinstance(raw, dict) else raw
+        items.append(value if isinstance(value, str) else '')
+    return items
+
+def chunked(seq, size):
+    for start in range(0, len(seq), size):
+        yield start, seq[start:start + size]
+
+def ndjson_line(obj):
+    return json.dumps(obj) + "\n"
+
+def stream_bulk_results(items, handle, build_result, prefetch=None, prefilter=None):
+    """Runs padded batch inference over `items` with the loaded model `handle` and yields NDJSON result lines as
+    each chunk finishes. Each item's incident is handed to the incident sink as its result is yielded, so a
+    client that disconnects midway still leaves rows for what was analysed. Failures are reported per item as
+    `{"index", "error"}` lines; the 200 status is already sent, so nothing may escape the generator.
+
+    `build_result(index, item, pred_idx, confidence, extra)` returns (result, incident);
+    `prefetch(item)`, if given, is scheduled on the bulk pool up front and its
+    outcome passed as `extra`. With a `prefilter` (see URLPrefilter.plan), each chunk
+    is scored by it first and only the escalated items reach the model."""
+    extras = [bulk_intel_pool.submit(prefetch, item) if prefetch and item else None for item in items]
+
+    for start, chunk in chunked(items, config.BULK_INFERENCE_BATCH):
+        valid = [(start + i, item) for i, item in enumerate(chunk) if item]
+        for i, item in enumerate(chunk):
+            if not item:
+                yield ndjson_line({"index": start + i, "error": "Empty item"})
+
+        if not valid:
+            continue
+
+        try:
+            plan = prefilter.plan([item for _, item in valid]) if prefilter else [(None, True)] * len(valid)
+            escalated = [item for (_, item), (_, escalate) in zip(valid, plan) if escalate]
+            predictions = iter(handle.predict_batch(escalated) if escalated else [])
+        except Exception as e:
+            for index, _ in valid:
+                yield ndjson_line({"index": index, "error": str(e)})
+            continue
+
+        for (index, item), (verdict, escalate) in zip(valid, plan):
+            try:
+                if escalate:
+                    pred_idx, confidence = next(predictions)
+                    if prefilter:
+                        prefilter.observe(verdict, pred_idx)
+                else:
+                    pred_idx, confidence = verdict
+                extra = extras[index].result() if extras[index] else None
+                result, incident = build_result(index, item, pred_idx, confidence, extra)
+            except Exception as e:
+                yield ndjson_line({"index": index, "error": str(e)})
+                continue
+            if prefilter:
+                result["tier"] = "transformer" if escalate else "prefilter"
+            incident_sink.submit(incident)
+            yield ndjson_line(result)
+
+@app.route('/api/analyze/email/batch', methods=['POST'])
+def analyze_email_batch():
+    try:
+        email = model_registry.get("email")
+    except ModelUnavailable as e:
+        return jsonify({"error": str(e)}), 500
+    try:
+        items = read_bulk_items('text')
+    except TooManyBulkItems as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build_result(index, text, pred_idx, confidence, _):
+        label = "Spam" if pred_idx == 1 else "Legitimate"
+        result = {"index": index, "prediction": label, "confidence": confidence}
+        incident = Incident(type="Email Analysis", target=email_target(text), prediction=label, confidence=confidence)
+        return result, incident
+
+    return Response(
+        stream_with_context(stream_bulk_results(items, email, build_result)),
+        mimetype='application/x-ndjson'
+    )
+
+@app.route('/api/analyze/url/batch', methods=['POST'])
+def analyze_url_batch():
+    try:
+        url_handle = model_registry.get("url")
+    except ModelUnavailable as e:
+        return jsonify({"error": str(e)}), 500
+    try:
+        items = read_bulk_items('url')
+    except TooManyBulkItems as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build_result(index, url, pred_idx, confidence, ti_result):
+        model_label, final_label, final_confidence = hybrid_url_verdict(ti_result, pred_idx, confidence)
         result = {
+            "index": index,
+            "url": url,
             "prediction": final_label,
             "confidence": final_confidence,
-            "attributions": attributions,
             "third_party_analysis": ti_result,
             "raw_model_prediction": model_label
         }
+        incident = Incident(type="URL Scan", target=url, prediction=final_label, confidence=final_confidence)
+        return result, incident
 
-        # Log Incident to DB
-        new_incident = Incident(
-            type="URL Scan",
-            target=url,
-            prediction=final_label,
-            confidence=final_confidence
-        )
-        db.session.add(new_incident)
-        db.session.commit()
-
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return Response(
+        stream_with_context(stream_bulk_results(
+            items, url_handle, build_result, prefetch=threat_intel.check_url, prefilter=url_prefilter)),
+        mimetype='application/x-ndjson'
+    )
 
 @app.route('/api/notify-cert', methods=['POST'])
 def notify_cert():
-    data = request.json
+    """Queues one indicator ({type, content}) or a campaign ({type, items: [...], campaign})
+    for CERT. Related indicators are archived together in one STIX bundle by the report
+    pipeline; poll GET /api/cert-reports/<report_id> for the bundle."""
+    data = request.json or {}
     threat_type = data.get('type')
-    content = data.get('content')
-    
-    # Generate STIX Bundle
-    stix_bundle = threat_intel.generate_stix_report(threat_type, content)
-    
-    # Save to disk (Simulating submission to SOC)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"report_{timestamp}.json"
-    filepath = os.path.join(BASE_DIR, 'submitted_reports', filename)
-    
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    
-    with open(filepath, 'w') as f:
-        json.dump(stix_bundle, f, indent=4)
-
-    print(f"\n[CERT] STIX Bundle saved to {filepath}")
-    
+    campaign = data.get('campaign')
+    items = data.get('items')
+    if items is None:
+        items = [{"type": threat_type, "content": data.get('content')}]
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected 'content' or a non-empty 'items' list"}), 400
+
+    submissions = []
+    for item in items:
+        item = item if isinstance(item, dict) else {"content": item}
+        item_type, content = item.get('type') or threat_type, item.get('content')
+        if not item_type or not content:
+            return jsonify({"error": "Every report needs a type and content"}), 400
+        if not isinstance(item_type, str) or not isinstance(content, str):
+            return jsonify({"error": "Report type and content must be strings"}), 400
+        submissions.append((item_type, content))
+    if campaign is not None and not isinstance(campaign, str):
+        return jsonify({"error": "'campaign' must be a string"}), 400
+
+    reports = []
+    for t, c in submissions:
+        try:
+            reports.append(report_pipeline.submit(t, c, campaign=campaign))
+        except queue.Full:
+            # Anything queued before the pipeline filled up is still archived
+            response = jsonify({"error": "CERT report queue is full, retry later", "reports": reports})
+            response.headers["Retry-After"] = str(max(1, math.ceil(report_pipeline.window)))
+            return response, 503
+    print(f"\n[CERT] Queued {len(reports)} indicator(s) for CERT")
+
+    response = {
+        "status": "queued",
+        "message": "CERT notification queued. STIX 2.1 bundle will be archived shortly.",
+        "report_id": reports[0]["submission_id"],
+        "indicator_id": reports[0]["indicator_id"],
+    }
+    if data.get('items') is not None:
+        response["reports"] = reports
+    return jsonify(response), 202
+
+CERT_REPORT_PAGE_DEFAULT = 50
+CERT_REPORT_PAGE_MAX = 500
+
+def filtered_cert_query():
+    """Submission index query filtered by type, campaign, bundle_id and start/end (submission time)."""
+    query = CertSubmission.query
+    for field in ('type', 'campaign', 'bundle_id'):
+        value = request.args.get(field)
+        if value:
+            query = query.filter(getattr(CertSubmission, field) == value)
+    start = parse_time_param('start')
+    if start is not None:
+        query = query.filter(CertSubmission.submitted_at >= start)
+    end = parse_time_param('end')
+    if end is not None:
+        query = query.filter(CertSubmission.submitted_at <= end)
+    return query
+
+@app.route('/api/cert-reports', methods=['GET'])
+def list_cert_reports():
+    # Archived submissions, newest first; pass next_cursor as `before` for the next page
+    try:
+        limit = min(max(int(request.args.get('limit', CERT_REPORT_PAGE_DEFAULT)), 1), CERT_REPORT_PAGE_MAX)
+        query = filtered_cert_query()
+        before = request.args.get('before')
+        if before:
+            query = query.filter(CertSubmission.id < int(before))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = query.order_by(CertSubmission.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     return jsonify({
-        "status": "reported", 
-        "message": "CERT notified successfully. STIX 2.1 Object generated.",
-        "report_id": f"STIX-{timestamp}",
-        "file_saved": filename,
-        "stix_data": stix_bundle
+        "items": [r.to_dict() for r in rows],
+        "next_cursor": rows[-1].id if has_more else None,
+        "pipeline": report_pipeline.stats(),
     })
 
+@app.route('/api/cert-reports/<submission_id>', methods=['GET'])
+def get_cert_report(submission_id):
+    # Queued submissions report their status; archived ones come with their STIX bundle
+    pending = report_pipeline.pending(submission_id)
+    if pending is not None:
+        return jsonify(pending)
+    row = CertSubmission.query.filter_by(submission_id=submission_id).first()
+    if row is None:
+        return jsonify({"error": "Unknown report ID"}), 404
+    record = report_pipeline.archive.read_bundle(row.segment, row.offset, row.bundle_id)
+    return jsonify(dict(row.to_dict(), bundle=record["bundle"] if record else None))
+
+@app.route('/api/cert-reports/export', methods=['GET'])
+def export_cert_reports():
+    """Streams the archived bundles of every matching submission, oldest first:
+    format=ndjson (one archive record per line, the default) or format=stix (one merged Bundle)."""
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'stix'):
+        return jsonify({"error": "format must be ndjson or stix"}), 400
+    try:
+        locations = (filtered_cert_query()
+                     .with_entities(CertSubmission.bundle_id, CertSubmission.segment, CertSubmission.offset)
+                     .distinct().order_by(CertSubmission.segment, CertSubmission.offset).all())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def records():
+        for bundle_id, segment, offset in locations:
+            record = report_pipeline.archive.read_bundle(segment, offset, bundle_id)
+            if record is not None:
+                yield record
+
+    def generate_ndjson():
+        for record in records():
+            yield json.dumps(record) + "\n"
+
+    def generate_stix():
+        # Objects of every bundle, wrapped in one new bundle
+        yield '{"type": "bundle", "id": "bundle--%s", "objects": [' % uuid.uuid4()
+        first = True
+        for record in records():
+            for obj in record["bundle"]["objects"]:
+                yield ("" if first else ",") + json.dumps(obj)
+                first = False
+        yield "]}\n"
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if export_format == 'stix':
+        body, mimetype, extension = generate_stix(), 'application/stix+json', 'json'
+    else:
+        body, mimetype, extension = generate_ndjson(), 'application/x-ndjson', 'ndjson'
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=cert_reports_{timestamp}.{extension}"})
+
+@app.route('/api/cert-reports/pipeline', methods=['GET'])
+def get_report_pipeline_stats():
+    return jsonify(report_pipeline.stats())
+
+INCIDENT_PAGE_DEFAULT = 50
+INCIDENT_PAGE_MAX = 500
+INCIDENT_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+def parse_time_param(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in INCIDENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid '{name}' timestamp: {value}")
+
+def parse_float_param(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}': {value}")
+
+def encode_cursor(incident):
+    raw = f"{incident.timestamp.isoformat()}|{incident.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, incident_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(incident_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+def filtered_incident_query():
+    """Incident query with the filters shared by the listing and export endpoints:
+    type, prediction (comma-separated), min/max_confidence, start/end and since (id)."""
+    query = Incident.query
+
+    types = [t for t in request.args.get('type', '').split(',') if t]
+    if types:
+        query = query.filter(Incident.type.in_(types))
+    predictions = [p for p in request.args.get('prediction', '').split(',') if p]
+    if predictions:
+        query = query.filter(Incident.prediction.in_(predictions))
+
+    min_confidence = parse_float_param('min_confidence')
+    if min_confidence is not None:
+        query = query.filter(Incident.confidence >= min_confidence)
+    max_confidence = parse_float_param('max_confidence')
+    if max_confidence is not None:
+        query = query.filter(Incident.confidence <= max_confidence)
+
+    start = parse_time_param('start')
+    if start is not None:
+        query = query.filter(Incident.timestamp >= start)
+    end = parse_time_param('end')
+    if end is not None:
+        query = query.filter(Incident.timestamp < end)
+
+    since = request.args.get('since')
+    if since:
+        try:
+            query = query.filter(Incident.id > int(since))
+        except ValueError:
+            raise ValueError(f"Invalid 'since': {since}")
+
+    return query.order_by(Incident.timestamp.desc(), Incident.id.desc())
+
 @app.route('/api/incident-logs', methods=['GET'])
 def get_incident_logs():
-    # Fetch from DB (descending order)
-    incidents = Incident.query.order_by(Incident.timestamp.desc()).all()
-    return jsonify([i.to_dict() for i in incidents])
+    # Newest first, one page at a time (keyset pagination on (timestamp, id))
+    try:
+        limit = min(max(int(request.args.get('limit', INCIDENT_PAGE_DEFAULT)), 1), INCIDENT_PAGE_MAX)
+        query = filtered_incident_query()
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor_time, cursor_id = decode_cursor(cursor)
+            query = query.filter(db.or_(
+                Incident.timestamp < cursor_time,
+                db.and_(Incident.timestamp == cursor_time, Incident.id < cursor_id)
+            ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch one extra row to know whether another page exists
+    incidents = query.limit(limit + 1).all()
+    has_more = len(incidents) > limit
+    incidents = incidents[:limit]
+
+    return jsonify({
+        "items": [i.to_dict() for i in incidents],
+        "next_cursor": encode_cursor(incidents[-1]) if has_more else None,
+        "latest_id": max((i.id for i in incidents), default=None)
+    })
+
+@app.route('/api/incident-stats', methods=['GET'])
+def get_incident_stats():
+    # Detections per minute/hour/day bucket by type and verdict, the confidence histogram and
+    # the most repeated targets, read from the rollup tables instead of the incident rows
+    try:
+        top = min(max(int(request.args.get('top', 10)), 0), 100)
+        start, end = parse_time_param('start'), parse_time_param('end')
+        with timing.stage("stats_query"):
+            stats = incident_stats.query(
+                db.session,
+                request.args.get('granularity', 'hour'),
+                start=start,
+                end=end,
+                types=[t for t in request.args.get('type', '').split(',') if t],
+                predictions=[p for p in request.args.get('prediction', '').split(',') if p],
+                top=top,
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(stats)
+
+INCIDENT_EXPORT_FIELDS = ["id", "type", "target", "prediction", "confidence", "timestamp"]
+
+@app.route('/api/incident-logs/export', methods=['GET'])
+def export_incident_logs():
+    """Streams every matching incident as NDJSON (default) or CSV without loading the table into memory."""
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        query = filtered_incident_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = query.yield_per(1000)
+
+    def generate_ndjson():
+        for incident in rows:
+            yield ndjson_line(incident.to_dict())
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=INCIDENT_EXPORT_FIELDS)
+        writer.writeheader()
+        for incident in rows:
+            writer.writerow(incident.to_dict())
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=incidents_{timestamp}.{export_format}"}
+    )
+
+@app.route('/api/explanations/<explanation_id>', methods=['GET'])
+def get_explanation(explanation_id):
+    entry = deferred_explanations.get(explanation_id)
+    if entry is None:
+        return jsonify({"error": "Unknown or expired explanation ID"}), 404
+    return jsonify(entry)
+
+@app.route('/api/ready', methods=['GET'])
+def get_readiness():
+    # Per-model load state; 503 until every model can serve
+    ready = model_registry.ready()
+    status = {"ready": ready, "models": model_registry.status()}
+    if model_registry.pool is not None:
+        status["workers"] = {"configured": model_registry.pool.workers, "ready": model_registry.pool.ready_workers()}
+    return jsonify(status), 200 if ready else 503
+
+@app.route('/api/inference-workers', methods=['GET'])
+def get_inference_workers():
+    # Per-worker state, cores, in-flight requests and restarts
+    if model_registry.pool is None:
+        return jsonify({"workers": 0, "ready": 0, "restarts": 0, "slots": []})
+    return jsonify(model_registry.pool.stats())
+
+def batcher_stats(name):
+    batcher = model_registry.handle(name).batcher
+    return batcher.stats() if batcher else None
+
+@app.route('/api/inference-stats', methods=['GET'])
+def get_inference_stats():
+    # Batch-size / queue-wait histograms for tuning the batching window
+    return jsonify({
+        "email": batcher_stats("email"),
+        "url": batcher_stats("url"),
+        "tokens": {
+            "real": model_utils.real_tokens.value,
+            "padding": model_utils.padding_tokens.value,
+        },
+        "result_cache": result_cache.stats(),
+        "url_prefilter": url_prefilter.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text exposition of every counter, gauge and histogram in this process
+    return Response(render_prometheus(registry), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/incident-sink', methods=['GET'])
+def get_incident_sink_stats():
+    # Queue depth and flush latency of the write-behind incident logger
+    return jsonify(incident_sink.stats())
+
+@app.route('/api/threat-feed/status', methods=['GET'])
+def get_threat_feed_status():
+    return jsonify(threat_intel.refresher.stats())
 
 @app.route('/api/threat-feed', methods=['GET'])
 def get_threat_feed():
+    # Newest feed rows first, filtered by threat/tag/status and paged with offset/limit.
+    # Pages are rendered once per feed version and revalidated with ETags, so polling is cheap.
     try:
-        threats = threat_intel.get_recent_threats(limit=50)
-        return jsonify(threats)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        query = page_query(
+            offset=request.args.get('offset', 0),
+            limit=request.args.get('limit'),
+            threat=request.args.get('threat'),
+            tag=request.args.get('tag'),
+            status=request.args.get('status'),
+        )
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+
+    feed = threat_intel.feed
+    etag = feed.etag(query)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(feed.page(query), mimetype='application/json', headers=headers)
+
+EVENT_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def requested_event_types(args):
+    """`?types=incidents,feed` narrows a stream; None subscribes to everything."""
+    return [t for t in args.get('types', '').split(',') if t] or None
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    # Server-Sent Events: `incidents` for each committed batch of incident rows and
+    # `feed` when the threat feed changes. Reconnects resume from Last-Event-ID.
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        subscription = event_hub.subscribe(last_event_id, requested_event_types(request.args))
+    except TooManySubscribers as e:
+        return jsonify({"error": str(e)}), 503
+
+    def generate():
+        try:
+            yield f"retry: {config.EVENT_RETRY_MS}\n\n".encode()
+            while not subscription.closed:
+                frames = subscription.wait(config.EVENT_HEARTBEAT_SECONDS)
+                if frames:
+                    yield b"".join(frames)
+                elif not subscription.closed:
+                    yield b": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+@app.route('/api/events/status', methods=['GET'])
+def get_event_stream_status():
+    return jsonify(event_hub.stats())
 
 
 
 if __name__ == '__main__':
+    # Turn SIGTERM into a normal exit so atexit drains the incident queue
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     app.run(debug=True, port=5000)
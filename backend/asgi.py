@@ -0,0 +1,291 @@
+"""
+ASGI entry point, for serving from an asyncio server instead of the Flask
+development server:
+
+    uvicorn asgi:application --port 5000
+
+POST /api/analyze/url and /api/analyze/email are served natively. The
+ThreatIntel DNS and TLS probes are awaited on the event loop, so a scan stuck
+on a TLS timeout holds a coroutine rather than a thread. The CPU-bound model
+work runs on a bounded executor (ASYNC_INFERENCE_THREADS).
+
+Admission is checked up front: once ASYNC_MAX_REQUESTS analyze requests are
+in flight, or ASYNC_MAX_PENDING_INFERENCE are queued for or running on the
+executor, new ones get a 429 with Retry-After instead of growing the queues.
+
+GET /api/events (live dashboard updates) is also native: an open stream waits
+on the event loop instead of holding a thread for as long as the dashboard
+stays open.
+
+Every other route is the Flask app, run through asgiref's WsgiToAsgi on its
+own thread pool (ASYNC_WSGI_THREADS).
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as flask_app
+import config
+import timing
+from event_hub import event_hub, TooManySubscribers
+from metrics import registry
+from threat_intel import threat_intel
+
+MAX_BODY_BYTES = 16 * 2 ** 20
+CORS_HEADERS = [(b"access-control-allow-origin", b"*"), (b"access-control-expose-headers", b"Server-Timing, ETag")]
+
+
+class Backpressure:
+    """Admission counters for the native routes. Only touched from the event loop, so no locking."""
+
+    def __init__(self, max_requests=None, max_pending_inference=None, inference_threads=None):
+        self.max_requests = max_requests or config.ASYNC_MAX_REQUESTS
+        self.max_pending_inference = max_pending_inference or config.ASYNC_MAX_PENDING_INFERENCE
+        self.executor = ThreadPoolExecutor(max_workers=inference_threads or config.ASYNC_INFERENCE_THREADS,
+                                           thread_name_prefix="asgi-inference")
+        self.requests = 0
+        self.pending_inference = 0
+        self.rejected = registry.counter("asgi_rejected_total", help_text="Analyze requests answered with 429.")
+        self.requests_gauge = registry.gauge("asgi_requests_in_flight", help_text="Native analyze requests in flight.")
+        self.inference_gauge = registry.gauge("asgi_pending_inference",
+                                              help_text="Requests queued for or running on the inference executor.")
+
+    def admit(self):
+        if self.requests >= self.max_requests or self.pending_inference >= self.max_pending_inference:
+            self.rejected.inc()
+            return False
+        self.requests += 1
+        self.requests_gauge.set(self.requests)
+        return True
+
+    def release(self):
+        self.requests -= 1
+        self.requests_gauge.set(self.requests)
+
+    async def run_inference(self, fn, *args):
+        """Runs `fn(*args)` on the inference executor, attributing its stage timings to this request."""
+        self.pending_inference += 1
+        self.inference_gauge.set(self.pending_inference)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, timing.propagate(fn), *args)
+        finally:
+            self.pending_inference -= 1
+            self.inference_gauge.set(self.pending_inference)
+
+    def stats(self):
+        return {
+            "requests_in_flight": self.requests,
+            "pending_inference": self.pending_inference,
+            "rejected": self.rejected.value,
+            "limits": {"requests": self.max_requests, "pending_inference": self.max_pending_inference},
+        }
+
+
+backpressure = Backpressure()
+
+
+# --- Native routes: (data, args) -> (status, payload) ---
+
+async def analyze_url(data, args):
+    url = data.get('url', '')
+    if not url:
+        return 400, {"error": "No URL provided"}
+    try:
+        explain_mode = flask_app.requested_explain_mode(data, args)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+    # 1. Threat Intelligence Check, probes awaited on the event loop
+    with timing.stage("threat_intel"):
+        ti_result = await threat_intel.check_url_async(url)
+
+    # 2-3. Model verdict and hybrid decision on the inference executor
+    return 200, await backpressure.run_inference(flask_app.analyze_url_with_intel, url, explain_mode, ti_result)
+
+
+async def analyze_email(data, args):
+    text = data.get('text', '')
+    if not text:
+        return 400, {"error": "No text provided"}
+    try:
+        explain_mode = flask_app.requested_explain_mode(data, args)
+        windowing = flask_app.requested_windowing(data)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    return 200, await backpressure.run_inference(flask_app.analyze_email_text, text, explain_mode, windowing)
+
+
+NATIVE_ROUTES = {
+    "/api/analyze/url": analyze_url,
+    "/api/analyze/email": analyze_email,
+}
+
+
+async def read_json(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    data = json.loads(b"".join(chunks) or b"{}")
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    return data
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    *CORS_HEADERS, *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def serve_native(handler, scope, receive, send):
+    endpoint = scope["path"]
+    if not backpressure.admit():
+        registry.counter("http_requests_total", {"endpoint": endpoint, "status": "429"},
+                         help_text="Responses sent.").inc()
+        await send_json(send, 429, {"error": "Server busy, retry later"},
+                        [(b"retry-after", str(config.ASYNC_RETRY_AFTER_SECONDS).encode())])
+        return
+
+    token = timing.begin(handler.__name__)
+    try:
+        args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        try:
+            data = await read_json(receive)
+        except ValueError as e:
+            data, status, payload = {}, 400, {"error": str(e)}
+        else:
+            if data is None:
+                return  # client went away
+            try:
+                status, payload = await handler(data, args)
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+
+        trace = timing.current()
+        if status == 200 and flask_app.wants_timings(data, args):
+            payload["timings"] = trace.as_dict()
+        headers = []
+        if config.SERVER_TIMING_HEADER and trace.stages:
+            headers.append((b"server-timing", trace.server_timing().encode()))
+        registry.histogram("http_request_duration_ms", {"endpoint": endpoint},
+                           help_text="Time to produce a response (streamed bodies excluded).").observe(trace.elapsed_ms())
+        registry.counter("http_requests_total", {"endpoint": endpoint, "status": str(status)},
+                         help_text="Responses sent.").inc()
+        await send_json(send, status, payload, headers)
+    finally:
+        backpressure.release()
+        timing.end(token)
+
+
+# --- Live events ---
+
+async def stream_events(scope, receive, send):
+    """The Flask /api/events stream, waiting on the event loop."""
+    args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    last_event_id = dict(scope["headers"]).get(b"last-event-id", b"").decode("latin-1") or args.get("last_event_id")
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    try:
+        subscription = event_hub.subscribe(last_event_id, flask_app.requested_event_types(args),
+                                           wakeup=lambda: loop.call_soon_threadsafe(ready.set))
+    except TooManySubscribers as e:
+        await send_json(send, 503, {"error": str(e)})
+        return
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        *[(k.lower().encode(), v.encode()) for k, v in flask_app.EVENT_STREAM_HEADERS.items()],
+                        *CORS_HEADERS],
+        })
+        await send({"type": "http.response.body", "body": f"retry: {config.EVENT_RETRY_MS}\n\n".encode(),
+                    "more_body": True})
+        while not subscription.closed:
+            ready.clear()
+            frames = subscription.drain()
+            if frames:
+                await send({"type": "http.response.body", "body": b"".join(frames), "more_body": True})
+                continue
+            waiter = asyncio.ensure_future(ready.wait())
+            done, _ = await asyncio.wait({waiter, disconnected}, timeout=config.EVENT_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if disconnected in done:
+                return
+            if not done:
+                await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+STREAM_ROUTES = {
+    "/api/events": stream_events,
+}
+
+
+# --- Everything else: the Flask app ---
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # WsgiToAsgi runs every request on one shared thread (thread_sensitive);
+    # the Flask handlers are thread-safe, so give them a pool instead.
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False,
+        executor=ThreadPoolExecutor(max_workers=config.ASYNC_WSGI_THREADS, thread_name_prefix="asgi-wsgi"))
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_fallback = ThreadedWsgiToAsgi(flask_app.app)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Queued incidents and CERT reports are drained by the app's atexit handlers
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in NATIVE_ROUTES:
+        await serve_native(NATIVE_ROUTES[scope["path"]], scope, receive, send)
+    elif scope["type"] == "http" and scope["method"] == "GET" and scope["path"] in STREAM_ROUTES:
+        await STREAM_ROUTES[scope["path"]](scope, receive, send)
+    else:
+        await wsgi_fallback(scope, receive, send)
@@ -0,0 +1,484 @@
+"""Latency and throughput benchmark for the analysis pipeline.
+
+    python benchmark.py --output bench/HEAD.json
+    python benchmark.py --stages predict,endpoints --emails 500 --email-words 300
+    python benchmark.py --output bench/new.json --compare bench/HEAD.json
+
+Corpora are synthetic and seeded, so two runs with the same arguments score
+the same texts on any machine. Stages (all by default):
+  tokenize      - model_utils.encode, one text at a time.
+  predict       - model_utils.predict, one text at a time.
+  predict_batch - model_utils.predict_batch in --batch-size chunks (throughput).
+  explain       - model_utils.explain_prediction in --explain-mode.
+  prefilter     - the lexical URL prefilter, one URL and --batch-size URLs per
+                  call, plus the share of URLs its thresholds settle (skipped
+                  without trained weights).
+  check_url     - ThreatIntel.check_url with DNS and TLS stubbed out locally.
+  endpoints     - POST /api/analyze/email and /api/analyze/url through the
+                  Flask test client, with --concurrency client threads.
+
+Each stage reports p50/p95/p99/mean/max latency, throughput and process RSS;
+the report also carries peak RSS and run metadata (git commit, versions,
+configuration). With --compare, p50/p95/p99 and throughput are diffed against
+an earlier report, and --fail-on-regression exits 1 past --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BACKEND_DIR)
+STAGES = ("tokenize", "predict", "predict_batch", "explain", "prefilter", "check_url", "endpoints")
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s")
+
+# --- Synthetic corpora ---
+
+_WORDS = (
+    "the report meeting please find attached quarterly invoice team schedule update project review "
+    "budget customer support office friday monday policy document thanks regards call notes agenda "
+    "shipment order delivery account payment statement reference request feedback training access"
+).split()
+_LURES = (
+    "urgent verify your account password suspended click here immediately confirm login security "
+    "alert winner prize claim gift card limited offer bank transfer wire unusual activity reset"
+).split()
+_TLDS = ("com", "net", "org", "io", "info", "xyz", "co.uk", "ru", "top")
+_URL_WORDS = ("login", "secure", "account", "update", "verify", "paypal", "bank", "mail", "cloud",
+              "shop", "news", "portal", "service", "support", "docs", "app", "static", "cdn")
+
+
+def synthetic_urls(count, max_segments, seed):
+    """`count` URLs mixing plain sites with lure-style hosts, paths of 0..max_segments segments."""
+    rng = random.Random(seed)
+    urls = []
+    for i in range(count):
+        host = "-".join(rng.sample(_URL_WORDS, rng.randint(1, 3))) + f"{i}." + rng.choice(_TLDS)
+        if rng.random() < 0.4:
+            host = rng.choice(("www", "m", "secure", "login")) + "." + host
+        path = "/".join(rng.choice(_URL_WORDS) for _ in range(rng.randint(0, max_segments)))
+        url = f"{rng.choice(('http', 'https'))}://{host}/{path}"
+        if rng.random() < 0.3:
+            url += f"?session={rng.getrandbits(32):08x}"
+        urls.append(url)
+    return urls
+
+
+def synthetic_emails(count, median_words, sigma, seed):
+    """`count` emails whose word counts are log-normal around `median_words` (spread `sigma`);
+    about a third are salted with phishing vocabulary."""
+    rng = random.Random(seed)
+    emails = []
+    for _ in range(count):
+        words = max(3, min(20000, int(rng.lognormvariate(np.log(median_words), sigma))))
+        lure = rng.random() < 0.33
+        body = [rng.choice(_LURES) if lure and rng.random() < 0.2 else rng.choice(_WORDS) for _ in range(words)]
+        emails.append(" ".join(body).capitalize() + ".")
+    return emails
+
+
+# --- Measurement ---
+
+def current_rss_mb():
+    """Resident set size now, from /proc (None where unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def summarize(latencies_ms, wall_seconds, items, errors=0):
+    latencies = np.asarray(latencies_ms, dtype=float)
+    summary = {"count": len(latencies_ms), "items": items, "errors": errors, "wall_s": round(wall_seconds, 3),
+               "throughput_per_s": round(items / wall_seconds, 2) if wall_seconds > 0 else None,
+               "rss_mb": _round(current_rss_mb()), "peak_rss_mb": _round(peak_rss_mb())}
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        summary.update(p50_ms=_round(p50), p95_ms=_round(p95), p99_ms=_round(p99),
+                       mean_ms=_round(latencies.mean()), max_ms=_round(latencies.max()))
+    return summary
+
+
+def _round(value):
+    return None if value is None else round(float(value), 3)
+
+
+def timed_calls(fn, inputs, concurrency=1):
+    """Calls fn(x) for each input and returns (latencies_ms, wall_seconds, errors)."""
+    latencies, errors = [], []
+
+    def call(x):
+        started = time.perf_counter()
+        try:
+            fn(x)
+        except Exception as e:
+            errors.append(e)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, inputs))
+    else:
+        for x in inputs:
+            call(x)
+    wall = time.perf_counter() - started
+    if errors:
+        print(f"  {len(errors)} call(s) failed, first: {type(errors[0]).__name__}: {errors[0]}", file=sys.stderr)
+    return latencies, wall, len(errors)
+
+
+# --- Stubbed forensics ---
+
+class _StubRecord:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def to_text(self):
+        return self.ip
+
+
+class _StubAnswer(list):
+    def __init__(self, ip, ttl):
+        super().__init__([_StubRecord(ip)])
+        self.rrset = type("RRset", (), {"ttl": ttl})()
+
+
+class StubResolver:
+    """Stands in for dns.resolver.Resolver: sleeps `latency_ms`, answers every
+    name except those in `nxdomain_fraction` of hosts (chosen by hash)."""
+
+    def __init__(self, latency_ms, nxdomain_fraction=0.2, ttl=300):
+        self.latency = latency_ms / 1000.0
+        self.nxdomain_fraction = nxdomain_fraction
+        self.ttl = ttl
+
+    def resolve(self, domain, rdtype="A", lifetime=None):
+        time.sleep(self.latency)
+        return self._answer(domain)
+
+    def _answer(self, domain):
+        import dns.resolver
+        digest = zlib.crc32(domain.encode())
+        if (digest & 0xFFFF) / 0xFFFF < self.nxdomain_fraction:
+            raise dns.resolver.NXDOMAIN()
+        return _StubAnswer("203.0.113.%d" % (digest >> 24), self.ttl)
+
+
+class AsyncStubResolver(StubResolver):
+    """StubResolver for ThreatIntel.check_dns_async: awaits the latency instead of sleeping."""
+
+    async def resolve(self, domain, rdtype="A", lifetime=None):
+        await asyncio.sleep(self.latency)
+        return self._answer(domain)
+
+
+def _stub_certificate(domain):
+    return {"valid": True, "issuer": "Benchmark CA", "subject": domain, "expiry": "Jan  1 00:00:00 2030 GMT"}
+
+
+def stub_certificate_fetch(latency_ms):
+    """Replacement for ThreatIntel._fetch_certificate that sleeps instead of handshaking."""
+    def fetch(domain):
+        time.sleep(latency_ms / 1000.0)
+        return _stub_certificate(domain)
+    return fetch
+
+
+def stub_certificate_fetch_async(latency_ms):
+    """Replacement for ThreatIntel._fetch_certificate_async."""
+    async def fetch(domain):
+        await asyncio.sleep(latency_ms / 1000.0)
+        return _stub_certificate(domain)
+    return fetch
+
+
+def stub_forensics(intel, args):
+    intel.resolver = StubResolver(args.dns_ms)
+    intel.async_resolver = AsyncStubResolver(args.dns_ms)
+    intel._fetch_certificate = stub_certificate_fetch(args.tls_ms)
+    intel._fetch_certificate_async = stub_certificate_fetch_async(args.tls_ms)
+    return intel
+
+
+# --- Stages ---
+
+def load_models(args):
+    import model_utils
+    models = {}
+    for name, path in (("email", args.email_model), ("url", args.url_model)):
+        model, tokenizer = model_utils.load_model(path)
+        if model is None:
+            raise SystemExit(f"Could not load the {name} model from {path}")
+        models[name] = (model, tokenizer)
+    return models
+
+
+def stage_tokenize(args, corpora, models):
+    import model_utils
+    report = {}
+    for name, texts in corpora.items():
+        tokenizer = models[name][1]
+        latencies, wall, errors = timed_calls(lambda t: model_utils.encode_one(t, tokenizer), texts)
+        report[name] = summarize(latencies, wall, len(texts), errors)
+    return report
+
+
+def stage_predict(args, corpora, models):
+    import model_utils
+    report = {}
+    for name, texts in corpora.items():
+        model, tokenizer = models[name]
+        model_utils.predict(texts[0], model, tokenizer)  # warm-up
+        latencies, wall, errors = timed_calls(lambda t: model_utils.predict(t, model, tokenizer), texts)
+        report[name] = summarize(latencies, wall, len(texts), errors)
+    return report
+
+
+def stage_predict_batch(args, corpora, models):
+    import model_utils
+    report = {}
+    for name, texts in corpora.items():
+        model, tokenizer = models[name]
+        chunks = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+        latencies, wall, errors = timed_calls(lambda c: model_utils.predict_batch(c, model, tokenizer), chunks)
+        report[name] = summarize(latencies, wall, len(texts), errors)
+        report[name]["batch_size"] = args.batch_size
+    return report
+
+
+def stage_explain(args, corpora, models):
+    import model_utils
+    report = {}
+    for name, texts in corpora.items():
+        model, tokenizer = models[name]
+        sample = texts[:args.explain_samples]
+        latencies, wall, errors = timed_calls(
+            lambda t: model_utils.explain_prediction(t, model, tokenizer, mode=args.explain_mode), sample)
+        report[name] = summarize(latencies, wall, len(sample), errors)
+        report[name]["mode"] = args.explain_mode
+    return report
+
+
+def stage_prefilter(args, corpora, models):
+    from url_prefilter import URLPrefilter
+    prefilter = URLPrefilter(mode="cascade", audit_rate=0.0)
+    if not prefilter.enabled:
+        print(f"Skipping prefilter: {prefilter.error}", file=sys.stderr)
+        return {}
+    urls = corpora["url"]
+    model = prefilter.model
+    report = {}
+    latencies, wall, errors = timed_calls(lambda u: model.scores([u]), urls)
+    report["single"] = summarize(latencies, wall, len(urls), errors)
+    chunks = [urls[i:i + args.batch_size] for i in range(0, len(urls), args.batch_size)]
+    latencies, wall, errors = timed_calls(model.scores, chunks)
+    report["batch"] = summarize(latencies, wall, len(urls), errors)
+    report["batch"]["batch_size"] = args.batch_size
+    plan = prefilter.plan(urls)
+    report["batch"]["settled_fraction"] = _round(sum(1 for _, escalate in plan if not escalate) / len(urls))
+    return report
+
+
+def stage_check_url(args, corpora, models):
+    from threat_intel import ThreatIntel
+    intel = stub_forensics(ThreatIntel(load_feed=False, snapshot_path=""), args)
+    intel.load_local_cache()
+    urls = corpora["url"]
+    report = {}
+    latencies, wall, errors = timed_calls(intel.check_url, urls, concurrency=args.concurrency)
+    report["cold"] = summarize(latencies, wall, len(urls), errors)
+    # Second pass hits the DNS/TLS caches
+    latencies, wall, errors = timed_calls(intel.check_url, urls, concurrency=args.concurrency)
+    report["warm"] = summarize(latencies, wall, len(urls), errors)
+    return report
+
+
+def stage_endpoints(args, corpora, models):
+    import app as app_module
+    stub_forensics(app_module.threat_intel, args)
+    app_module.model_registry.get("email")
+    app_module.model_registry.get("url")
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = app_module.app.test_client()
+        return local.client
+
+    def post(path, body):
+        response = client().post(path, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    requests = {
+        "email": ("/api/analyze/email", [{"text": t, "explain": args.endpoint_explain} for t in corpora["email"]]),
+        "url": ("/api/analyze/url", [{"url": u, "explain": args.endpoint_explain} for u in corpora["url"]]),
+    }
+    report = {}
+    for name, (path, bodies) in requests.items():
+        post(path, dict(bodies[0], **{"text" if name == "email" else "url": "benchmark warm-up"}))
+        latencies, wall, errors = timed_calls(lambda b: post(path, b), bodies, concurrency=args.concurrency)
+        report[name] = summarize(latencies, wall, len(bodies), errors)
+        report[name].update(concurrency=args.concurrency, explain=args.endpoint_explain)
+    app_module.incident_sink.shutdown()
+    return report
+
+
+STAGE_RUNNERS = {
+    "tokenize": stage_tokenize,
+    "predict": stage_predict,
+    "predict_batch": stage_predict_batch,
+    "explain": stage_explain,
+    "prefilter": stage_prefilter,
+    "check_url": stage_check_url,
+    "endpoints": stage_endpoints,
+}
+
+
+# --- Report ---
+
+def run_metadata(args):
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=BACKEND_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import config
+    import torch
+    import transformers
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git("rev-parse", "HEAD"),
+        "git_dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "inference_backend": config.INFERENCE_BACKEND,
+        "inference_workers": config.INFERENCE_WORKERS,
+        "args": vars(args),
+    }
+
+
+def compare(report, baseline, threshold):
+    """Prints the relative change of COMPARED_METRICS per stage; returns the regressions."""
+    print(f"\nCompared with {baseline['meta'].get('git_commit') or 'baseline'} "
+          f"({baseline['meta'].get('timestamp')}):")
+    regressions = []
+    for stage, groups in report["stages"].items():
+        for group, summary in groups.items():
+            old = baseline.get("stages", {}).get(stage, {}).get(group)
+            if not old:
+                continue
+            cells = []
+            for metric in COMPARED_METRICS:
+                before, after = old.get(metric), summary.get(metric)
+                if not before or after is None:
+                    continue
+                change = (after - before) / before
+                # Latency regresses upwards, throughput downwards
+                worse = change < -threshold if metric == "throughput_per_s" else change > threshold
+                if worse:
+                    regressions.append(f"{stage}.{group}.{metric}")
+                cells.append(f"{metric} {before:.2f} -> {after:.2f} ({change:+.1%}){' !' if worse else ''}")
+            print(f"  {stage}.{group}: " + ", ".join(cells))
+    if regressions:
+        print(f"Regressions beyond {threshold:.0%}: {', '.join(regressions)}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--seed", type=int, default=1337)
+    parser.add_argument("--urls", type=int, default=200, help="URLs in the corpus")
+    parser.add_argument("--url-max-segments", type=int, default=6, help="longest URL path, in segments")
+    parser.add_argument("--emails", type=int, default=100, help="emails in the corpus")
+    parser.add_argument("--email-words", type=int, default=120, help="median email length in words")
+    parser.add_argument("--email-sigma", type=float, default=0.8, help="spread of the log-normal email length")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--explain-mode", default="fast")
+    parser.add_argument("--explain-samples", type=int, default=20)
+    parser.add_argument("--endpoint-explain", default="none", help="explain mode sent to the endpoints")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads for check_url and endpoints")
+    parser.add_argument("--dns-ms", type=float, default=20.0, help="simulated DNS lookup latency")
+    parser.add_argument("--tls-ms", type=float, default=60.0, help="simulated TLS handshake latency")
+    parser.add_argument("--email-model", default=os.path.join(PROJECT_ROOT, "email"))
+    parser.add_argument("--url-model", default=os.path.join(PROJECT_ROOT, "url"))
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    # Keep the app from touching the network, the real incident log or the real feed
+    # snapshot while benchmarking: the feed is never fetched and any snapshot is scratch
+    scratch = tempfile.mkdtemp(prefix="cerebro-bench-")
+    os.environ.setdefault("CEREBRO_DATABASE_PATH", os.path.join(scratch, "incident_logs.db"))
+    os.environ.setdefault("CEREBRO_FEED_REFRESH_SECONDS", "-1")
+    os.environ.setdefault("CEREBRO_FEED_SNAPSHOT_PATH", os.path.join(scratch, "urlhaus_snapshot.bin"))
+    os.environ.setdefault("CEREBRO_MODEL_WARMUP", "lazy")
+    sys.path.insert(0, BACKEND_DIR)
+
+    corpora = {
+        "email": synthetic_emails(args.emails, args.email_words, args.email_sigma, args.seed),
+        "url": synthetic_urls(args.urls, args.url_max_segments, args.seed),
+    }
+    models = load_models(args) if set(stages) - {"prefilter", "check_url", "endpoints"} else None
+
+    report = {"meta": run_metadata(args), "stages": {}}
+    for stage in stages:
+        print(f"Running {stage}...", file=sys.stderr)
+        report["stages"][stage] = STAGE_RUNNERS[stage](args, corpora, models)
+    report["peak_rss_mb"] = _round(peak_rss_mb())
+
+    print(json.dumps(report["stages"], indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
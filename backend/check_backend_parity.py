@@ -0,0 +1,63 @@
+"""Compares an inference backend against the fp32 model before enabling it.
+
+    python check_backend_parity.py --model url --backend int8
+    python check_backend_parity.py --model email --backend onnx --input samples.txt
+
+Texts come from --input (one per line, or a CSV column with --column) and
+default to the built-in probes. Exits non-zero if the backend changes any
+verdict (or exceeds --max-logit-diff).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+import config
+import inference_backends
+import model_utils
+
+
+def read_texts(path, column=None, limit=None):
+    with open(path, newline='', encoding='utf-8', errors='ignore') as f:
+        if column:
+            texts = [row[column] for row in csv.DictReader(f) if row.get(column)]
+        else:
+            texts = [line.rstrip("\n") for line in f if line.strip()]
+    return texts[:limit] if limit else texts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="url", help="'email', 'url' or a model directory")
+    parser.add_argument("--backend", default=config.INFERENCE_BACKEND, choices=inference_backends.INFERENCE_BACKENDS)
+    parser.add_argument("--input", help="text file (one sample per line) or CSV with --column")
+    parser.add_argument("--column", help="CSV column holding the text")
+    parser.add_argument("--limit", type=int, help="only check the first N samples")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-logit-diff", type=float, default=0.0, help="fail above this drift (0 = verdicts only)")
+    args = parser.parse_args(argv)
+
+    model_path = args.model
+    if args.model in ("email", "url"):
+        model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), args.model)
+
+    inference_backends.configure_threads()
+    model, tokenizer = model_utils.load_model(model_path)
+    if not model:
+        return 2
+
+    texts = read_texts(args.input, args.column, args.limit) if args.input else list(inference_backends.PARITY_PROBES)
+    backend = inference_backends.build_backend(
+        args.backend, model, tokenizer, model_path, model_utils.model_fingerprint(model_path))
+    report = inference_backends.check_parity(model, backend, tokenizer, texts, batch_size=args.batch_size)
+    report["disagreements"] = [{"index": i, "text": texts[i][:200]} for i in report["disagreements"]]
+    print(json.dumps(report, indent=2))
+
+    failed = report["verdict_agreement"] < 1.0 or (
+        args.max_logit_diff > 0 and report["max_logit_diff"] > args.max_logit_diff)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
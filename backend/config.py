@@ -0,0 +1,246 @@
+"""Runtime tuning knobs for the CEREBRO backend.
+
+Every setting can be overridden with an environment variable named
+``CEREBRO_<SETTING>`` (e.g. ``CEREBRO_BATCH_MAX_SIZE=32``).
+"""
+import os
+
+_PREFIX = "CEREBRO_"
+
+
+def _env(name, default, cast):
+    raw = os.environ.get(_PREFIX + name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return cast(raw)
+    except ValueError:
+        print(f"Warning: invalid value {raw!r} for {_PREFIX + name}, using {default!r}")
+        return default
+
+
+def _bool(raw):
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+# --- Micro-batching (model_utils.BatchScheduler) ---
+# Largest number of queued requests merged into one forward pass.
+BATCH_MAX_SIZE = _env("BATCH_MAX_SIZE", 16, int)
+# How long the first request of a batch may wait for company, in milliseconds.
+BATCH_MAX_WAIT_MS = _env("BATCH_MAX_WAIT_MS", 5.0, float)
+# Upper bounds (in tokens) of the length buckets; requests in different buckets
+# are never padded into the same forward pass.
+BATCH_LENGTH_BUCKETS = _env(
+    "BATCH_LENGTH_BUCKETS", (32, 64, 128, 256, 512), lambda raw: tuple(sorted(int(b) for b in raw.split(","))))
+
+# --- Model loading (model_registry.ModelRegistry) ---
+# eager: load before serving; background: load concurrently while serving; lazy: load on first request.
+MODEL_WARMUP = _env("MODEL_WARMUP", "background", str)
+# Back CPU model weights with a copy-on-write mmap of model.safetensors, so processes share them.
+MODEL_MMAP_WEIGHTS = _env("MODEL_MMAP_WEIGHTS", True, _bool)
+
+# --- Worker processes (worker_pool.InferenceWorkerPool) ---
+# Inference worker processes; 0 runs inference inside the web process.
+INFERENCE_WORKERS = _env("INFERENCE_WORKERS", 0, int)
+# Pin each worker to its own contiguous slice of the available CPUs.
+WORKER_PIN_CORES = _env("WORKER_PIN_CORES", True, _bool)
+# Seconds between checks for exited workers, which are then restarted.
+WORKER_HEALTH_INTERVAL_SECONDS = _env("WORKER_HEALTH_INTERVAL_SECONDS", 2.0, float)
+# Seconds a worker has to answer a request. A worker with an overdue request is treated as
+# hung: its requests fail with WorkerTimeout and it is killed and restarted.
+WORKER_REQUEST_TIMEOUT_SECONDS = _env("WORKER_REQUEST_TIMEOUT_SECONDS", 60.0, float)
+
+# --- Inference backend (inference_backends.create_backend) ---
+# eager (fp32 PyTorch), int8 (dynamic quantization), torchscript, compile or onnx.
+INFERENCE_BACKEND = _env("INFERENCE_BACKEND", "eager", str)
+# PyTorch / ONNX Runtime thread pools; 0 keeps the library default.
+INTRA_OP_THREADS = _env("INTRA_OP_THREADS", 0, int)
+INTER_OP_THREADS = _env("INTER_OP_THREADS", 0, int)
+# Where exported graphs are cached; empty uses a `<model>.compiled/` directory next to each model.
+INFERENCE_CACHE_DIR = _env("INFERENCE_CACHE_DIR", "", str)
+# Startup parity check against fp32: minimum verdict agreement on the probe texts,
+# and optional maximum absolute logit difference (0 disables that check).
+INFERENCE_PARITY_MIN_AGREEMENT = _env("INFERENCE_PARITY_MIN_AGREEMENT", 1.0, float)
+INFERENCE_PARITY_MAX_LOGIT_DIFF = _env("INFERENCE_PARITY_MAX_LOGIT_DIFF", 0.0, float)
+
+# --- Long emails (model_utils.encode_windows / classify_windows) ---
+# window: classify emails longer than the model limit in overlapping windows; truncate: old behaviour.
+EMAIL_LONG_TEXT_MODE = _env("EMAIL_LONG_TEXT_MODE", "window", str)
+# Tokens shared by consecutive windows.
+WINDOW_OVERLAP_TOKENS = _env("WINDOW_OVERLAP_TOKENS", 128, int)
+# Windows beyond this many are ignored (the tail of very long texts is still truncated).
+WINDOW_MAX_WINDOWS = _env("WINDOW_MAX_WINDOWS", 16, int)
+# How window verdicts are combined: max, mean or attention.
+WINDOW_AGGREGATION = _env("WINDOW_AGGREGATION", "max", str)
+# Stop evaluating windows once one reaches this positive-class probability (0 evaluates all).
+WINDOW_EARLY_STOP_CONFIDENCE = _env("WINDOW_EARLY_STOP_CONFIDENCE", 0.95, float)
+# Windows submitted per step of the lazy evaluation.
+WINDOW_CHUNK_SIZE = _env("WINDOW_CHUNK_SIZE", 4, int)
+
+# --- URL prefilter (url_prefilter.URLPrefilter) ---
+# off: every URL goes to the transformer; cascade: confident prefilter verdicts are served
+# directly; shadow: the transformer serves everything and the prefilter is only measured.
+URL_PREFILTER_MODE = _env("URL_PREFILTER_MODE", "cascade", str)
+# Weights written by train_url_prefilter.py; empty means url/prefilter.npz.
+URL_PREFILTER_PATH = _env("URL_PREFILTER_PATH", "", str)
+# P(phishing) at or below which a URL is settled as safe / at or above which it is settled as
+# phishing. Empty uses the thresholds picked on held-out data at training time.
+URL_PREFILTER_SAFE_THRESHOLD = _env("URL_PREFILTER_SAFE_THRESHOLD", None, float)
+URL_PREFILTER_PHISHING_THRESHOLD = _env("URL_PREFILTER_PHISHING_THRESHOLD", None, float)
+# Fraction of settled URLs also sent to the transformer to measure disagreement.
+URL_PREFILTER_AUDIT_RATE = _env("URL_PREFILTER_AUDIT_RATE", 0.02, float)
+
+# --- Async serving (asgi.py) ---
+# Analyze requests in flight at once (including those awaiting DNS/TLS probes); more get a 429.
+ASYNC_MAX_REQUESTS = _env("ASYNC_MAX_REQUESTS", 512, int)
+# Requests queued for or running inference on the executor; new analyze requests get a 429 beyond it.
+ASYNC_MAX_PENDING_INFERENCE = _env("ASYNC_MAX_PENDING_INFERENCE", 64, int)
+# Threads running CPU-bound inference (tokenization, batching, explanations) off the event loop.
+ASYNC_INFERENCE_THREADS = _env("ASYNC_INFERENCE_THREADS", 8, int)
+# Retry-After sent with a 429, in seconds.
+ASYNC_RETRY_AFTER_SECONDS = _env("ASYNC_RETRY_AFTER_SECONDS", 1, int)
+# Threads serving the remaining (Flask) routes under the ASGI server.
+ASYNC_WSGI_THREADS = _env("ASYNC_WSGI_THREADS", 32, int)
+
+# --- Bulk analysis (/api/analyze/<kind>/batch) ---
+# Maximum number of items accepted in a single bulk call.
+BULK_MAX_ITEMS = _env("BULK_MAX_ITEMS", 10000, int)
+# Items per padded forward pass in bulk mode.
+BULK_INFERENCE_BATCH = _env("BULK_INFERENCE_BATCH", 32, int)
+# Concurrent ThreatIntel.check_url lookups during a bulk URL scan.
+BULK_INTEL_WORKERS = _env("BULK_INTEL_WORKERS", 16, int)
+
+# --- Explanations (model_utils.explain_prediction) ---
+# Mode used when a request does not ask for one: none, gradient, fast, full or deferred.
+EXPLAIN_DEFAULT_MODE = _env("EXPLAIN_DEFAULT_MODE", "full", str)
+# Mode the background worker uses for deferred explanations.
+EXPLAIN_DEFERRED_MODE = _env("EXPLAIN_DEFERRED_MODE", "full", str)
+# Integrated Gradients step counts for the full and fast modes.
+EXPLAIN_FULL_STEPS = _env("EXPLAIN_FULL_STEPS", 50, int)
+EXPLAIN_FAST_STEPS = _env("EXPLAIN_FAST_STEPS", 8, int)
+# Interpolation steps evaluated per forward/backward pass in fast mode.
+EXPLAIN_INTERNAL_BATCH_SIZE = _env("EXPLAIN_INTERNAL_BATCH_SIZE", 8, int)
+# Background threads computing deferred explanations.
+EXPLAIN_WORKERS = _env("EXPLAIN_WORKERS", 1, int)
+# Finished deferred explanations kept for retrieval.
+EXPLAIN_MAX_STORED = _env("EXPLAIN_MAX_STORED", 1000, int)
+# Deferred explanations waiting for or being computed; beyond it requests get none (status "busy").
+EXPLAIN_MAX_PENDING = _env("EXPLAIN_MAX_PENDING", 64, int)
+
+# --- Result cache (result_cache.ResultCache) ---
+# Memory budget for cached predictions/attributions in MB (0 disables the memory tier).
+RESULT_CACHE_MAX_MB = _env("RESULT_CACHE_MAX_MB", 64.0, float)
+# Seconds before a cached result expires.
+RESULT_CACHE_TTL_SECONDS = _env("RESULT_CACHE_TTL_SECONDS", 3600.0, float)
+# SQLite file for the on-disk tier; empty disables it.
+RESULT_CACHE_DISK_PATH = _env("RESULT_CACHE_DISK_PATH", "", str)
+
+# --- Threat intelligence (threat_intel.ThreatIntel) ---
+# Optional file with one blocklisted domain per line; subdomains match too.
+DOMAIN_BLOCKLIST_PATH = _env("DOMAIN_BLOCKLIST_PATH", "", str)
+
+# --- Forensics (ThreatIntel.run_forensics) ---
+# Threads shared by all DNS/TLS probes.
+FORENSICS_WORKERS = _env("FORENSICS_WORKERS", 32, int)
+# Per-probe deadlines; a probe that misses its deadline finishes in the background.
+DNS_DEADLINE_SECONDS = _env("DNS_DEADLINE_SECONDS", 2.0, float)
+TLS_DEADLINE_SECONDS = _env("TLS_DEADLINE_SECONDS", 3.0, float)
+# Timeouts of the underlying resolver query and TCP connect.
+DNS_TIMEOUT_SECONDS = _env("DNS_TIMEOUT_SECONDS", 5.0, float)
+TLS_TIMEOUT_SECONDS = _env("TLS_TIMEOUT_SECONDS", 3.0, float)
+# DNS answers are cached for their record TTL, clamped to this range.
+DNS_MIN_TTL_SECONDS = _env("DNS_MIN_TTL_SECONDS", 30, int)
+DNS_MAX_TTL_SECONDS = _env("DNS_MAX_TTL_SECONDS", 3600, int)
+# How long NXDOMAIN answers are negatively cached.
+DNS_NEGATIVE_TTL_SECONDS = _env("DNS_NEGATIVE_TTL_SECONDS", 300, int)
+# How long certificate details (and handshake failures) are cached.
+TLS_CACHE_TTL_SECONDS = _env("TLS_CACHE_TTL_SECONDS", 3600, int)
+TLS_FAILURE_CACHE_TTL_SECONDS = _env("TLS_FAILURE_CACHE_TTL_SECONDS", 60, int)
+# Maximum domains kept in each forensics cache.
+FORENSICS_CACHE_ENTRIES = _env("FORENSICS_CACHE_ENTRIES", 10000, int)
+# Forensics for allowlist/blocklist/URLHaus hits: run, skip or defer (warm the cache in the background).
+FORENSICS_ON_LIST_HIT = _env("FORENSICS_ON_LIST_HIT", "run", str)
+
+# --- Threat feed refresh (feed_refresher.FeedRefresher) ---
+FEED_URL = _env("FEED_URL", "https://urlhaus.abuse.ch/downloads/csv_recent/", str)
+# Seconds between conditional polls of the feed (0 fetches once at startup, negative never fetches).
+FEED_REFRESH_SECONDS = _env("FEED_REFRESH_SECONDS", 300, int)
+FEED_FETCH_TIMEOUT_SECONDS = _env("FEED_FETCH_TIMEOUT_SECONDS", 10.0, float)
+# A refresh that would remove more than this share of the current indicators is rejected
+# as a truncated or broken download (1 disables the check). Empty feeds are always rejected.
+FEED_MAX_REMOVED_FRACTION = _env("FEED_MAX_REMOVED_FRACTION", 0.5, float)
+# The removal check only applies when the loaded index came from this feed URL, and a feed
+# rejected for it this many times in a row with identical content is then accepted.
+FEED_REJECT_CONFIRMATIONS = _env("FEED_REJECT_CONFIRMATIONS", 3, int)
+# Memory-mappable index snapshot loaded at startup; empty disables persistence.
+FEED_SNAPSHOT_PATH = _env(
+    "FEED_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "urlhaus_snapshot.bin"), str)
+
+# --- Threat feed API (feed_table.FeedTable) ---
+# Rows per /api/threat-feed page by default, and the largest page a client may request.
+THREAT_FEED_PAGE_SIZE = _env("THREAT_FEED_PAGE_SIZE", 50, int)
+THREAT_FEED_MAX_PAGE_SIZE = _env("THREAT_FEED_MAX_PAGE_SIZE", 500, int)
+# Rendered pages kept per feed version (distinct filter/offset combinations).
+THREAT_FEED_PAGE_CACHE_ENTRIES = _env("THREAT_FEED_PAGE_CACHE_ENTRIES", 256, int)
+
+# --- Incident logging (incident_sink.IncidentSink) ---
+# SQLite database holding the incident log.
+DATABASE_PATH = _env(
+    "DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "incident_logs.db"), str)
+# Rows committed per transaction at most.
+INCIDENT_FLUSH_BATCH_SIZE = _env("INCIDENT_FLUSH_BATCH_SIZE", 200, int)
+# Longest time a queued incident waits before its batch is committed, in milliseconds.
+INCIDENT_FLUSH_INTERVAL_MS = _env("INCIDENT_FLUSH_INTERVAL_MS", 250.0, float)
+# Queue capacity; producers block when it is full.
+INCIDENT_QUEUE_MAX = _env("INCIDENT_QUEUE_MAX", 10000, int)
+# Attempts at a batch whose commit failed before its rows are dropped, and the delay
+# before the first retry in milliseconds (doubled for each further one).
+INCIDENT_FLUSH_RETRIES = _env("INCIDENT_FLUSH_RETRIES", 3, int)
+INCIDENT_FLUSH_RETRY_BACKOFF_MS = _env("INCIDENT_FLUSH_RETRY_BACKOFF_MS", 100.0, float)
+
+# --- Incident statistics (incident_stats.IncidentStats) ---
+# Confidence histogram bins (equal width over [0, 1]) kept in the rollups.
+INCIDENT_STATS_CONFIDENCE_BINS = _env("INCIDENT_STATS_CONFIDENCE_BINS", 10, int)
+# How long minute and hour rollups are kept; day rollups are kept indefinitely.
+INCIDENT_STATS_MINUTE_RETENTION_HOURS = _env("INCIDENT_STATS_MINUTE_RETENTION_HOURS", 48, int)
+INCIDENT_STATS_HOUR_RETENTION_DAYS = _env("INCIDENT_STATS_HOUR_RETENTION_DAYS", 90, int)
+# Counters per day in the top-targets sketch; larger is more accurate further down the ranking.
+INCIDENT_STATS_TOP_TARGETS_CAPACITY = _env("INCIDENT_STATS_TOP_TARGETS_CAPACITY", 256, int)
+
+# --- CERT reports (report_pipeline.ReportPipeline) ---
+# Directory of the gzip NDJSON report archive; empty means backend/submitted_reports.
+REPORT_ARCHIVE_DIR = _env("REPORT_ARCHIVE_DIR", "", str)
+# How long the writer gathers submissions into one batch after the first arrives, in seconds.
+REPORT_WINDOW_SECONDS = _env("REPORT_WINDOW_SECONDS", 5.0, float)
+# Most indicators archived per batch.
+REPORT_MAX_BUNDLE_INDICATORS = _env("REPORT_MAX_BUNDLE_INDICATORS", 500, int)
+# Archive segments rotate once they reach this size, in megabytes.
+REPORT_ARCHIVE_ROTATE_MB = _env("REPORT_ARCHIVE_ROTATE_MB", 64.0, float)
+# Queue capacity; /api/notify-cert answers 503 when it is full.
+REPORT_QUEUE_MAX = _env("REPORT_QUEUE_MAX", 10000, int)
+# Times a submission whose batch could not be archived is queued again before it is dropped.
+REPORT_RETRIES = _env("REPORT_RETRIES", 3, int)
+
+# --- Live events (event_hub.EventHub, /api/events) ---
+# Recent events kept so a reconnecting client can resume from its Last-Event-ID.
+EVENT_REPLAY_SIZE = _env("EVENT_REPLAY_SIZE", 1000, int)
+# Events queued per client; a client that falls further behind is disconnected and resumes on reconnect.
+EVENT_CLIENT_BUFFER = _env("EVENT_CLIENT_BUFFER", 256, int)
+# Concurrent stream subscribers; more get a 503.
+EVENT_MAX_SUBSCRIBERS = _env("EVENT_MAX_SUBSCRIBERS", 200, int)
+# Seconds between keepalive comments on an idle stream.
+EVENT_HEARTBEAT_SECONDS = _env("EVENT_HEARTBEAT_SECONDS", 15.0, float)
+# Reconnect delay suggested to EventSource clients, in milliseconds.
+EVENT_RETRY_MS = _env("EVENT_RETRY_MS", 3000, int)
+
+# --- Request timing (timing, sampling_profiler.SlowRequestProfiler) ---
+# Send the per-stage breakdown of every API response as a Server-Timing header.
+SERVER_TIMING_HEADER = _env("SERVER_TIMING_HEADER", True, _bool)
+# Requests slower than this get a sampled stack profile written to PROFILE_DIR; 0 disables sampling.
+PROFILE_SLOW_REQUEST_MS = _env("PROFILE_SLOW_REQUEST_MS", 0.0, float)
+# Stack sampling period while profiling, in milliseconds.
+PROFILE_SAMPLE_INTERVAL_MS = _env("PROFILE_SAMPLE_INTERVAL_MS", 5.0, float)
+# Where folded-stack profiles go; empty means backend/profiles.
+PROFILE_DIR = _env("PROFILE_DIR", "", str)
+# Most recent profiles kept; older ones are deleted.
+PROFILE_KEEP = _env("PROFILE_KEEP", 50, int)
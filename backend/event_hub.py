@@ -0,0 +1,176 @@
+"""
+In-process pub/sub for the dashboards' live updates (/api/events).
+
+Publishers (the incident writer, the feed refresher) call `publish` once per
+change; the event is serialized to its Server-Sent Events frame once and
+appended to every matching subscriber's queue, and to a replay buffer.
+
+Event IDs are `<boot>-<seq>`. A client reconnecting with Last-Event-ID gets
+the events it missed replayed from the buffer; if they have already left it,
+or the ID is from an earlier process, it gets a `reset` event instead and
+should re-fetch. A subscriber whose queue reaches `client_buffer` events is
+dropped rather than slowing the publisher down; its stream ends and the
+client resumes from its last event on reconnect.
+"""
+import json
+import threading
+import uuid
+from collections import deque
+
+import config
+from metrics import registry
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Event:
+    __slots__ = ("seq", "type", "frame")
+
+    def __init__(self, seq, event_type, frame):
+        self.seq = seq
+        self.type = event_type
+        self.frame = frame
+
+
+def sse_frame(event_id, event_type, data):
+    """One Server-Sent Events message, encoded."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+class Subscription:
+    """One client's queue of encoded frames. Consumers either block in `wait` (threads)
+    or pass a `wakeup` callback to `EventHub.subscribe` and call `drain` (asyncio)."""
+
+    def __init__(self, hub, types, wakeup=None):
+        self.hub = hub
+        self.types = types
+        self.closed = False
+        self._frames = deque()
+        self._ready = threading.Event()
+        self._wakeup = wakeup
+
+    def wants(self, event_type):
+        return self.types is None or event_type in self.types
+
+    def _push(self, frame):
+        self._frames.append(frame)
+
+    def _notify(self):
+        self._ready.set()
+        if self._wakeup is not None:
+            self._wakeup()
+
+    def drain(self):
+        frames = []
+        while self._frames:
+            frames.append(self._frames.popleft())
+        return frames
+
+    def wait(self, timeout):
+        """Frames queued so far, waiting up to `timeout` seconds for the first one."""
+        self._ready.wait(timeout)
+        self._ready.clear()
+        return self.drain()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, replay_size=None, client_buffer=None, max_subscribers=None):
+        self.boot = uuid.uuid4().hex[:8]
+        self.client_buffer = client_buffer or config.EVENT_CLIENT_BUFFER
+        self.max_subscribers = max_subscribers or config.EVENT_MAX_SUBSCRIBERS
+        self._replay = deque(maxlen=replay_size or config.EVENT_REPLAY_SIZE)
+        self._seq = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+        self.subscribers_gauge = registry.gauge("event_subscribers", help_text="Open live event streams.")
+        self.dropped = registry.counter("event_subscribers_dropped_total",
+                                        help_text="Streams closed because the client fell too far behind.")
+
+    def event_id(self, seq):
+        return f"{self.boot}-{seq}"
+
+    def publish(self, event_type, data):
+        """Queues `data` (JSON-serializable) for every subscriber of `event_type`."""
+        notify = []
+        with self._lock:
+            self._seq += 1
+            event = Event(self._seq, event_type, sse_frame(self.event_id(self._seq), event_type, data))
+            self._replay.append(event)
+            for subscription in list(self._subscribers):
+                if not subscription.wants(event_type):
+                    continue
+                if len(subscription._frames) >= self.client_buffer:
+                    self._drop(subscription)
+                else:
+                    subscription._push(event.frame)
+                notify.append(subscription)
+        registry.counter("events_published_total", {"type": event_type}, help_text="Live events published.").inc()
+        for subscription in notify:
+            subscription._notify()
+
+    def subscribe(self, last_event_id=None, types=None, wakeup=None):
+        """Registers a subscriber to `types` (None for all). Events missed since
+        `last_event_id` are queued on it straight away, or a `reset` event if they
+        can no longer be replayed."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(f"{self.max_subscribers} live event streams already open")
+            subscription = Subscription(self, set(types) if types else None, wakeup)
+            if last_event_id:
+                missed = self._missed_since(last_event_id)
+                if missed is None:
+                    subscription._push(sse_frame(self.event_id(self._seq), "reset",
+                                                 {"reason": "Events since the given ID are no longer available"}))
+                else:
+                    for event in missed:
+                        if subscription.wants(event.type):
+                            subscription._push(event.frame)
+            self._subscribers.add(subscription)
+            self.subscribers_gauge.set(len(self._subscribers))
+        if subscription._frames:
+            subscription._notify()
+        return subscription
+
+    def _missed_since(self, last_event_id):
+        """Buffered events after `last_event_id`, or None if some were already evicted."""
+        boot, _, seq = last_event_id.rpartition("-")
+        if boot != self.boot or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        seq = int(seq)
+        oldest = self._replay[0].seq if self._replay else self._seq + 1
+        if seq < oldest - 1:
+            return None
+        return [event for event in self._replay if event.seq > seq]
+
+    def _drop(self, subscription):
+        subscription.closed = True
+        subscription._frames.clear()
+        self._subscribers.discard(subscription)
+        self.subscribers_gauge.set(len(self._subscribers))
+        self.dropped.inc()
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+            self._subscribers.discard(subscription)
+            self.subscribers_gauge.set(len(self._subscribers))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "last_event_id": self.event_id(self._seq) if self._seq else None,
+                "replay_buffered": len(self._replay),
+                "dropped": self.dropped.value,
+            }
+
+
+# Singleton instance
+event_hub = EventHub()
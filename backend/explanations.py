@@ -0,0 +1,101 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import config
+from metrics import registry
+
+
+class ExplanationQueueFull(Exception):
+    pass
+
+
+class DeferredExplanations:
+    """
+    Computes explanations in background threads so the prediction can be
+    returned immediately. Results are kept (bounded, oldest evicted first)
+    until the client fetches them by ID. At most `max_pending` jobs wait or
+    run at once; `submit` refuses more, and jobs whose entry was evicted
+    before they started are skipped.
+    """
+
+    def __init__(self, workers=None, max_stored=None, max_pending=None):
+        self.max_stored = max_stored or config.EXPLAIN_MAX_STORED
+        self.max_pending = max_pending or config.EXPLAIN_MAX_PENDING
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or config.EXPLAIN_WORKERS, thread_name_prefix="explain")
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.rejected = registry.counter("explanations_rejected_total",
+                                         help_text="Deferred explanations refused with the queue full.")
+        self.skipped = registry.counter("explanations_skipped_total",
+                                        help_text="Deferred explanations evicted before they were computed.")
+
+    def submit(self, text, handle, target_class, mode=None, on_done=None, encoding=None):
+        """Schedules an explanation with the loaded model `handle` (model_registry.ModelHandle) and returns its ID.
+        `on_done(attributions)` is called from the worker when it succeeds;
+        `encoding` is the prediction's tokenization, reused if given.
+        Raises ExplanationQueueFull when `max_pending` jobs are already queued."""
+        mode = mode or config.EXPLAIN_DEFERRED_MODE
+        explanation_id = uuid.uuid4().hex
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected.inc()
+                raise ExplanationQueueFull(f"{self.max_pending} explanations already pending")
+            self._pending += 1
+            self._results[explanation_id] = {
+                "id": explanation_id,
+                "status": "pending",
+                "mode": mode,
+                "attributions": [],
+                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            while len(self._results) > self.max_stored:
+                self._results.popitem(last=False)
+
+        self._executor.submit(self._run, explanation_id, text, handle, target_class, mode, on_done, encoding)
+        return explanation_id
+
+    def _run(self, explanation_id, text, handle, target_class, mode, on_done, encoding):
+        try:
+            self._explain(explanation_id, text, handle, target_class, mode, on_done, encoding)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _explain(self, explanation_id, text, handle, target_class, mode, on_done, encoding):
+        with self._lock:
+            if explanation_id not in self._results:
+                # Evicted while queued: nobody can fetch it any more
+                self.skipped.inc()
+                return
+        try:
+            attributions, _ = handle.explain(text, target_class=target_class, mode=mode, encoding=encoding)
+            update = {"status": "done", "attributions": attributions}
+        except Exception as e:
+            update = {"status": "failed", "error": str(e)}
+        else:
+            if on_done is not None:
+                try:
+                    on_done(attributions)
+                except Exception as e:
+                    print(f"Deferred explanation callback failed: {e}")
+
+        with self._lock:
+            entry = self._results.get(explanation_id)
+            if entry is not None:
+                entry.update(update)
+
+    def get(self, explanation_id):
+        """Returns a copy of the stored entry, or None if unknown/evicted."""
+        with self._lock:
+            entry = self._results.get(explanation_id)
+            return dict(entry) if entry else None
+
+
+# Singleton instance
+deferred_explanations = DeferredExplanations()
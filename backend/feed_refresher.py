@@ -0,0 +1,202 @@
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+import config
+from event_hub import event_hub
+from indicator_index import indicator_entries, save_snapshot
+from metrics import registry
+
+
+class FeedRefresher:
+    """
+    Keeps ThreatIntel's URLHaus index current from a background thread.
+
+    Each poll is a conditional GET (If-None-Match / If-Modified-Since). When
+    the feed changed, only the added/removed indicators are applied to a copy
+    of the current index, which is then swapped in with a single attribute
+    assignment, so lookups never wait on a refresh. Every successful update is
+    persisted as a memory-mappable snapshot for fast, offline-capable startup,
+    and announced to live dashboards as a `feed` event.
+    """
+
+    def __init__(self, intel, url=None, interval=None, snapshot_path=None, timeout=None, max_removed_fraction=None,
+                 reject_confirmations=None):
+        self.intel = intel
+        self.url = url or config.FEED_URL
+        self.interval = config.FEED_REFRESH_SECONDS if interval is None else interval
+        self.snapshot_path = config.FEED_SNAPSHOT_PATH if snapshot_path is None else snapshot_path
+        self.timeout = timeout or config.FEED_FETCH_TIMEOUT_SECONDS
+        self.max_removed_fraction = (config.FEED_MAX_REMOVED_FRACTION if max_removed_fraction is None
+                                     else max_removed_fraction)
+        self.reject_confirmations = (config.FEED_REJECT_CONFIRMATIONS if reject_confirmations is None
+                                     else reject_confirmations)
+
+        self.etag = None
+        self.last_modified = None
+        self.last_checked = None
+        self.last_changed = None
+        self.last_result = None
+        self.last_rejection = None
+        # Source of the loaded index: this URL once a live fetch (or its snapshot) was
+        # loaded, None for the bundled CSV. Mass removals are only suspect against it.
+        self.baseline_source = None
+        self._rejected_version = None
+        self._rejected_count = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._refresh_lock = threading.Lock()
+
+        self.refresh_results = {
+            result: registry.counter("feed_refresh_total", {"result": result})
+            for result in ("updated", "unchanged", "not_modified", "rejected", "failed")
+        }
+        self.refresh_latency = registry.histogram("feed_refresh_ms")
+        self.indicators_gauge = registry.gauge("feed_indicators")
+
+    def start(self):
+        """Starts polling in a daemon thread; the first poll happens immediately.
+        With an interval of 0 the feed is fetched once and not polled; with a
+        negative one it is never fetched (offline runs, benchmarks)."""
+        if self._thread is not None or self.interval < 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="feed-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_once()
+            if self.interval <= 0:
+                return
+            self._stop.wait(self.interval)
+
+    def refresh_once(self):
+        """Polls the feed once. Returns 'updated', 'unchanged', 'not_modified', 'rejected' or 'failed'."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            try:
+                result = self._refresh()
+            except Exception as e:
+                print(f"Threat feed refresh failed: {e}")
+                result = "failed"
+            self.last_checked = datetime.now()
+            self.last_result = result
+            self.refresh_results[result].inc()
+            self.refresh_latency.observe((time.perf_counter() - started) * 1000.0)
+            self.indicators_gauge.set(len(self.intel.urlhaus_index))
+            return result
+
+    def _refresh(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        response = requests.get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return "not_modified"
+        response.raise_for_status()
+
+        feed = self.intel._parse_csv(response.content.decode('utf-8', errors='ignore').splitlines())
+        current = self.intel.urlhaus_index
+        added, removed = current.diff(indicator_entries(feed.urls))
+
+        # Keep the current index (and validators, so the next poll refetches) rather
+        # than apply what is most likely a truncated or broken download
+        rejection = self._sanity_check(feed, current, removed)
+        if rejection and len(feed):
+            # The same content over and over is the feed's real state, not a bad download
+            if feed.version == self._rejected_version:
+                self._rejected_count += 1
+            else:
+                self._rejected_version, self._rejected_count = feed.version, 1
+            if self._rejected_count >= self.reject_confirmations:
+                print(f"Threat feed accepted after {self._rejected_count} identical rejected fetches: {rejection}")
+                rejection = None
+        if rejection:
+            self.last_rejection = {"at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "reason": rejection}
+            print(f"Threat feed refresh rejected: {rejection}")
+            return "rejected"
+
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.baseline_source = self.url
+        self._rejected_version, self._rejected_count = None, 0
+
+        if not added and not removed:
+            if feed.version == self.intel.feed.version:
+                return "unchanged"
+            # Same indicators, but row metadata (e.g. online/offline status) moved on
+            self.intel.swap_index(current, feed)
+        else:
+            self.intel.swap_index(current.apply_diff(added, removed), feed)
+            print(f"Threat feed updated: +{len(added)} / -{len(removed)} indicators ({len(self.intel.urlhaus_index)} total).")
+        self.last_changed = datetime.now()
+        self.save_snapshot()
+        event_hub.publish("feed", {
+            "version": feed.version,
+            "added": len(added),
+            "removed": len(removed),
+            "indicators": len(self.intel.urlhaus_index),
+            "changed_at": self.last_changed.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        return "updated"
+
+    def _sanity_check(self, feed, current, removed):
+        """Why the fetched feed should not replace the current one, or None if it looks sound."""
+        if not len(feed):
+            return "the feed has no indicators"
+        if self.baseline_source != self.url:
+            return None  # e.g. the bundled CSV, which the live feed is expected to replace
+        if len(current) and len(removed) > self.max_removed_fraction * len(current):
+            return (f"it would remove {len(removed)} of {len(current)} indicators "
+                    f"(more than {self.max_removed_fraction:.0%})")
+        return None
+
+    def save_snapshot(self):
+        """Persists the current index, feed table and feed validators. Failures are logged, not raised."""
+        if not self.snapshot_path:
+            return
+        feed = self.intel.feed
+        metadata = {
+            "source": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "feed_table": feed.snapshot_header(),
+        }
+        try:
+            save_snapshot(self.intel.urlhaus_index, self.snapshot_path, metadata, feed.snapshot_columns())
+        except OSError as e:
+            # e.g. Windows refuses to replace a file that is still memory-mapped
+            print(f"Could not write threat feed snapshot {self.snapshot_path}: {e}")
+
+    def restore_validators(self, metadata):
+        """Reuses ETag/Last-Modified from a loaded snapshot for the next conditional request."""
+        if metadata.get("source") == self.url:
+            self.etag = metadata.get("etag")
+            self.last_modified = metadata.get("last_modified")
+            self.baseline_source = self.url
+
+    def stats(self):
+        def fmt(value):
+            return value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+        return {
+            "source": self.url,
+            "interval_seconds": self.interval,
+            "indicators": len(self.intel.urlhaus_index),
+            "last_checked": fmt(self.last_checked),
+            "last_changed": fmt(self.last_changed),
+            "last_result": self.last_result,
+            "last_rejection": self.last_rejection,
+            "rejected": self.refresh_results["rejected"].value,
+            "etag": self.etag,
+        }
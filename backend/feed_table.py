@@ -0,0 +1,278 @@
+"""
+Columnar store of URLHaus feed rows for the threat-feed API.
+
+Rows are kept newest first as parallel arrays: dates as epoch seconds,
+statuses and threat types as codes into small vocabularies, tags as offsets
+into one shared array of tag codes, URLs as one UTF-8 blob plus offsets.
+The same arrays are written to the indicator snapshot as binary columns and
+served straight from the memory mapping after a restart. Row numbers per
+threat type, tag and status are indexed on the first filtered query, so a
+filtered page is a slice of a precomputed list.
+
+A table is immutable and carries a content `version`. Rendered pages are
+cached per table with ETags derived from that version, so a poll that finds
+the feed unchanged costs a dictionary lookup (or a 304).
+"""
+import csv
+import hashlib
+import json
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+import config
+
+# URLHaus CSV layouts (the header is a comment line in the export)
+CSV_COLUMNS = ("id", "dateadded", "url", "url_status", "last_online", "threat", "tags", "urlhaus_link", "reporter")
+CSV_COLUMNS_LEGACY = ("id", "dateadded", "url", "url_status", "threat", "tags", "urlhaus_link", "reporter")
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+FILTERS = ("threat", "tag", "status")
+# (column, array typecode) as stored in the indicator snapshot, under a "feed_" prefix
+SNAPSHOT_COLUMNS = (
+    ("ids", "Q"), ("added", "q"), ("url_offsets", "Q"), ("statuses", "H"), ("threats", "H"),
+    ("tag_offsets", "I"), ("tag_codes", "H"), ("url_blob", "B"),
+)
+
+
+def page_query(offset=0, limit=None, threat=None, tag=None, status=None):
+    """Normalized page request: offset clamped at 0, limit to [1, THREAT_FEED_MAX_PAGE_SIZE]."""
+    limit = config.THREAT_FEED_PAGE_SIZE if limit is None else limit
+    return {
+        "offset": max(int(offset), 0),
+        "limit": min(max(int(limit), 1), config.THREAT_FEED_MAX_PAGE_SIZE),
+        "threat": threat or None,
+        "tag": tag or None,
+        "status": status or None,
+    }
+
+
+def _epoch(value):
+    try:
+        return int(datetime.strptime(value.strip(), DATE_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        return 0
+
+
+def _format_epoch(seconds):
+    if not seconds:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(DATE_FORMAT)
+
+
+class _Vocabulary:
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {v: i for i, v in enumerate(self.values)}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class FeedTable:
+    """Immutable feed rows, newest first. Build with `parse_csv`, `from_urls` or `from_snapshot`."""
+
+    def __init__(self, ids, added, url_blob, url_offsets, statuses, threats, tag_offsets, tag_codes,
+                 status_values, threat_values, tag_values, version=None, facets=None):
+        self.ids = ids
+        self.added = added
+        self._url_blob = url_blob
+        self._url_offsets = url_offsets
+        self.statuses = statuses
+        self.threats = threats
+        self._tag_offsets = tag_offsets
+        self._tag_codes = tag_codes
+        self.status_values = status_values
+        self.threat_values = threat_values
+        self.tag_values = tag_values
+
+        if version is None:
+            digest = hashlib.blake2b(digest_size=8)
+            for column in (ids, added, statuses, threats, tag_offsets, tag_codes, url_offsets, url_blob):
+                digest.update(column)
+            version = digest.hexdigest()
+        self.version = version
+
+        self._index = None
+        self._facets = facets
+        self._pages = OrderedDict()
+        self._pages_lock = threading.Lock()
+
+    # --- Construction ---
+
+    @classmethod
+    def _build(cls, rows):
+        """rows: iterables of (id, dateadded epoch, url, status, threat, [tags]) in any order."""
+        rows = sorted(rows, key=lambda r: (r[1], r[0]), reverse=True)
+        statuses, threats, tags = _Vocabulary(), _Vocabulary(), _Vocabulary()
+        ids, added = array("Q"), array("q")
+        status_col, threat_col = array("H"), array("H")
+        url_offsets, tag_offsets, tag_codes = array("Q", [0]), array("I", [0]), array("H")
+        blob = bytearray()
+        for row_id, date, url, status, threat, row_tags in rows:
+            ids.append(row_id)
+            added.append(date)
+            encoded = url.encode("utf-8")
+            blob += encoded
+            url_offsets.append(len(blob))
+            status_col.append(statuses.code(status))
+            threat_col.append(threats.code(threat))
+            tag_codes.extend(tags.code(t) for t in row_tags)
+            tag_offsets.append(len(tag_codes))
+        return cls(ids, added, bytes(blob), url_offsets, status_col, threat_col, tag_offsets, tag_codes,
+                   statuses.values, threats.values, tags.values)
+
+    @classmethod
+    def parse_csv(cls, lines):
+        """Parses a URLHaus CSV export (current or legacy column layout)."""
+        columns = None
+        rows = []
+        for position, row in enumerate(csv.reader(lines)):
+            if not row:
+                continue
+            if row[0].startswith('#'):
+                header = tuple(c.strip().lstrip('#').strip() for c in row)
+                if "url" in header and "dateadded" in header:
+                    columns = header
+                continue
+            fields = dict(zip(columns or (CSV_COLUMNS if len(row) >= len(CSV_COLUMNS) else CSV_COLUMNS_LEGACY), row))
+            url = fields.get("url", "").strip()
+            if not url:
+                continue
+            try:
+                row_id = int(fields.get("id", ""))
+            except ValueError:
+                row_id = position
+            tags = [t.strip() for t in fields.get("tags", "").split(",") if t.strip() and t.strip() != "None"]
+            rows.append((row_id, _epoch(fields.get("dateadded", "")), url,
+                         fields.get("url_status", "").strip() or "unknown",
+                         fields.get("threat", "").strip() or "unknown", tags))
+        return cls._build(rows)
+
+    @classmethod
+    def from_urls(cls, urls):
+        """A table without metadata, for URL-only sources (e.g. older snapshots)."""
+        return cls._build((len(urls) - i, 0, url, "unknown", "unknown", []) for i, url in enumerate(urls))
+
+    @classmethod
+    def from_snapshot(cls, columns, header):
+        """A table over the columns of an indicator snapshot (memoryviews into its mapping,
+        used as they are) and the `snapshot_header` saved with them."""
+        return cls(*(columns["feed_" + name] for name in ("ids", "added", "url_blob", "url_offsets",
+                                                           "statuses", "threats", "tag_offsets", "tag_codes")),
+                   header["status_values"], header["threat_values"], header["tag_values"],
+                   version=header["version"], facets=header["facets"])
+
+    def snapshot_columns(self):
+        """{name: (typecode, column)} for indicator_index.save_snapshot's extra columns."""
+        columns = {"ids": self.ids, "added": self.added, "url_offsets": self._url_offsets,
+                   "statuses": self.statuses, "threats": self.threats, "tag_offsets": self._tag_offsets,
+                   "tag_codes": self._tag_codes, "url_blob": self._url_blob}
+        return {"feed_" + name: (typecode, columns[name]) for name, typecode in SNAPSHOT_COLUMNS}
+
+    def snapshot_header(self):
+        """The small, JSON-serializable rest of the table: vocabularies, version and facets."""
+        return {
+            "status_values": self.status_values, "threat_values": self.threat_values, "tag_values": self.tag_values,
+            "version": self.version, "facets": self.facets(),
+        }
+
+    # --- Access ---
+
+    def __len__(self):
+        return len(self.ids)
+
+    def url(self, row):
+        return str(self._url_blob[self._url_offsets[row]:self._url_offsets[row + 1]], "utf-8")
+
+    @property
+    def urls(self):
+        return [self.url(row) for row in range(len(self))]
+
+    def tags(self, row):
+        return [self.tag_values[c] for c in self._tag_codes[self._tag_offsets[row]:self._tag_offsets[row + 1]]]
+
+    def row(self, row):
+        return {
+            "id": self.ids[row],
+            "url": self.url(row),
+            "date_added": _format_epoch(self.added[row]),
+            "threat": self.threat_values[self.threats[row]],
+            "tags": self.tags(row),
+            "status": self.status_values[self.statuses[row]],
+            "source": "URLHaus",
+        }
+
+    def _row_index(self):
+        """{filter: {value: row numbers}}, built on first use."""
+        if self._index is None:
+            index = {"threat": {}, "tag": {}, "status": {}}
+            for row in range(len(self)):
+                index["threat"].setdefault(self.threat_values[self.threats[row]], array("I")).append(row)
+                index["status"].setdefault(self.status_values[self.statuses[row]], array("I")).append(row)
+                for code in self._tag_codes[self._tag_offsets[row]:self._tag_offsets[row + 1]]:
+                    index["tag"].setdefault(self.tag_values[code], array("I")).append(row)
+            self._index = index
+        return self._index
+
+    def select(self, threat=None, tag=None, status=None):
+        """Row numbers matching every given filter, newest first."""
+        wanted = [self._row_index()[name].get(value, array("I"))
+                  for name, value in (("threat", threat), ("tag", tag), ("status", status)) if value]
+        if not wanted:
+            return range(len(self))
+        wanted.sort(key=len)
+        if len(wanted) == 1:
+            return wanted[0]
+        others = [set(rows) for rows in wanted[1:]]
+        return [row for row in wanted[0] if all(row in rows for rows in others)]
+
+    def facets(self, top_tags=50):
+        """Counts per threat type and status, and the most common tags, for filter menus."""
+        if self._facets is None:
+            index = self._row_index()
+            self._facets = {
+                "threats": {value: len(rows) for value, rows in index["threat"].items()},
+                "statuses": {value: len(rows) for value, rows in index["status"].items()},
+                "tags": dict(Counter({value: len(rows) for value, rows in index["tag"].items()}).most_common(top_tags)),
+            }
+        return self._facets
+
+    # --- Pages ---
+
+    def etag(self, query):
+        """ETag of the page for `query` (see `page`); known without rendering it."""
+        return f"{self.version}-" + hashlib.blake2b(json.dumps(query, sort_keys=True).encode(), digest_size=6).hexdigest()
+
+    def page(self, query):
+        """Rendered JSON body (bytes) for `query` = {offset, limit, threat, tag, status},
+        cached per table, so it is built at most once per feed version."""
+        key = json.dumps(query, sort_keys=True)
+        with self._pages_lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+                return body
+
+        rows = self.select(**{name: query.get(name) for name in FILTERS})
+        offset, limit = query["offset"], query["limit"]
+        body = json.dumps({
+            "items": [self.row(r) for r in rows[offset:offset + limit]],
+            "total": len(rows),
+            "offset": offset,
+            "limit": limit,
+            "filters": {name: query.get(name) for name in FILTERS},
+            "facets": self.facets(),
+            "version": self.version,
+            "latest": _format_epoch(self.added[0]) if len(self) else None,
+        }).encode("utf-8")
+
+        with self._pages_lock:
+            self._pages[key] = body
+            while len(self._pages) > config.THREAT_FEED_PAGE_CACHE_ENTRIES:
+                self._pages.popitem(last=False)
+        return body
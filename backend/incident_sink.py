@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+import config
+from event_hub import event_hub
+from metrics import registry
+
+# Applied to every new SQLite connection. WAL lets readers proceed while the
+# writer commits, and synchronous=NORMAL drops the per-commit fsync of the WAL.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+
+def configure_sqlite(engine):
+    """Registers a connect hook applying SQLITE_PRAGMAS to `engine`."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+class IncidentSink:
+    """
+    Write-behind queue for incident rows.
+
+    Request handlers hand over unsaved model instances and return at once; a
+    background writer commits them in batches, flushing when `batch_size`
+    rows are waiting or `flush_interval_ms` after the oldest queued row.
+    Each committed batch is published to the event hub as one `incidents`
+    event (rows newest first, as the incident log lists them). With `rollups`
+    (an incident_stats.IncidentStats), the statistics rollups are updated in
+    the same transaction as the rows. A batch whose commit fails (e.g. the
+    database is locked) is retried with backoff before its rows are dropped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, app, db, batch_size=None, flush_interval_ms=None, max_queue=None, rollups=None,
+                 retries=None, retry_backoff_ms=None):
+        self.app = app
+        self.db = db
+        self.rollups = rollups
+        self.batch_size = batch_size or config.INCIDENT_FLUSH_BATCH_SIZE
+        self.flush_interval = (config.INCIDENT_FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue or config.INCIDENT_QUEUE_MAX)
+        self.retries = config.INCIDENT_FLUSH_RETRIES if retries is None else retries
+        self.retry_backoff = (config.INCIDENT_FLUSH_RETRY_BACKOFF_MS if retry_backoff_ms is None
+                              else retry_backoff_ms) / 1000.0
+
+        self.queue_depth = registry.gauge("incident_queue_depth", help_text="Incidents waiting to be written.")
+        self.flush_latency = registry.histogram("incident_flush_ms", help_text="Time to commit one batch.")
+        self.flush_size = registry.histogram(
+            "incident_flush_batch_size", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+            help_text="Incidents committed per transaction.")
+        self.written = registry.counter("incidents_written_total")
+        self.retried = registry.counter("incident_flush_retries_total", help_text="Batch commits retried after a failure.")
+        self.failed = registry.counter("incidents_failed_total",
+                                       help_text="Incidents dropped after every commit attempt failed.")
+
+        self._stopped = False
+        self._writer = threading.Thread(target=self._run, name="incident-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, incident):
+        """Queues one incident. Blocks only if the queue is full (backpressure)."""
+        self.submit_many([incident])
+
+    def submit_many(self, incidents):
+        # Stamp now so rows keep the time they were reported, not when they were flushed
+        for incident in incidents:
+            if incident.timestamp is None:
+                incident.timestamp = datetime.now()
+        if self._stopped:
+            # Late writes during shutdown are committed synchronously
+            self._flush(list(incidents))
+            return
+        for incident in incidents:
+            self._queue.put(incident)
+            self.queue_depth.inc()
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is self._STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                self._queue.put(self._STOP)  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            self.queue_depth.dec(len(batch))
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Commits `batch`, retrying with backoff; rows are dropped once every attempt failed.
+        Retries happen here on the writer rather than back through the queue, which keeps
+        the rows in order and cannot block on a full queue."""
+        if not batch:
+            return
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried.inc()
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                self._commit(batch)
+                return
+            except Exception as e:
+                error = e
+        self.failed.inc(len(batch))
+        print(f"Incident flush of {len(batch)} rows failed after {self.retries + 1} attempts; dropping them: {error}")
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                self.db.session.add_all(batch)
+                self.db.session.flush()
+                # Serialize while the ids are fresh; commit() expires every attribute
+                rows = [incident.to_dict() for incident in reversed(batch)]
+                if self.rollups is not None:
+                    self.rollups.apply(self.db.session, batch)
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                if self.rollups is not None:
+                    self.rollups.rollback()
+                print(f"Incident flush of {len(batch)} rows failed: {e}")
+                # The rolled-back rows go back to being new; drop their flushed ids for the retry
+                for incident in batch:
+                    incident.id = None
+                raise
+        self.flush_latency.observe((time.perf_counter() - started) * 1000.0)
+        self.flush_size.observe(len(batch))
+        self.written.inc(len(batch))
+        event_hub.publish("incidents", {"items": rows})
+
+    def shutdown(self, timeout=10.0):
+        """Drains the queue and stops the writer. Safe to call more than once."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(self._STOP)
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            print(f"Incident writer did not drain within {timeout}s; {self._queue.qsize()} rows pending.")
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000.0,
+            "written": self.written.value,
+            "retried_flushes": self.retried.value,
+            "failed": self.failed.value,
+            "flush_ms": self.flush_latency.snapshot(),
+            "flush_batch_size": self.flush_size.snapshot(),
+        }
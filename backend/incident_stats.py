@@ -0,0 +1,358 @@
+"""
+Incrementally maintained incident statistics (/api/incident-stats).
+
+The incident writer calls `IncidentStats.apply` in the transaction that
+commits each batch. Every incident adds one to a rollup row per granularity
+(minute, hour, day), keyed by bucket start, type, prediction and confidence
+bin; rows also sum their confidences. Counts per bucket, verdict mixes, mean
+confidence and the confidence histogram for any range are then read from the
+rollups, never from the incident rows. Minute and hour rollups are pruned
+after their retention period; day rollups are kept.
+
+Repeated targets are counted in one Space-Saving sketch per day, persisted
+alongside the rollups. Ranges spanning several days merge the day sketches.
+Counts are upper bounds, and `min_count` is the guaranteed lower bound.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Integer, bindparam, case, cast, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import config
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+# Range returned when the request gives no `start`
+DEFAULT_SPANS = {"minute": timedelta(hours=1), "hour": timedelta(hours=24), "day": timedelta(days=30)}
+MAX_BUCKETS = 10000
+ROLLUP_KEY = ("granularity", "bucket", "type", "prediction", "confidence_bin")
+SKETCH_KEY = ("day", "type", "target")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K summary (Metwally et al.) over at most `capacity` counters.
+
+    `counters` maps item -> [count, error]: count over-estimates the item's
+    true frequency by at most error. When full, a new item replaces the
+    current minimum and inherits its count as error. Items changed or
+    evicted since the last write are tracked in `dirty` / `evicted`.
+    """
+
+    def __init__(self, capacity, counters=None):
+        self.capacity = capacity
+        self.counters = {item: list(entry) for item, entry in (counters or {}).items()}
+        self._heap = [(entry[0], item) for item, entry in self.counters.items()]
+        heapq.heapify(self._heap)
+        self.dirty = set()
+        self.evicted = set()
+
+    def offer(self, item, n=1):
+        entry = self.counters.get(item)
+        if entry is not None:
+            entry[0] += n
+        elif len(self.counters) < self.capacity:
+            entry = self.counters[item] = [n, 0]
+        else:
+            floor, victim = self._pop_min()
+            del self.counters[victim]
+            self.dirty.discard(victim)
+            self.evicted.add(victim)
+            entry = self.counters[item] = [floor + n, floor]
+        self.evicted.discard(item)
+        self.dirty.add(item)
+        # Stale heap entries are skipped when popped; rebuild before they pile up
+        heapq.heappush(self._heap, (entry[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(e[0], i) for i, e in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            entry = self.counters.get(item)
+            if entry is not None and entry[0] == count:
+                return count, item
+
+
+class IncidentStats:
+    """Rollups and target sketches over `incident_model`; see app.IncidentRollup and app.IncidentTargetSketch."""
+
+    def __init__(self, incident_model, rollup_model, sketch_model, confidence_bins=None,
+                 top_capacity=None, minute_retention_hours=None, hour_retention_days=None):
+        self.incident_model = incident_model
+        self.rollup_model = rollup_model
+        self.sketch_model = sketch_model
+        self.bins = confidence_bins or config.INCIDENT_STATS_CONFIDENCE_BINS
+        self.top_capacity = top_capacity or config.INCIDENT_STATS_TOP_TARGETS_CAPACITY
+        self.retention = {
+            "minute": timedelta(hours=minute_retention_hours or config.INCIDENT_STATS_MINUTE_RETENTION_HOURS),
+            "hour": timedelta(days=hour_retention_days or config.INCIDENT_STATS_HOUR_RETENTION_DAYS),
+        }
+        self._sketches = OrderedDict()  # day -> SpaceSaving, for the days most recently written
+        self._pruned_hour = None
+        self._lock = threading.Lock()
+
+    def confidence_bin(self, confidence):
+        return min(max(int(confidence * self.bins), 0), self.bins - 1)
+
+    # --- Writing (incident writer thread) ---
+
+    def apply(self, session, incidents):
+        """Adds flushed, not yet committed incidents to the rollups and sketches in `session`'s transaction."""
+        rollups, targets = {}, {}
+        for incident in incidents:
+            confidence_bin = self.confidence_bin(incident.confidence)
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(incident.timestamp, granularity),
+                       incident.type, incident.prediction, confidence_bin)
+                entry = rollups.setdefault(key, [0, 0.0])
+                entry[0] += 1
+                entry[1] += incident.confidence
+            day_targets = targets.setdefault(incident.timestamp.date(), {})
+            item = (incident.type, incident.target)
+            day_targets[item] = day_targets.get(item, 0) + 1
+
+        connection = session.connection()
+        with self._lock:
+            self._upsert_rollups(connection, rollups)
+            for day, counts in targets.items():
+                sketch = self._sketch(connection, day)
+                for item, n in counts.items():
+                    sketch.offer(item, n)
+                self._write_sketch(connection, day, sketch)
+            self._prune(connection)
+
+    def rollback(self):
+        """Forgets the in-memory sketches after a failed commit; they are reloaded from the database."""
+        with self._lock:
+            self._sketches.clear()
+
+    def _upsert_rollups(self, connection, rollups):
+        if not rollups:
+            return
+        table = self.rollup_model.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=ROLLUP_KEY, set_={
+            "count": table.c.count + stmt.excluded.count,
+            "confidence_sum": table.c.confidence_sum + stmt.excluded.confidence_sum,
+        })
+        connection.execute(stmt, [dict(zip(ROLLUP_KEY, key), count=count, confidence_sum=total)
+                                  for key, (count, total) in rollups.items()])
+
+    def _sketch(self, connection, day):
+        sketch = self._sketches.get(day)
+        if sketch is not None:
+            self._sketches.move_to_end(day)
+            return sketch
+        table = self.sketch_model.__table__
+        rows = connection.execute(select(table.c.type, table.c.target, table.c.count, table.c.error)
+                                  .where(table.c.day == day))
+        sketch = self._sketches[day] = SpaceSaving(
+            self.top_capacity, {(type_, target): (count, error) for type_, target, count, error in rows})
+        # Today and yesterday (late rows near midnight); older days reload if ever written again
+        while len(self._sketches) > 2:
+            self._sketches.popitem(last=False)
+        return sketch
+
+    def _write_sketch(self, connection, day, sketch):
+        table = self.sketch_model.__table__
+        if sketch.evicted:
+            connection.execute(
+                table.delete().where(table.c.day == bindparam("d"), table.c.type == bindparam("t"),
+                                     table.c.target == bindparam("g")),
+                [{"d": day, "t": type_, "g": target} for type_, target in sketch.evicted])
+        if sketch.dirty:
+            stmt = sqlite_insert(table)
+            stmt = stmt.on_conflict_do_update(index_elements=SKETCH_KEY, set_={
+                "count": stmt.excluded.count,
+                "error": stmt.excluded.error,
+            })
+            connection.execute(stmt, [
+                {"day": day, "type": type_, "target": target,
+                 "count": sketch.counters[(type_, target)][0], "error": sketch.counters[(type_, target)][1]}
+                for type_, target in sketch.dirty])
+        sketch.dirty.clear()
+        sketch.evicted.clear()
+
+    def _prune(self, connection):
+        """Drops minute and hour rollups past their retention, at most once an hour."""
+        now = datetime.now()
+        hour = bucket_start(now, "hour")
+        if self._pruned_hour == hour:
+            return
+        self._pruned_hour = hour
+        table = self.rollup_model.__table__
+        for granularity, retention in self.retention.items():
+            connection.execute(table.delete().where(
+                table.c.granularity == granularity,
+                table.c.bucket < bucket_start(now - retention, granularity)))
+
+    def backfill(self, session):
+        """Builds the rollups and sketches from existing incidents when the rollup
+        table is empty but the incident table is not (a database from before the
+        rollups existed). Aggregates in SQL, one pass over the incident table."""
+        if (session.query(self.rollup_model.id).first() is not None
+                or session.query(self.incident_model.id).first() is None):
+            return
+        started = time.perf_counter()
+        incidents = self.incident_model.__table__
+        minute = func.strftime("%Y-%m-%d %H:%M", incidents.c.timestamp)
+        confidence_bin = func.min(cast(incidents.c.confidence * self.bins, Integer), self.bins - 1)
+        rows = session.execute(
+            select(minute, incidents.c.type, incidents.c.prediction, confidence_bin,
+                   func.count(), func.sum(incidents.c.confidence))
+            .group_by(minute, incidents.c.type, incidents.c.prediction, confidence_bin))
+
+        now = datetime.now()
+        cutoffs = {g: bucket_start(now - retention, g) for g, retention in self.retention.items()}
+        rollups, total = {}, 0
+        for minute_value, type_, prediction, confidence_bin, count, confidence_sum in rows:
+            timestamp = datetime.strptime(minute_value, "%Y-%m-%d %H:%M")
+            total += count
+            for granularity in GRANULARITIES:
+                bucket = bucket_start(timestamp, granularity)
+                if granularity in cutoffs and bucket < cutoffs[granularity]:
+                    continue
+                entry = rollups.setdefault((granularity, bucket, type_, prediction, confidence_bin), [0, 0.0])
+                entry[0] += count
+                entry[1] += confidence_sum
+        connection = session.connection()
+        self._upsert_rollups(connection, rollups)
+
+        # Exact per-day counts, of which each day's sketch keeps the largest `top_capacity`
+        day = func.date(incidents.c.timestamp)
+        per_day = {}
+        for day_value, type_, target, count in session.execute(
+                select(day, incidents.c.type, incidents.c.target, func.count())
+                .group_by(day, incidents.c.type, incidents.c.target)):
+            per_day.setdefault(date.fromisoformat(day_value), []).append(((type_, target), count))
+        for day_value, counts in per_day.items():
+            top = heapq.nlargest(self.top_capacity, counts, key=lambda item: item[1])
+            sketch = SpaceSaving(self.top_capacity, {item: (count, 0) for item, count in top})
+            sketch.dirty.update(sketch.counters)
+            self._write_sketch(connection, day_value, sketch)
+        session.commit()
+        print(f"Built incident statistics from {total} existing incidents in {time.perf_counter() - started:.1f}s.")
+
+    # --- Reading ---
+
+    def query(self, session, granularity, start=None, end=None, types=None, predictions=None, top=10):
+        """Per-bucket counts by type and prediction, totals, the confidence histogram and the
+        `top` most repeated targets over [start, end). Raises ValueError for unusable ranges."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+        step = GRANULARITIES[granularity]
+        end = end or bucket_start(datetime.now(), granularity) + step
+        start = bucket_start(start or end - DEFAULT_SPANS[granularity], granularity)
+        if start >= end:
+            raise ValueError("'start' must be before 'end'")
+        if (end - start) / step > MAX_BUCKETS:
+            raise ValueError(f"Range spans more than {MAX_BUCKETS} {granularity} buckets; use a coarser granularity")
+
+        table = self.rollup_model.__table__
+        conditions = [table.c.granularity == granularity, table.c.bucket >= start, table.c.bucket < end]
+        if types:
+            conditions.append(table.c.type.in_(types))
+        if predictions:
+            conditions.append(table.c.prediction.in_(predictions))
+
+        series, by_type, by_prediction = [], {}, {}
+        count_total, confidence_total = 0, 0.0
+        for bucket, type_, prediction, count, confidence_sum in session.execute(
+                select(table.c.bucket, table.c.type, table.c.prediction,
+                       func.sum(table.c.count), func.sum(table.c.confidence_sum))
+                .where(*conditions)
+                .group_by(table.c.bucket, table.c.type, table.c.prediction)
+                .order_by(table.c.bucket)):
+            series.append({
+                "bucket": bucket.strftime(TIME_FORMAT),
+                "type": type_,
+                "prediction": prediction,
+                "count": count,
+                "mean_confidence": round(confidence_sum / count, 4),
+            })
+            by_type[type_] = by_type.get(type_, 0) + count
+            by_prediction[prediction] = by_prediction.get(prediction, 0) + count
+            count_total += count
+            confidence_total += confidence_sum
+
+        histogram = [0] * self.bins
+        for confidence_bin, count in session.execute(
+                select(table.c.confidence_bin, func.sum(table.c.count))
+                .where(*conditions).group_by(table.c.confidence_bin)):
+            if 0 <= confidence_bin < self.bins:
+                histogram[confidence_bin] = count
+
+        result = {
+            "granularity": granularity,
+            "start": start.strftime(TIME_FORMAT),
+            "end": end.strftime(TIME_FORMAT),
+            "series": series,
+            "totals": {
+                "count": count_total,
+                "mean_confidence": round(confidence_total / count_total, 4) if count_total else None,
+                "by_type": by_type,
+                "by_prediction": by_prediction,
+            },
+            "confidence_histogram": {
+                "edges": [round(i / self.bins, 4) for i in range(self.bins + 1)],
+                "counts": histogram,
+            },
+            "top_targets": self.top_targets(session, start, end, types, top) if top else [],
+        }
+        if granularity in self.retention:
+            result["retained_from"] = bucket_start(datetime.now() - self.retention[granularity],
+                                                   granularity).strftime(TIME_FORMAT)
+        return result
+
+    def top_targets(self, session, start, end, types=None, k=10):
+        """The `k` most repeated targets on the days overlapping [start, end), merged from
+        the day sketches. A target missing from a full day's sketch may have occurred up
+        to that sketch's smallest count (its floor), which is added to both its count and
+        its error. Merged in SQL over only the counters above their day's floor, since
+        the rest cannot outrank a target that was never seen."""
+        table = self.sketch_model.__table__
+        first, last = start.date(), (end - timedelta(microseconds=1)).date()
+        floors = (
+            select(table.c.day,
+                   case((func.count() >= self.top_capacity, func.min(table.c["count"])), else_=0).label("floor"))
+            .where(table.c.day.between(first, last))
+            .group_by(table.c.day)
+            .subquery()
+        )
+        total_floor = session.execute(select(func.coalesce(func.sum(floors.c.floor), 0))).scalar()
+
+        count = func.sum(table.c["count"] - floors.c.floor)
+        error = func.sum(table.c.error - floors.c.floor)
+        query = (
+            select(table.c.type, table.c.target, count, error)
+            .join(floors, table.c.day == floors.c.day)
+            .where(table.c["count"] > floors.c.floor)
+            .group_by(table.c.type, table.c.target)
+            .order_by(count.desc())
+            .limit(k)
+        )
+        if types:
+            query = query.where(table.c.type.in_(types))
+        return [
+            {"type": type_, "target": target, "count": total_floor + extra,
+             "min_count": (total_floor + extra) - (total_floor + extra_error)}
+            for type_, target, extra, extra_error in session.execute(query)
+        ]
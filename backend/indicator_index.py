@@ -0,0 +1,433 @@
+"""
+Compact lookup structures for threat indicators.
+
+URLs, hosts and registered domains are stored as sorted arrays of 64-bit
+hashes (8 bytes per entry instead of a full Python string), so several
+multi-million entry feeds fit in memory comfortably. Allow/block lists use a
+reversed-label suffix trie so subdomain matching costs O(number of labels).
+"""
+import bisect
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import struct
+from array import array
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# Multi-label public suffixes under which the registered domain has three labels.
+# Not a full Public Suffix List, just the suffixes common in phishing feeds.
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "ltd.uk", "plc.uk",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "co.in", "net.in", "org.in", "gov.in", "ac.in",
+    "co.jp", "ne.jp", "or.jp", "ac.jp",
+    "com.br", "net.br", "org.br", "gov.br",
+    "com.cn", "net.cn", "org.cn", "gov.cn",
+    "co.nz", "org.nz", "co.za", "org.za", "co.kr", "or.kr",
+    "com.mx", "com.tr", "com.ru", "com.ua", "com.pl", "com.ar", "com.co",
+    "com.sg", "com.my", "com.hk", "com.tw", "com.vn", "com.pk", "com.ng",
+    "co.id", "or.id", "web.id", "co.il", "co.th", "in.th",
+}
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+def hash64(value):
+    """Stable 64-bit hash of a string (BLAKE2b, so it survives restarts)."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _split(url):
+    url = url.strip()
+    if "://" not in url:
+        # Users often paste "example.com/path" without a scheme
+        url = "http://" + url
+    return urlsplit(url)
+
+
+def normalize_host(host):
+    """Lowercases, strips trailing dots and IDNA-encodes a hostname."""
+    host = host.strip().rstrip(".").lower()
+    if host.startswith("[") and host.endswith("]"):
+        return host[1:-1]
+    if host.isascii():
+        return host
+    try:
+        return host.encode("idna").decode("ascii")
+    except UnicodeError:
+        return host
+
+
+def host_of(url):
+    """Normalized hostname (no port, no credentials) of a URL."""
+    try:
+        return normalize_host(_split(url).hostname or "")
+    except ValueError:
+        return normalize_host(url.split("/")[0])
+
+
+def canonicalize_url(url):
+    """
+    Canonical form of a URL for indicator matching: scheme dropped,
+    host normalized, default port removed, fragment removed, duplicate
+    and trailing slashes removed, query parameters sorted.
+    """
+    return _canonical_and_host(url)[0]
+
+
+def _canonical_and_host(url):
+    """(canonical URL, normalized host) with a single parse of `url`."""
+    try:
+        parts = _split(url)
+        host = normalize_host(parts.hostname or "")
+        port = parts.port
+    except ValueError:
+        return url.strip().lower(), host_of(url)
+
+    netloc = host
+    if port is not None and str(port) != DEFAULT_PORTS.get(parts.scheme.lower()):
+        netloc = f"{host}:{port}"
+
+    path = "/".join(segment for segment in parts.path.split("/") if segment)
+    canonical = netloc + ("/" + path if path else "")
+    if parts.query:
+        canonical += "?" + urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return canonical, host
+
+
+def is_ip_address(host):
+    if ":" not in host and not host[-1:].isdigit():
+        # Cheap reject: hostnames never end in a digit, IPv4 always does
+        return False
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def registered_domain(host):
+    """Registrable domain of a host (e.g. a.b.example.co.uk -> example.co.uk)."""
+    if not host or is_ip_address(host):
+        return host
+    labels = host.split(".")
+    if len(labels) <= 2:
+        return host
+    if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _contains(keys, value):
+    i = bisect.bisect_left(keys, value)
+    return i < len(keys) and keys[i] == value
+
+
+class CountedHashSet64:
+    """Sorted 64-bit hashes with a reference count each (e.g. URLs per host)."""
+
+    __slots__ = ("keys", "counts")
+
+    def __init__(self, keys=None, counts=None):
+        self.keys = keys if keys is not None else array("Q")
+        self.counts = counts if counts is not None else array("I")
+
+    @classmethod
+    def from_counts(cls, counter):
+        keys = sorted(counter)
+        return cls(array("Q", keys), array("I", (counter[k] for k in keys)))
+
+    def with_deltas(self, deltas):
+        """Returns a copy with per-key count changes applied; keys reaching zero are dropped."""
+        keys, counts = array("Q", self.keys), array("I", self.counts)
+        for key, delta in sorted(deltas.items()):
+            if delta == 0:
+                continue
+            i = bisect.bisect_left(keys, key)
+            present = i < len(keys) and keys[i] == key
+            new_count = (counts[i] if present else 0) + delta
+            if present and new_count <= 0:
+                del keys[i]
+                del counts[i]
+            elif present:
+                counts[i] = new_count
+            elif new_count > 0:
+                keys.insert(i, key)
+                counts.insert(i, new_count)
+        return CountedHashSet64(keys, counts)
+
+    def __contains__(self, value):
+        return _contains(self.keys, value)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nbytes(self):
+        return len(self.keys) * 12
+
+
+def indicator_hashes(raw_url):
+    """(url, host, registered domain) hashes of a feed URL; 0 when there is no host."""
+    canonical, host = _canonical_and_host(raw_url)
+    if not host:
+        return hash64(canonical), 0, 0
+    return hash64(canonical), hash64(host), hash64(registered_domain(host))
+
+
+def indicator_entries(raw_urls):
+    """Maps each URL hash to its (host, domain) hashes for an iterable of feed URLs."""
+    entries = {}
+    for raw in raw_urls:
+        url_hash, host_hash, domain_hash = indicator_hashes(raw)
+        entries.setdefault(url_hash, (host_hash, domain_hash))
+    return entries
+
+
+class IndicatorIndex:
+    """
+    Malicious URL index with three levels of matching:
+      url    - canonical URL listed in the feed
+      host   - another URL on a host that has listed URLs
+      domain - a host under the same registered domain
+
+    URL hashes are kept sorted with the host/domain hash of each URL in
+    parallel columns, so removals can be applied without the original strings.
+    Instances are never mutated; updates return a new index to swap in.
+    """
+
+    # Above this fraction of changed entries, rebuilding beats in-place edits
+    REBUILD_FRACTION = 0.05
+
+    def __init__(self, url_keys=None, url_hosts=None, url_domains=None, hosts=None, domains=None):
+        self.url_keys = url_keys if url_keys is not None else array("Q")
+        self.url_hosts = url_hosts if url_hosts is not None else array("Q")
+        self.url_domains = url_domains if url_domains is not None else array("Q")
+        self.hosts = hosts if hosts is not None else CountedHashSet64()
+        self.domains = domains if domains is not None else CountedHashSet64()
+
+    @classmethod
+    def build(cls, raw_urls):
+        """Builds an index from an iterable of raw feed URLs."""
+        return cls.from_entries(indicator_entries(raw_urls))
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Builds an index from a {url_hash: (host_hash, domain_hash)} mapping."""
+        url_keys = sorted(entries)
+        host_counts = {}
+        domain_counts = {}
+        for host_hash, domain_hash in entries.values():
+            if host_hash:
+                host_counts[host_hash] = host_counts.get(host_hash, 0) + 1
+                domain_counts[domain_hash] = domain_counts.get(domain_hash, 0) + 1
+        return cls(
+            array("Q", url_keys),
+            array("Q", (entries[k][0] for k in url_keys)),
+            array("Q", (entries[k][1] for k in url_keys)),
+            CountedHashSet64.from_counts(host_counts),
+            CountedHashSet64.from_counts(domain_counts),
+        )
+
+    def entries(self):
+        return {k: (h, d) for k, h, d in zip(self.url_keys, self.url_hosts, self.url_domains)}
+
+    def diff(self, entries):
+        """Returns (added, removed) between this index and a new entries mapping:
+        added is {url_hash: (host_hash, domain_hash)}, removed a set of URL hashes."""
+        current = set(self.url_keys)
+        added = {k: v for k, v in entries.items() if k not in current}
+        removed = current.difference(entries)
+        return added, removed
+
+    def apply_diff(self, added, removed):
+        """Returns a new index with `added` entries inserted and `removed` URL hashes dropped."""
+        if len(added) + len(removed) > max(len(self.url_keys), 1) * self.REBUILD_FRACTION:
+            entries = self.entries()
+            for key in removed:
+                entries.pop(key, None)
+            entries.update(added)
+            return IndicatorIndex.from_entries(entries)
+
+        url_keys = array("Q", self.url_keys)
+        url_hosts = array("Q", self.url_hosts)
+        url_domains = array("Q", self.url_domains)
+        host_deltas = {}
+        domain_deltas = {}
+
+        for key in removed:
+            i = bisect.bisect_left(url_keys, key)
+            if i < len(url_keys) and url_keys[i] == key:
+                if url_hosts[i]:
+                    host_deltas[url_hosts[i]] = host_deltas.get(url_hosts[i], 0) - 1
+                    domain_deltas[url_domains[i]] = domain_deltas.get(url_domains[i], 0) - 1
+                del url_keys[i], url_hosts[i], url_domains[i]
+
+        for key, (host_hash, domain_hash) in added.items():
+            i = bisect.bisect_left(url_keys, key)
+            if i < len(url_keys) and url_keys[i] == key:
+                continue
+            url_keys.insert(i, key)
+            url_hosts.insert(i, host_hash)
+            url_domains.insert(i, domain_hash)
+            if host_hash:
+                host_deltas[host_hash] = host_deltas.get(host_hash, 0) + 1
+                domain_deltas[domain_hash] = domain_deltas.get(domain_hash, 0) + 1
+
+        return IndicatorIndex(
+            url_keys, url_hosts, url_domains,
+            self.hosts.with_deltas(host_deltas),
+            self.domains.with_deltas(domain_deltas),
+        )
+
+    def lookup(self, url):
+        """Returns 'url', 'host', 'domain' or None for the most specific match."""
+        canonical, host = _canonical_and_host(url)
+        if _contains(self.url_keys, hash64(canonical)):
+            return "url"
+        if not host:
+            return None
+        if hash64(host) in self.hosts:
+            return "host"
+        if hash64(registered_domain(host)) in self.domains:
+            return "domain"
+        return None
+
+    def __contains__(self, url):
+        return _contains(self.url_keys, hash64(canonicalize_url(url)))
+
+    def __len__(self):
+        return len(self.url_keys)
+
+    def nbytes(self):
+        return len(self.url_keys) * 24 + self.hosts.nbytes() + self.domains.nbytes()
+
+
+# --- Snapshots ---
+# Layout: magic, uint32 header length, JSON header, then 8-byte aligned columns.
+# Columns are memory-mapped on load, so startup does no parsing or hashing.
+# Besides the index's own columns a snapshot can carry extra named columns
+# (the feed table's), stored and mapped the same way.
+SNAPSHOT_MAGIC = b"CRBIDX01"
+_SNAPSHOT_COLUMNS = (
+    ("url_keys", "Q"), ("url_hosts", "Q"), ("url_domains", "Q"),
+    ("host_keys", "Q"), ("host_counts", "I"),
+    ("domain_keys", "Q"), ("domain_counts", "I"),
+)
+
+
+def _snapshot_columns(index):
+    return {
+        "url_keys": index.url_keys, "url_hosts": index.url_hosts, "url_domains": index.url_domains,
+        "host_keys": index.hosts.keys, "host_counts": index.hosts.counts,
+        "domain_keys": index.domains.keys, "domain_counts": index.domains.counts,
+    }
+
+
+def save_snapshot(index, path, metadata=None, extra_columns=None):
+    """Atomically writes `index` plus JSON-serializable `metadata` to `path`.
+    `extra_columns` maps further column names to (typecode, array or bytes-like)."""
+    extra_columns = extra_columns or {}
+    columns = _snapshot_columns(index)
+    columns.update((name, column) for name, (_, column) in extra_columns.items())
+    layout = []
+    offset = 0
+    for name, typecode in _SNAPSHOT_COLUMNS + tuple((name, t) for name, (t, _) in extra_columns.items()):
+        nbytes = len(columns[name]) * array(typecode).itemsize
+        layout.append({"name": name, "type": typecode, "offset": offset, "length": len(columns[name])})
+        offset += (nbytes + 7) & ~7
+    header = json.dumps({"metadata": metadata or {}, "columns": layout}).encode("utf-8")
+    data_start = (len(SNAPSHOT_MAGIC) + 4 + len(header) + 7) & ~7
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for entry in layout:
+            f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+            column = columns[entry["name"]]
+            f.write(column)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """Memory-maps a snapshot written by `save_snapshot`. Returns (index, metadata, extra_columns),
+    the extra columns as memoryviews into the mapping."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not an indicator snapshot")
+    (header_len,) = struct.unpack_from("<I", mapped, len(SNAPSHOT_MAGIC))
+    header_start = len(SNAPSHOT_MAGIC) + 4
+    header = json.loads(bytes(mapped[header_start:header_start + header_len]))
+    data_start = (header_start + header_len + 7) & ~7
+
+    view = memoryview(mapped)
+    columns = {}
+    for entry in header["columns"]:
+        itemsize = array(entry["type"]).itemsize
+        start = data_start + entry["offset"]
+        columns[entry["name"]] = view[start:start + entry["length"] * itemsize].cast(entry["type"])
+
+    index = IndicatorIndex(
+        columns.pop("url_keys"), columns.pop("url_hosts"), columns.pop("url_domains"),
+        CountedHashSet64(columns.pop("host_keys"), columns.pop("host_counts")),
+        CountedHashSet64(columns.pop("domain_keys"), columns.pop("domain_counts")),
+    )
+    return index, header["metadata"], columns
+
+
+class DomainTrie:
+    """
+    Suffix trie over reversed domain labels (com -> example -> www).
+    A host matches if it equals an entry or is a subdomain of one.
+    """
+
+    _END = None  # marks that the path from the root is a complete entry
+
+    def __init__(self, domains=()):
+        self._root = {}
+        self._size = 0
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        node = self._root
+        for label in reversed(normalize_host(domain).split(".")):
+            node = node.setdefault(label, {})
+        if self._END not in node:
+            node[self._END] = True
+            self._size += 1
+
+    def match(self, host):
+        """Returns the listed domain that `host` falls under, or None."""
+        node = self._root
+        labels = normalize_host(host).split(".")
+        for depth, label in enumerate(reversed(labels), start=1):
+            node = node.get(label)
+            if node is None:
+                return None
+            if self._END in node:
+                return ".".join(labels[-depth:])
+        return None
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def __len__(self):
+        return self._size
+
+
+def load_domain_list(path):
+    """Reads one domain per line ('#' comments allowed) into a DomainTrie."""
+    trie = DomainTrie()
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                trie.add(line)
+    return trie
@@ -0,0 +1,263 @@
+import copy
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+
+import config
+import model_utils
+
+INFERENCE_BACKENDS = ("eager", "int8", "torchscript", "compile", "onnx")
+
+# Inputs used to trace/export a model and to sanity-check the result at startup.
+# Mixed lengths so the export sees a padded batch.
+PARITY_PROBES = (
+    "http://google.com",
+    "https://www.bnymellon.com",
+    "http://suspicious-site.com/login",
+    "http://paypal-verification-secure.com/account/update?session=8f2a",
+    "Hi team, the quarterly report is attached. Let me know if you have questions before Friday.",
+    "URGENT: your account has been suspended. Verify your password within 24 hours at the link below to avoid closure.",
+    "Congratulations! You have won a $1000 gift card. Click here to claim your prize now, limited time offer.",
+    "Meeting moved to 3pm tomorrow, same room.",
+)
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """Applies the configured PyTorch thread counts (0 keeps the PyTorch default)."""
+    intra_op = config.INTRA_OP_THREADS if intra_op is None else intra_op
+    inter_op = config.INTER_OP_THREADS if inter_op is None else inter_op
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # Only allowed before the first inter-op parallel work has started
+            print(f"Could not set inter-op threads to {inter_op}: {e}")
+
+
+def cache_dir_for(model_path):
+    """Directory holding exported artifacts for `model_path`: a sibling
+    `<model>.compiled/` directory unless INFERENCE_CACHE_DIR is set."""
+    name = os.path.basename(os.path.normpath(model_path))
+    if config.INFERENCE_CACHE_DIR:
+        return os.path.join(config.INFERENCE_CACHE_DIR, name)
+    return os.path.normpath(model_path) + ".compiled"
+
+
+def example_inputs(tokenizer, device, texts=PARITY_PROBES[:2]):
+    return {k: v.to(device) for k, v in model_utils.pad_encodings(model_utils.encode(texts, tokenizer), tokenizer).items()}
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Positional-argument wrapper returning bare logits, as tracing and ONNX export need."""
+
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = list(input_names)
+
+    def forward(self, *tensors):
+        return self.model(**dict(zip(self.input_names, tensors))).logits
+
+
+class EagerBackend:
+    """The fp32 Hugging Face model as loaded."""
+
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+
+    def logits(self, inputs):
+        with torch.no_grad():
+            return self.model(**inputs).logits
+
+
+class Int8Backend(EagerBackend):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations
+    quantized on the fly). CPU only; the fp32 model is left untouched."""
+
+    name = "int8"
+
+    def __init__(self, model):
+        if next(model.parameters()).device.type != "cpu":
+            raise RuntimeError("int8 dynamic quantization only runs on CPU")
+        super().__init__(torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class TorchScriptBackend:
+    """Traced and frozen TorchScript module, cached as a .pt file."""
+
+    name = "torchscript"
+
+    def __init__(self, model, tokenizer, path):
+        self.input_names = list(example_inputs(tokenizer, "cpu").keys())
+        device = next(model.parameters()).device
+        if os.path.exists(path):
+            self.module = torch.jit.load(path, map_location=device)
+        else:
+            inputs = example_inputs(tokenizer, device)
+            with torch.no_grad():
+                traced = torch.jit.trace(
+                    _LogitsOnly(model, self.input_names), tuple(inputs[n] for n in self.input_names), strict=False)
+            self.module = torch.jit.freeze(traced.eval())
+            _atomic_save(path, lambda tmp: torch.jit.save(self.module, tmp))
+
+    def logits(self, inputs):
+        with torch.no_grad():
+            return self.module(*(inputs[n] for n in self.input_names))
+
+
+class CompileBackend(EagerBackend):
+    """torch.compile with dynamic shapes. Compiled kernels are cached by
+    Inductor in the model's cache directory, so restarts skip most codegen."""
+
+    name = "compile"
+
+    def __init__(self, model, tokenizer, cache_dir):
+        # Inductor reads this lazily; torch fills in a /tmp default at import, so assign rather than setdefault
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(cache_dir, "inductor")
+        super().__init__(torch.compile(model, dynamic=True))
+        # Compile now rather than on the first request
+        self.logits(example_inputs(tokenizer, next(model.parameters()).device))
+
+
+class OnnxBackend:
+    """ONNX Runtime session over an exported graph with dynamic batch and sequence axes."""
+
+    name = "onnx"
+
+    def __init__(self, model, tokenizer, path):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("onnxruntime is not installed (pip install onnxruntime)")
+
+        inputs = example_inputs(tokenizer, "cpu")
+        self.input_names = list(inputs.keys())
+        if not os.path.exists(path):
+            cpu_model = copy.deepcopy(model).cpu()
+            dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in self.input_names}
+            dynamic_axes["logits"] = {0: "batch"}
+            with torch.no_grad():
+                _atomic_save(path, lambda tmp: torch.onnx.export(
+                    _LogitsOnly(cpu_model, self.input_names), tuple(inputs[n] for n in self.input_names), tmp,
+                    input_names=self.input_names, output_names=["logits"], dynamic_axes=dynamic_axes,
+                    opset_version=17, dynamo=False))
+
+        options = onnxruntime.SessionOptions()
+        if config.INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = config.INTRA_OP_THREADS
+        if config.INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = config.INTER_OP_THREADS
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def logits(self, inputs):
+        feed = {n: inputs[n].cpu().numpy() for n in self.input_names}
+        return torch.from_numpy(self.session.run(["logits"], feed)[0])
+
+
+def _atomic_save(path, save):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def build_backend(name, model, tokenizer, model_path, model_id):
+    """Constructs the named backend without any fallback."""
+    if name not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Expected one of: {', '.join(INFERENCE_BACKENDS)}")
+    cache_dir = cache_dir_for(model_path)
+    # Exports are keyed by the model fingerprint so retrained weights are never served stale graphs
+    artifact = model_id.rsplit(":", 1)[-1]
+    if name == "int8":
+        return Int8Backend(model)
+    if name == "torchscript":
+        return TorchScriptBackend(model, tokenizer, os.path.join(cache_dir, f"torchscript-{artifact}.pt"))
+    if name == "compile":
+        return CompileBackend(model, tokenizer, cache_dir)
+    if name == "onnx":
+        return OnnxBackend(model, tokenizer, os.path.join(cache_dir, f"onnx-{artifact}.onnx"))
+    return EagerBackend(model)
+
+
+def check_parity(model, backend, tokenizer, texts, batch_size=16):
+    """
+    Compares `backend` logits with the fp32 model on `texts`.
+    Returns agreement of the predicted class, logit and confidence drift,
+    per-text timings, and the indices of texts whose verdict changed.
+    """
+    reference = EagerBackend(model)
+    texts = list(texts)
+    disagreements = []
+    max_logit_diff = 0.0
+    max_confidence_diff = 0.0
+    timings = {"fp32_ms": 0.0, "backend_ms": 0.0}
+
+    for start in range(0, len(texts), batch_size):
+        inputs = model_utils.pad_encodings(model_utils.encode(texts[start:start + batch_size], tokenizer), tokenizer)
+        started = time.perf_counter()
+        expected = reference.logits(inputs).float().cpu()
+        timings["fp32_ms"] += (time.perf_counter() - started) * 1000.0
+        started = time.perf_counter()
+        actual = backend.logits(inputs).float().cpu()
+        timings["backend_ms"] += (time.perf_counter() - started) * 1000.0
+
+        max_logit_diff = max(max_logit_diff, (expected - actual).abs().max().item())
+        expected_probs, actual_probs = F.softmax(expected, dim=1), F.softmax(actual, dim=1)
+        expected_idx, actual_idx = expected_probs.argmax(dim=1), actual_probs.argmax(dim=1)
+        confidence_diff = (expected_probs.gather(1, expected_idx[:, None]) - actual_probs.gather(1, expected_idx[:, None])).abs()
+        max_confidence_diff = max(max_confidence_diff, confidence_diff.max().item())
+        for offset in (expected_idx != actual_idx).nonzero().flatten().tolist():
+            disagreements.append(start + offset)
+
+    count = len(texts)
+    return {
+        "backend": backend.name,
+        "texts": count,
+        "verdict_agreement": (count - len(disagreements)) / count if count else 1.0,
+        "disagreements": disagreements,
+        "max_logit_diff": max_logit_diff,
+        "max_confidence_diff": max_confidence_diff,
+        "fp32_ms_per_text": timings["fp32_ms"] / count if count else 0.0,
+        "backend_ms_per_text": timings["backend_ms"] / count if count else 0.0,
+    }
+
+
+def parity_ok(report):
+    if report["verdict_agreement"] < config.INFERENCE_PARITY_MIN_AGREEMENT:
+        return False
+    max_diff = config.INFERENCE_PARITY_MAX_LOGIT_DIFF
+    return max_diff <= 0 or report["max_logit_diff"] <= max_diff
+
+
+def create_backend(model, tokenizer, model_path, model_id, name=None):
+    """
+    Builds the configured inference backend for a loaded fp32 model.
+
+    Non-eager backends are checked against the fp32 logits on PARITY_PROBES
+    first; if the export fails or changes a verdict, the eager model is used
+    instead, so switching backends never silently changes results.
+    """
+    name = (name or config.INFERENCE_BACKEND).lower()
+    if name == "eager":
+        return EagerBackend(model)
+    try:
+        backend = build_backend(name, model, tokenizer, model_path, model_id)
+        report = check_parity(model, backend, tokenizer, PARITY_PROBES)
+    except Exception as e:
+        print(f"Inference backend '{name}' unavailable for {model_path}: {e}. Using eager fp32.")
+        return EagerBackend(model)
+
+    if not parity_ok(report):
+        print(f"Inference backend '{name}' failed the parity check for {model_path} "
+              f"(agreement {report['verdict_agreement']:.2%}, max logit diff {report['max_logit_diff']:.4f}). Using eager fp32.")
+        return EagerBackend(model)
+    print(f"Using '{name}' inference for {model_path} "
+          f"(max logit diff {report['max_logit_diff']:.4f}, {report['backend_ms_per_text']:.1f} ms/text vs {report['fp32_ms_per_text']:.1f} fp32).")
+    return backend
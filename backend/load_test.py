@@ -0,0 +1,215 @@
+"""Load test of URL scans: the threaded Flask server against the ASGI server.
+
+    python load_test.py
+    python load_test.py --servers sync,asgi --concurrency 8,32,128 --requests 400 --tls-ms 1500
+    python load_test.py --servers sync --sync-threads 8     # a gthread-style fixed worker pool
+
+Each server runs in its own subprocess (`python load_test.py serve ...`):
+  sync - werkzeug's threaded server, as `python app.py` runs it (one thread per
+         request, or a fixed pool with --sync-threads).
+  asgi - asgi:application under uvicorn.
+
+DNS and TLS are replaced by the benchmark stubs with --dns-ms / --tls-ms of
+simulated latency, standing in for slow or unreachable hosts. The server
+writes incidents to a scratch database. Client threads POST
+/api/analyze/url with explain=none. Every request uses a new host, so the
+forensics and result caches never answer for it. Per server and concurrency
+level the report gives throughput, p50/p95/p99 latency and the number of
+429s and other errors.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERS = ("sync", "asgi")
+
+
+# --- Server side ---
+
+def serve(args):
+    scratch = tempfile.mkdtemp(prefix="cerebro-load-")
+    os.environ.setdefault("CEREBRO_DATABASE_PATH", os.path.join(scratch, "incident_logs.db"))
+    os.environ.setdefault("CEREBRO_FEED_REFRESH_SECONDS", "-1")  # never fetch the feed
+    os.environ.setdefault("CEREBRO_FEED_SNAPSHOT_PATH", os.path.join(scratch, "urlhaus_snapshot.bin"))
+    os.environ.setdefault("CEREBRO_MODEL_WARMUP", "lazy")
+    # Measure the transformer path, not the lexical prefilter
+    os.environ.setdefault("CEREBRO_URL_PREFILTER_MODE", "off")
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as app_module
+    from benchmark import stub_forensics
+    stub_forensics(app_module.threat_intel, args)
+    for name in ("url", "email"):  # /api/ready waits for both
+        app_module.model_registry.get(name)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if args.server == "asgi":
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.application, host="127.0.0.1", port=args.port, log_level="warning")
+        return
+
+    from werkzeug.serving import BaseWSGIServer, make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if args.sync_threads:
+        class PooledWSGIServer(BaseWSGIServer):
+            """Fixed worker pool, like gunicorn's gthread workers."""
+
+            def __init__(self, *server_args):
+                super().__init__(*server_args)
+                self.pool = ThreadPoolExecutor(max_workers=args.sync_threads)
+
+            def process_request(self, request, client_address):
+                self.pool.submit(self._handle, request, client_address)
+
+            def _handle(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        server = PooledWSGIServer("127.0.0.1", args.port, app_module.app)
+    else:
+        server = make_server("127.0.0.1", args.port, app_module.app, threaded=True)
+    server.serve_forever()
+
+
+# --- Client side ---
+
+def wait_ready(base_url, proc, timeout):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server exited with status {proc.returncode}")
+        try:
+            if requests.get(f"{base_url}/api/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {base_url} not ready after {timeout}s")
+
+
+def run_level(base_url, label, concurrency, total, timeout):
+    """`total` scans from `concurrency` client threads; returns (latencies, wall, statuses)."""
+    import requests
+    local = threading.local()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def scan(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        url = f"https://login-{label}-{concurrency}-{i}.example.test/verify/account"
+        started = time.perf_counter()
+        try:
+            status = session.post(f"{base_url}/api/analyze/url", json={"url": url, "explain": "none"},
+                                  timeout=timeout).status_code
+        except requests.RequestException:
+            status = "error"
+        elapsed = (time.perf_counter() - started) * 1000.0
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(scan, range(total)))
+    return latencies, time.perf_counter() - started, statuses
+
+
+def run_server(args, server, port):
+    from benchmark import summarize
+    command = [sys.executable, os.path.abspath(__file__), "serve", "--server", server, "--port", str(port),
+               "--dns-ms", str(args.dns_ms), "--tls-ms", str(args.tls_ms), "--sync-threads", str(args.sync_threads)]
+    proc = subprocess.Popen(command, cwd=BACKEND_DIR)
+    base_url = f"http://127.0.0.1:{port}"
+    report = {}
+    try:
+        wait_ready(base_url, proc, args.ready_timeout)
+        run_level(base_url, f"{server}-warmup", 2, 4, args.timeout)
+        for concurrency in args.concurrency:
+            print(f"{server}: {args.requests} scans at concurrency {concurrency}...", file=sys.stderr)
+            latencies, wall, statuses = run_level(base_url, server, concurrency, args.requests, args.timeout)
+            summary = summarize(latencies, wall, statuses.get(200, 0), args.requests - statuses.get(200, 0))
+            summary["rejected_429"] = statuses.get(429, 0)
+            summary["statuses"] = {str(k): v for k, v in statuses.items()}
+            for key in ("rss_mb", "peak_rss_mb"):
+                summary.pop(key, None)  # the client's, not the server's
+            report[str(concurrency)] = summary
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+    serve_parser = sub.add_parser("serve", help="run one server (used by the driver)")
+    serve_parser.add_argument("--server", choices=SERVERS, required=True)
+    serve_parser.add_argument("--port", type=int, required=True)
+    for p in (parser, serve_parser):
+        p.add_argument("--dns-ms", type=float, default=50.0, help="simulated DNS lookup latency")
+        p.add_argument("--tls-ms", type=float, default=1000.0, help="simulated TLS handshake latency")
+        p.add_argument("--sync-threads", type=int, default=0,
+                       help="fixed worker threads for the sync server (0 = a thread per request)")
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--concurrency", default="8,32,64", help="comma-separated client thread counts")
+    parser.add_argument("--requests", type=int, default=200, help="scans per concurrency level")
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request, seconds")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args)
+        return 0
+
+    sys.path.insert(0, BACKEND_DIR)
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    servers = [s.strip() for s in args.servers.split(",") if s.strip()]
+    unknown = set(servers) - set(SERVERS)
+    if unknown:
+        parser.error(f"unknown server(s): {', '.join(sorted(unknown))}")
+
+    report = {
+        "meta": {"dns_ms": args.dns_ms, "tls_ms": args.tls_ms, "requests": args.requests,
+                 "sync_threads": args.sync_threads, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")},
+        "servers": {server: run_server(args, server, args.port + i) for i, server in enumerate(servers)},
+    }
+
+    print(f"\n{'server':<8}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'429':>6}{'err':>6}")
+    for server, levels in report["servers"].items():
+        for concurrency, s in levels.items():
+            print(f"{server:<8}{concurrency:>6}{s['throughput_per_s'] or 0:>10.1f}{s.get('p50_ms') or 0:>10.1f}"
+                  f"{s.get('p95_ms') or 0:>10.1f}{s.get('p99_ms') or 0:>10.1f}{s['rejected_429']:>6}"
+                  f"{s['errors'] - s['rejected_429']:>6}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
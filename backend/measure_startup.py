@@ -0,0 +1,80 @@
+"""Measures cold-start time of the backend for each model warm-up mode.
+
+    python measure_startup.py                      # all modes, 3 runs each
+    python measure_startup.py --mode lazy --runs 5
+
+Every run is a fresh interpreter, so imports and model loads are cold (apart
+from the OS page cache). Reported per mode, as the median over runs:
+  import_s      - `import app` finished, i.e. Flask could start serving.
+  ready_s       - /api/ready reports every model loaded.
+  first_email_s - first /api/analyze/email response (includes any lazy load).
+  first_url_s   - first /api/analyze/url response after that.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child interpreter; prints one JSON line of timings
+PROBE = r'''
+import json, os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+if os.environ["CEREBRO_MODEL_WARMUP"] != "lazy":
+    # Lazy mode loads nothing until the first request, so there is nothing to wait for
+    while client.get("/api/ready").status_code != 200:
+        if any(m["state"] == "failed" for m in app.model_registry.status().values()):
+            break
+        time.sleep(0.01)
+ready = time.perf_counter() if app.model_registry.ready() else None
+client.post("/api/analyze/email", json={"text": "Quarterly report attached.", "explain": "none"})
+first_email = time.perf_counter()
+client.post("/api/analyze/url", json={"url": "http://example.com/", "explain": "none"})
+first_url = time.perf_counter()
+print("STARTUP " + json.dumps({
+    "import_s": imported - started,
+    "ready_s": (ready - started) if ready else None,
+    "first_email_s": first_email - started,
+    "first_url_s": first_url - started,
+}))
+'''
+
+
+def run_once(mode):
+    env = dict(os.environ, CEREBRO_MODEL_WARMUP=mode)
+    # Keep the feed refresher from touching the network (or rewriting the snapshot) while measuring
+    env.setdefault("CEREBRO_FEED_REFRESH_SECONDS", "-1")
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    line = next(l for l in out.splitlines() if l.startswith("STARTUP "))
+    return json.loads(line[len("STARTUP "):])
+
+
+def median(values):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("eager", "background", "lazy"), action="append",
+                        help="warm-up mode to measure (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    report = {}
+    for mode in args.mode or ("eager", "background", "lazy"):
+        runs = [run_once(mode) for _ in range(args.runs)]
+        report[mode] = {key: median([r[key] for r in runs]) for key in runs[0]}
+        print(f"{mode}: {report[mode]}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
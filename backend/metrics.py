@@ -0,0 +1,167 @@
+"""Lightweight in-process metrics (counters, gauges and histograms)."""
+import bisect
+import re
+import threading
+
+# Default bucket boundaries, in milliseconds, for latency histograms.
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    def __init__(self, name, labels, help_text=""):
+        self.name = name
+        self.labels = labels
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down (queue depths, pool sizes...)."""
+
+    def __init__(self, name, labels, help_text=""):
+        self.name = name
+        self.labels = labels
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Histogram:
+    """Cumulative bucketed distribution, Prometheus style."""
+
+    def __init__(self, name, labels, buckets, help_text=""):
+        self.name = name
+        self.labels = labels
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Returns cumulative bucket counts plus count/sum/mean."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = {}
+        running = 0
+        for bound, n in zip(self.buckets, counts):
+            running += n
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = running + counts[-1]
+        return {
+            "buckets": cumulative,
+            "count": count,
+            "sum": round(total, 3),
+            "mean": round(total / count, 3) if count else 0.0,
+        }
+
+
+class Registry:
+    """Get-or-create store for named metrics, keyed by name and label set."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = cls(name, dict(labels or {}), **kwargs)
+                self._metrics[key] = metric
+            return metric
+
+    def counter(self, name, labels=None, help_text=""):
+        return self._get_or_create(Counter, name, labels, help_text=help_text)
+
+    def gauge(self, name, labels=None, help_text=""):
+        return self._get_or_create(Gauge, name, labels, help_text=help_text)
+
+    def histogram(self, name, labels=None, buckets=LATENCY_BUCKETS_MS, help_text=""):
+        return self._get_or_create(Histogram, name, labels, buckets=buckets, help_text=help_text)
+
+    def collect(self):
+        """Returns a list of all registered metric objects."""
+        with self._lock:
+            return list(self._metrics.values())
+
+
+def _prometheus_labels(labels, extra=None):
+    items = dict(labels, **(extra or {}))
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in items.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(items, escaped)) + "}"
+
+
+def render_prometheus(registry):
+    """Renders every metric in `registry` in the Prometheus text exposition format (0.0.4)."""
+    families = {}
+    for metric in registry.collect():
+        families.setdefault(re.sub(r"[^a-zA-Z0-9_:]", "_", metric.name), []).append(metric)
+
+    lines = []
+    for name in sorted(families):
+        metrics = families[name]
+        kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metrics[0])]
+        help_text = next((m.help for m in metrics if m.help), "")
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for metric in metrics:
+            if kind != "histogram":
+                lines.append(f"{name}{_prometheus_labels(metric.labels)} {metric.value}")
+                continue
+            snapshot = metric.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{name}_bucket{_prometheus_labels(metric.labels, {'le': bound})} {count}")
+            lines.append(f"{name}_sum{_prometheus_labels(metric.labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{_prometheus_labels(metric.labels)} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+registry = Registry()
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import config
+import inference_backends
+import model_utils
+import timing
+from worker_pool import InferenceWorkerPool, NoWorkersAvailable
+
+
+class ModelUnavailable(Exception):
+    """Raised when a model failed to load."""
+
+
+class ModelHandle:
+    """
+    One model's serving stack, built on first use: the fp32 model and
+    tokenizer, the inference backend and the micro-batcher. The model ID is
+    computed up front from file metadata, so cache keys never wait on a load.
+
+    With a worker pool attached, predictions and explanations run in the
+    worker processes; the local model is the fallback while none is ready.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.model_id = model_utils.model_fingerprint(path)
+        self.state = "unloaded"
+        self.error = None
+        self.load_seconds = None
+
+        self.model = None
+        self.tokenizer = None
+        self.backend = None
+        self.batcher = None
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the handle with everything loaded, loading it now if needed.
+        Concurrent callers wait for the same load. Raises ModelUnavailable."""
+        if self.state != "ready":
+            with self._lock:
+                if self.state not in ("ready", "failed"):
+                    with timing.stage("model_load"):
+                        self._load()
+        if self.state == "failed":
+            raise ModelUnavailable(f"{self.name} model not loaded: {self.error}")
+        return self
+
+    def _load(self):
+        self.state = "loading"
+        started = time.perf_counter()
+        print(f"Loading {self.name} model from {self.path}...")
+        try:
+            model, tokenizer = model_utils.load_model(self.path)
+            if model is None:
+                raise RuntimeError(f"could not load {self.path}")
+            if self.pool is not None:
+                # Workers build their own backends; the local model only covers gaps
+                self.backend = inference_backends.EagerBackend(model)
+            else:
+                self.backend = inference_backends.create_backend(model, tokenizer, self.path, self.model_id)
+            self.batcher = model_utils.BatchScheduler(
+                model, tokenizer, name=self.name, backend=self.backend, offload=self._offload_predict)
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            return
+        self.model, self.tokenizer = model, tokenizer
+        self.load_seconds = time.perf_counter() - started
+        self.state = "ready"
+        print(f"{self.name} model ready in {self.load_seconds:.2f}s.")
+
+    def _offload_predict(self, encodings):
+        if self.pool is None:
+            raise NoWorkersAvailable("no worker pool")
+        return self.pool.submit("predict", self.name, encodings)
+
+    def predict_batch(self, texts):
+        """Classifies `texts` in one call, on a worker if one is ready.
+        Returns a list of (pred_label_idx, confidence)."""
+        encodings = model_utils.encode(texts, self.tokenizer)
+        try:
+            future = self._offload_predict(encodings)
+        except NoWorkersAvailable:
+            return model_utils.predict_encoded(encodings, self.model, self.tokenizer, self.backend)
+        return self.pool.result(future)
+
+    def explain(self, text, target_class=None, mode="full", encoding=None):
+        """model_utils.explain_prediction for this model, on a worker if one is ready."""
+        with timing.stage("explain"):
+            if self.pool is not None:
+                try:
+                    return self.pool.result(self.pool.submit("explain", self.name, text, target_class, mode, encoding))
+                except NoWorkersAvailable:
+                    pass
+            return model_utils.explain_prediction(
+                text, self.model, self.tokenizer, target_class=target_class, mode=mode, encoding=encoding)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "model_id": self.model_id,
+            "backend": self.backend.name if self.backend is not None else None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """
+    Named models loaded according to `warmup`:
+      eager      - load every model before returning from warm_up().
+      background - load all models concurrently in daemon threads.
+      lazy       - load each model on its first request.
+    """
+
+    WARMUP_MODES = ("eager", "background", "lazy")
+
+    def __init__(self):
+        self._handles = {}
+        self.pool = None
+
+    def register(self, name, path):
+        self._handles[name] = ModelHandle(name, path)
+        return self._handles[name]
+
+    def handle(self, name):
+        """The handle without loading it (for IDs and status)."""
+        return self._handles[name]
+
+    def get(self, name):
+        return self._handles[name].get()
+
+    def start_pool(self, workers=None):
+        """Starts worker processes serving every registered model (see worker_pool)."""
+        self.pool = InferenceWorkerPool({name: h.path for name, h in self._handles.items()}, workers=workers)
+        for handle in self._handles.values():
+            handle.pool = self.pool
+        self.pool.start()
+        return self.pool
+
+    def warm_up(self, mode=None):
+        mode = (mode or config.MODEL_WARMUP).lower()
+        if mode not in self.WARMUP_MODES:
+            print(f"Unknown model warm-up mode '{mode}', using background.")
+            mode = "background"
+        if mode == "lazy":
+            return
+        threads = [threading.Thread(target=self._warm, args=(handle,), name=f"warmup-{handle.name}", daemon=True)
+                   for handle in self._handles.values()]
+        for thread in threads:
+            thread.start()
+        if mode == "eager":
+            for thread in threads:
+                thread.join()
+
+    def _warm(self, handle):
+        try:
+            handle.get()
+        except ModelUnavailable as e:
+            print(e)
+
+    def ready(self):
+        return all(handle.state == "ready" for handle in self._handles.values())
+
+    def status(self):
+        return {name: handle.status() for name, handle in self._handles.items()}
+
+
+# Singleton instance
+model_registry = ModelRegistry()
@@ -1,30 +1,193 @@
 
 import torch
 import torch.nn.functional as F
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from captum.attr import LayerIntegratedGradients, TokenReferenceBase, visualization
 import numpy as np
 import os
+import hashlib
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import config
+import timing
+from metrics import registry
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Padding overhead across all forward passes, to size the length buckets
+padding_tokens = registry.counter(
+    "inference_padding_tokens_total", help_text="Pad tokens fed to the models.")
+real_tokens = registry.counter(
+    "inference_tokens_total", help_text="Non-pad tokens fed to the models.")
+
+_transformers_import_lock = threading.Lock()
+
 def load_model(model_path):
-    """Loads the model and tokenizer from the specified path using AutoClasses."""
+    """Loads the model and tokenizer from the specified path using AutoClasses.
+
+    transformers is imported here rather than at module level because the
+    import alone takes seconds; low_cpu_mem_usage loads safetensors weights
+    straight from the memory-mapped file instead of into a randomly
+    initialised copy first.
+    """
+    # transformers' lazy module is not safe to import from two threads at once
+    with _transformers_import_lock:
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
     try:
         tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path, low_cpu_mem_usage=True)
         model.to(device)
         model.eval()
+        if config.MODEL_MMAP_WEIGHTS and device.type == "cpu":
+            share_safetensors_weights(model, model_path)
         return model, tokenizer
     except Exception as e:
         print(f"Error loading model from {model_path}: {e}")
         return None, None
 
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+def map_safetensors(path):
+    """
+    Returns {name: tensor} viewing a copy-on-write mmap of a .safetensors file.
+    Nothing is read up front; pages are faulted in from the page cache on use
+    and shared by every process mapping the same file.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_len = struct.unpack("<Q", mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_len])
+    data_start = 8 + header_len
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__" or info["dtype"] not in _SAFETENSORS_DTYPES:
+            continue
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        flat = torch.frombuffer(mapped, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=data_start + begin)
+        tensors[name] = flat.view(info["shape"])
+    return tensors
+
+def share_safetensors_weights(model, model_path):
+    """
+    Re-points the model's parameters at views of the mmapped safetensors file,
+    dropping the private copies made while loading. Several processes serving
+    the same model then share one copy of the weights through the page cache.
+    Tensors whose name, shape or dtype differ from the file are left alone.
+    Returns the number of tensors now backed by the file.
+    """
+    path = os.path.join(model_path, "model.safetensors")
+    if not os.path.exists(path):
+        return 0
+    mapped = map_safetensors(path)
+    current = model.state_dict()
+    shared = {
+        name: tensor for name, tensor in mapped.items()
+        if name in current and current[name].shape == tensor.shape and current[name].dtype == tensor.dtype
+    }
+    model.load_state_dict(shared, strict=False, assign=True)
+    return len(shared)
+
+def model_fingerprint(model_path):
+    """
+    Stable identity for a model directory, used in result-cache keys.
+    Changes whenever the config or the weight files change.
+    """
+    digest = hashlib.sha256()
+    for name in ("config.json", "model.safetensors", "pytorch_model.bin"):
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}".encode("utf-8"))
+    config_path = os.path.join(model_path, "config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "rb") as f:
+            digest.update(f.read())
+    return f"{os.path.basename(os.path.normpath(model_path))}:{digest.hexdigest()[:16]}"
+
+MAX_LENGTH = 512
+
+def encode(texts, tokenizer):
+    """
+    Tokenizes `texts` in one call to the fast tokenizer's batch API, without padding.
+    Returns one encoding per text: a dict of token-id lists (input_ids, attention_mask, ...)
+    that can be passed to prediction and explanation alike, so each text is tokenized once.
+    """
+    with timing.stage("tokenize"):
+        batch = tokenizer(list(texts), truncation=True, max_length=MAX_LENGTH)
+    return [{key: values[i] for key, values in batch.items()} for i in range(len(texts))]
+
+def encode_one(text, tokenizer):
+    return encode([text], tokenizer)[0]
+
+def pad_encodings(encodings, tokenizer):
+    """Right-pads encodings to the longest one and returns a dict of tensors on `device`."""
+    width = max(len(e["input_ids"]) for e in encodings)
+    padded = {}
+    for key in encodings[0]:
+        fill = tokenizer.pad_token_id if key == "input_ids" else 0
+        padded[key] = torch.tensor([e[key] + [fill] * (width - len(e[key])) for e in encodings], device=device)
+    return padded
+
+def length_bucket(length):
+    """Smallest configured bucket bound that fits `length` tokens."""
+    for bound in config.BATCH_LENGTH_BUCKETS:
+        if length <= bound:
+            return bound
+    return MAX_LENGTH
+
+def bucket_by_length(encodings):
+    """Groups encoding indices by length bucket, each group sorted by length,
+    so short URLs and long emails never share a padded forward pass."""
+    groups = {}
+    for i, encoding in enumerate(encodings):
+        groups.setdefault(length_bucket(len(encoding["input_ids"])), []).append(i)
+    return [sorted(indices, key=lambda i: len(encodings[i]["input_ids"])) for _, indices in sorted(groups.items())]
+
+def predict_encoded(encodings, model, tokenizer, backend=None):
+    """
+    Classifies pre-tokenized inputs, one padded forward pass per length bucket.
+    Returns a list of (pred_label_idx, confidence) tuples in input order.
+
+    `backend` (see inference_backends) replaces the eager fp32 forward pass when given.
+    """
+    results = [None] * len(encodings)
+    for indices in bucket_by_length(encodings):
+        inputs = pad_encodings([encodings[i] for i in indices], tokenizer)
+        used = int(inputs["attention_mask"].sum())
+        real_tokens.inc(used)
+        padding_tokens.inc(inputs["attention_mask"].numel() - used)
+
+        with timing.stage("forward"), torch.no_grad():
+            logits = backend.logits(inputs) if backend is not None else model(**inputs).logits
+            probs = F.softmax(logits.float(), dim=1)
+            confidences, pred_label_idx = torch.max(probs, dim=1)
+
+        for i, result in zip(indices, zip(pred_label_idx.tolist(), confidences.tolist())):
+            results[i] = result
+    return results
+
+def predict_batch(texts, model, tokenizer, backend=None):
+    """Tokenizes `texts` in one batch call and classifies them (see predict_encoded)."""
+    return predict_encoded(encode(texts, tokenizer), model, tokenizer, backend)
+
 def predict(text, model, tokenizer):
     """
     Predicts the class (spam/ham or phishing/safe) and returns formatting for visualization.
     """
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=512).to(device)
+    inputs = pad_encodings([encode_one(text, tokenizer)], tokenizer)
     
     with torch.no_grad():
         outputs = model(**inputs)
@@ -34,63 +197,308 @@ def predict(text, model, tokenizer):
 
     return pred_label_idx, confidence, inputs
 
-def explain_prediction(text, model, tokenizer, target_class=None):
+WINDOW_AGGREGATIONS = ("max", "mean", "attention")
+
+class WindowedEncoding:
     """
-    Computes attributions using Integrated Gradients.
-    Returns list of (word, attribution_score) tuples.
+    A long text split into overlapping model-sized windows.
+    `offsets[i]` is the position of window i's first body token in `body_ids`
+    and `body_positions[i]` the indices of its non-special tokens; `evaluated`
+    is how many leading windows were classified (lazy evaluation may stop
+    early), which is also how many get explained.
     """
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=512)
-    input_ids = inputs["input_ids"].to(device)
-    token_type_ids = inputs["token_type_ids"].to(device) if "token_type_ids" in inputs else None
-    attention_mask = inputs["attention_mask"].to(device)
-    
-    # Forward function for Captum
-    def forward_func(inputs, token_type_ids=None, attention_mask=None):
-        if token_type_ids is not None:
-             pred = model(inputs, token_type_ids=token_type_ids, attention_mask=attention_mask)
-        else:
-             pred = model(inputs, attention_mask=attention_mask)
-        return pred.logits
 
-    # Construct LayerIntegratedGradients
-    # Handle different model architectures for embeddings
+    def __init__(self, body_ids, windows, offsets, body_positions):
+        self.body_ids = body_ids
+        self.windows = windows
+        self.offsets = offsets
+        self.body_positions = body_positions
+        self.evaluated = 0
+
+def encode_windows(text, tokenizer, overlap=None, max_windows=None):
+    """
+    Splits `text` into windows of at most MAX_LENGTH tokens (special tokens
+    included) overlapping by `overlap` tokens, using the fast tokenizer's
+    overflow support. When the text fits in a single window, returns that window
+    as a plain encoding (as `encode_one` would), so short inputs keep the
+    ordinary path without being tokenized again.
+    """
+    overlap = config.WINDOW_OVERLAP_TOKENS if overlap is None else overlap
+    max_windows = max_windows or config.WINDOW_MAX_WINDOWS
+    size = MAX_LENGTH - tokenizer.num_special_tokens_to_add()
+    overlap = min(overlap, size // 2)
+    with timing.stage("tokenize"):
+        batch = tokenizer(text, truncation=True, max_length=MAX_LENGTH, stride=overlap,
+                          return_overflowing_tokens=True, return_special_tokens_mask=True)
+    if len(batch["input_ids"]) <= 1:
+        return {key: values[0] for key, values in batch.items()
+                if key not in ("special_tokens_mask", "overflow_to_sample_mapping")}
+
+    count = min(len(batch["input_ids"]), max_windows)
+    windows, offsets, body_positions, body_ids = [], [], [], []
+    for i in range(count):
+        windows.append({key: batch[key][i] for key in tokenizer.model_input_names if key in batch})
+        positions = [j for j, special in enumerate(batch["special_tokens_mask"][i]) if not special]
+        ids = [batch["input_ids"][i][j] for j in positions]
+        # Each window after the first repeats the last `overlap` body tokens of its predecessor
+        offset = len(body_ids) - overlap if i else 0
+        offsets.append(offset)
+        body_positions.append(positions)
+        body_ids.extend(ids[len(body_ids) - offset:])
+    return WindowedEncoding(body_ids, windows, offsets, body_positions)
+
+def aggregate_window_scores(scores, aggregation):
+    """
+    Combines per-window probabilities of the positive class into one:
+      max       - the most suspicious window decides.
+      mean      - plain average over the evaluated windows.
+      attention - average weighted by softmax(window logit), a soft maximum
+                  that lets one strong window dominate without ignoring the rest.
+    """
+    if aggregation == "max":
+        return max(scores)
+    if aggregation == "mean":
+        return sum(scores) / len(scores)
+    if aggregation == "attention":
+        clipped = np.clip(np.asarray(scores, dtype=np.float64), 1e-6, 1 - 1e-6)
+        logits = np.log(clipped / (1 - clipped))
+        weights = np.exp(logits - logits.max())
+        return float((weights * clipped).sum() / weights.sum())
+    raise ValueError(f"Unknown window aggregation '{aggregation}'. Expected one of: {', '.join(WINDOW_AGGREGATIONS)}")
+
+def classify_windows(windowed, predict_many, positive_class, aggregation=None, early_stop=None, chunk_size=None):
+    """
+    Classifies a WindowedEncoding lazily, `chunk_size` windows at a time,
+    stopping as soon as any window's positive-class probability reaches
+    `early_stop` (0 disables). `predict_many(encodings)` returns
+    (pred_label_idx, confidence) per encoding. Assumes a binary classifier.
+    Returns (pred_label_idx, confidence, window_info).
+    """
+    aggregation = aggregation or config.WINDOW_AGGREGATION
+    early_stop = config.WINDOW_EARLY_STOP_CONFIDENCE if early_stop is None else early_stop
+    chunk_size = chunk_size or config.WINDOW_CHUNK_SIZE
+    if aggregation not in WINDOW_AGGREGATIONS:
+        raise ValueError(f"Unknown window aggregation '{aggregation}'. Expected one of: {', '.join(WINDOW_AGGREGATIONS)}")
+
+    total = len(windowed.windows)
+    scores = []
+    stopped_early = False
+    for start in range(0, total, chunk_size):
+        for pred_idx, confidence in predict_many(windowed.windows[start:start + chunk_size]):
+            scores.append(confidence if pred_idx == positive_class else 1.0 - confidence)
+        if early_stop > 0 and max(scores) >= early_stop and len(scores) < total:
+            stopped_early = True
+            break
+    windowed.evaluated = len(scores)
+
+    positive = aggregate_window_scores(scores, aggregation)
+    pred_idx = positive_class if positive >= 0.5 else 1 - positive_class
+    confidence = positive if pred_idx == positive_class else 1.0 - positive
+    return pred_idx, confidence, {
+        "aggregation": aggregation,
+        "total": total,
+        "evaluated": len(scores),
+        "stopped_early": stopped_early,
+        "scores": scores,
+    }
+
+class _PendingPrediction:
+    __slots__ = ("encoding", "future", "enqueued_at", "started_at", "finished_at")
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+
+def _record_batch_timings(pendings):
+    """Reports the queue wait and inference time of finished predictions to the
+    caller's request trace (they were measured on the batcher thread)."""
+    if any(p.started_at is None or p.finished_at is None for p in pendings):
+        return
+    started = min(p.started_at for p in pendings)
+    timing.record("queue_wait", (started - min(p.enqueued_at for p in pendings)) * 1000.0)
+    timing.record("inference", (max(p.finished_at for p in pendings) - started) * 1000.0)
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of a single model.
+
+    Callers submit one text (or its encoding) at a time; a background thread
+    collects whatever arrives within `max_wait_ms` of the oldest queued
+    request (up to `max_batch_size` items), splits it into length buckets and
+    runs one padded forward pass per bucket, handing each caller its own result.
+    With `offload` set, the forward passes run elsewhere (see worker_pool).
+    """
+
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, model, tokenizer, name, max_batch_size=None, max_wait_ms=None, backend=None, offload=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.backend = backend
+        # offload(encodings) -> Future of results, e.g. a worker pool; raises to run in-process
+        self.offload = offload
+        self.name = name
+        self.max_batch_size = max_batch_size or config.BATCH_MAX_SIZE
+        self.max_wait = (config.BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+
+        labels = {"model": name}
+        self.batch_size_hist = registry.histogram(
+            "inference_batch_size", labels, buckets=self.BATCH_SIZE_BUCKETS,
+            help_text="Requests merged into each forward pass.")
+        self.queue_wait_hist = registry.histogram(
+            "inference_queue_wait_ms", labels,
+            help_text="Time a request spent queued before its batch ran.")
+        self.batches_total = registry.counter(
+            "inference_batches_total", labels, help_text="Forward passes executed.")
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, encoding=None):
+        """Queues `text` and returns a Future resolving to (pred_label_idx, confidence).
+        Pass `encoding` (from `encode`) to skip tokenizing again; otherwise the
+        text is tokenized here, on the caller's thread."""
+        return self._enqueue(text, encoding).future
+
+    def _enqueue(self, text, encoding):
+        pending = _PendingPrediction(encoding if encoding is not None else encode_one(text, self.tokenizer))
+        self._queue.put(pending)
+        return pending
+
+    def predict(self, text, timeout=None, encoding=None):
+        """Blocking convenience wrapper around `submit`."""
+        pending = self._enqueue(text, encoding)
+        result = pending.future.result(timeout=timeout)
+        _record_batch_timings([pending])
+        return result
+
+    def predict_many(self, encodings, timeout=None):
+        """Queues several encodings at once so they can share forward passes."""
+        pendings = [self._enqueue(None, encoding) for encoding in encodings]
+        results = [pending.future.result(timeout=timeout) for pending in pendings]
+        _record_batch_timings(pendings)
+        return results
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window already closed: only take what is queued right now.
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            for pending in batch:
+                self.queue_wait_hist.observe((started - pending.enqueued_at) * 1000.0)
+
+            for indices in bucket_by_length([p.encoding for p in batch]):
+                group = [batch[i] for i in indices]
+                group_started = time.perf_counter()
+                for pending in group:
+                    pending.started_at = group_started
+                self.batch_size_hist.observe(len(group))
+                self.batches_total.inc()
+                if self.offload is not None:
+                    try:
+                        # Resolved by the worker pool; meanwhile the next batch can be collected
+                        self.offload([p.encoding for p in group]).add_done_callback(
+                            lambda future, group=group: self._resolve(group, future))
+                        continue
+                    except Exception:
+                        pass  # no worker available: run it here
+                try:
+                    results = predict_encoded([p.encoding for p in group], self.model, self.tokenizer, self.backend)
+                except Exception as e:
+                    for pending in group:
+                        pending.future.set_exception(e)
+                    continue
+
+                finished = time.perf_counter()
+                for pending, result in zip(group, results):
+                    pending.finished_at = finished
+                    pending.future.set_result(result)
+
+    @staticmethod
+    def _resolve(group, future):
+        error = future.exception()
+        finished = time.perf_counter()
+        for i, pending in enumerate(group):
+            pending.finished_at = finished
+            if error is not None:
+                pending.future.set_exception(error)
+            else:
+                pending.future.set_result(future.result()[i])
+
+    def stats(self):
+        """Batch-size and queue-wait histograms for tuning the batching window."""
+        return {
+            "backend": self.backend.name if self.backend is not None else "eager",
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches_total.value,
+            "batch_size": self.batch_size_hist.snapshot(),
+            "queue_wait_ms": self.queue_wait_hist.snapshot(),
+        }
+
+EXPLAIN_MODES = ("none", "gradient", "fast", "full")
+
+def _word_embeddings(model):
+    """Returns the token embedding table for the supported architectures."""
     if hasattr(model, 'bert'):
-        embeddings = model.bert.embeddings
+        return model.bert.embeddings.word_embeddings
     elif hasattr(model, 'distilbert'):
-        embeddings = model.distilbert.embeddings
+        return model.distilbert.embeddings.word_embeddings
     elif hasattr(model, 'roberta'):
-         embeddings = model.roberta.embeddings
-    else:
-        # Fallback or error
-        print("Warning: Could not identify embedding layer. Explanations might fail.")
-        embeddings = model.base_model.embeddings
+        return model.roberta.embeddings.word_embeddings
+    # Fallback
+    print("Warning: Could not identify embedding layer. Explanations might fail.")
+    return model.get_input_embeddings()
 
-    lig = LayerIntegratedGradients(forward_func, embeddings)
+def explain_prediction(text, model, tokenizer, target_class=None, mode="full", encoding=None):
+    """
+    Computes token attributions for the prediction.
+    Returns list of (word, attribution_score) tuples and the explained class.
 
-    if target_class is None:
-        # Default to predicted class
-        with torch.no_grad():
-            if token_type_ids is not None:
-                outputs = model(input_ids, token_type_ids=token_type_ids, attention_mask=attention_mask)
-            else:
-                outputs = model(input_ids, attention_mask=attention_mask)
-            target_class = torch.argmax(outputs.logits, dim=1).item()
+    Modes:
+      none     - skip attribution entirely.
+      gradient - gradient x input, a single backward pass.
+      fast     - Integrated Gradients with few steps, evaluated in internal batches.
+      full     - Integrated Gradients with the full step count.
 
-    # Compute attributions
-    attributions, delta = lig.attribute(
-        inputs=input_ids,
-        baselines=None,
-        target=target_class,
-        additional_forward_args=(token_type_ids, attention_mask),
-        return_convergence_delta=True
-    )
-    
-    attributions = attributions.sum(dim=2).squeeze(0)
-    attributions = attributions / torch.norm(attributions)
-    attributions = attributions.cpu().detach().numpy()
+    Attribution runs on `inputs_embeds` instead of hooking the embedding layer,
+    so it is safe to run while other threads use the same model for inference.
+    Pass the `encoding` used for the prediction to avoid tokenizing `text` again;
+    a WindowedEncoding is explained window by window and stitched back together.
+    """
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"Unknown explanation mode '{mode}'")
+    if mode == "none":
+        return [], target_class
+    if isinstance(encoding, WindowedEncoding):
+        return _explain_windows(encoding, model, tokenizer, target_class, mode)
+
+    encoding = encoding if encoding is not None else encode_one(text, tokenizer)
+    attributions, target_class = _token_scores(encoding, model, tokenizer, target_class, mode)
+    attributions = attributions / np.linalg.norm(attributions)
     
     # decode tokens
-    tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
+    tokens = tokenizer.convert_ids_to_tokens(encoding["input_ids"])
     
     # Filter out special tokens ([CLS], [SEP], [PAD]) for cleaner visualization
     result = []
@@ -100,3 +508,80 @@ def explain_prediction(text, model, tokenizer, target_class=None):
             
     return result, target_class
 
+def _token_scores(encoding, model, tokenizer, target_class, mode):
+    """Unnormalized attribution per token position of one encoding, and the explained class."""
+    # Deferred: captum is only needed once an explanation is actually requested
+    from captum.attr import IntegratedGradients, InputXGradient
+
+    inputs = pad_encodings([encoding], tokenizer)
+    input_ids = inputs["input_ids"]
+    token_type_ids = inputs.get("token_type_ids")
+    attention_mask = inputs["attention_mask"]
+    
+    # Forward function for Captum
+    def forward_func(inputs_embeds, token_type_ids=None, attention_mask=None):
+        if token_type_ids is not None:
+             pred = model(inputs_embeds=inputs_embeds, token_type_ids=token_type_ids, attention_mask=attention_mask)
+        else:
+             pred = model(inputs_embeds=inputs_embeds, attention_mask=attention_mask)
+        return pred.logits
+
+    word_embeddings = _word_embeddings(model)
+    with torch.no_grad():
+        input_embeds = word_embeddings(input_ids)
+        # Reference input: every token replaced by id 0 ([PAD])
+        baseline_embeds = word_embeddings(torch.zeros_like(input_ids))
+
+        if target_class is None:
+            # Default to predicted class
+            target_class = torch.argmax(forward_func(input_embeds, token_type_ids, attention_mask), dim=1).item()
+
+    # Compute attributions
+    with timing.stage("attribution"):
+        if mode == "gradient":
+            attributions = InputXGradient(forward_func).attribute(
+                input_embeds,
+                target=target_class,
+                additional_forward_args=(token_type_ids, attention_mask)
+            )
+        else:
+            fast = mode == "fast"
+            attributions = IntegratedGradients(forward_func).attribute(
+                input_embeds,
+                baselines=baseline_embeds,
+                target=target_class,
+                additional_forward_args=(token_type_ids, attention_mask),
+                n_steps=config.EXPLAIN_FAST_STEPS if fast else config.EXPLAIN_FULL_STEPS,
+                internal_batch_size=config.EXPLAIN_INTERNAL_BATCH_SIZE if fast else None
+            )
+    
+    return attributions.sum(dim=2).squeeze(0).cpu().detach().numpy(), target_class
+
+def _explain_windows(windowed, model, tokenizer, target_class, mode):
+    """
+    Explains each evaluated window and maps the scores back onto the body
+    tokens; tokens covered by overlapping windows get the mean of their scores.
+    """
+    windows = windowed.windows[:windowed.evaluated or len(windowed.windows)]
+    offsets = windowed.offsets[:len(windows)]
+    if target_class is None:
+        with torch.no_grad():
+            logits = sum(
+                F.log_softmax(model(**pad_encodings([w], tokenizer)).logits, dim=1)[0] for w in windows)
+        target_class = int(torch.argmax(logits).item())
+
+    totals = np.zeros(len(windowed.body_ids))
+    counts = np.zeros(len(windowed.body_ids))
+    for window, offset, positions in zip(windows, offsets, windowed.body_positions):
+        scores, _ = _token_scores(window, model, tokenizer, target_class, mode)
+        body_scores = scores[positions]
+        totals[offset:offset + len(body_scores)] += body_scores
+        counts[offset:offset + len(body_scores)] += 1
+
+    covered = int(np.count_nonzero(counts))
+    stitched = totals[:covered] / counts[:covered]
+    norm = np.linalg.norm(stitched)
+    if norm > 0:
+        stitched = stitched / norm
+    tokens = tokenizer.convert_ids_to_tokens(windowed.body_ids[:covered])
+    return [(token, float(score)) for token, score in zip(tokens, stitched)], target_class
@@ -0,0 +1,372 @@
+"""
+Asynchronous CERT report pipeline.
+
+`submit` assigns IDs and queues an indicator; a background writer collects
+submissions for `window_seconds` after the first one arrives (up to
+`max_bundle_indicators`), groups them by campaign (or, without one, by threat
+type and registered domain) and turns each group into one STIX 2.1 Bundle:
+an Indicator per submission plus a Report referencing them all.
+
+Bundles are appended as NDJSON lines to a gzip archive, one gzip member per
+flush, in segments that rotate at `rotate_mb`. Each submission gets a row in
+an index table recording its bundle's segment and member offset, so reports
+can be queried, fetched and exported without rescanning the archive.
+
+A group whose bundle cannot be built is dropped on its own. If the archive or
+index write fails, the batch's submissions are queued again, up to `retries`
+times, and dropped after that. A retry writes the bundle built the first time,
+so bundle and indicator IDs never change.
+"""
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+from stix2 import Indicator, Bundle, Report
+
+import config
+from indicator_index import host_of, registered_domain
+from metrics import registry
+
+SEGMENT_PREFIX = "reports-"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+
+def _stix_string(value):
+    """Escapes a value for use inside a quoted STIX pattern string."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def group_key(threat_type, content, campaign=None):
+    """Submissions sharing a key are reported in the same bundle."""
+    if campaign:
+        return f"campaign:{campaign}"
+    if threat_type == "Malicious URL":
+        host = host_of(content)
+        return f"url:{registered_domain(host) if host else 'unknown'}"
+    return f"type:{threat_type}"
+
+
+def build_bundle(submissions, key):
+    """One STIX Bundle with an Indicator per submission and a Report covering them."""
+    indicators = []
+    for s in submissions:
+        if s["type"] == "Malicious URL":
+            pattern = f"[url:value = '{_stix_string(s['content'])}']"
+        else:
+            pattern = f"[email-message:body_multipart.body_raw.content MATCHES '{_stix_string(s['content'][:50])}...']"
+        indicators.append(Indicator(
+            id=s["indicator_id"],
+            pattern=pattern,
+            pattern_type="stix",
+            valid_from=s["submitted_at"],
+            name=f"Phishing Indicator: {s['type']}",
+            description=f"Detected by GuardAI Phishing Defense. Type: {s['type']}",
+            labels=["phishing", "malicious-activity"],
+        ))
+    published = max(s["submitted_at"] for s in submissions)
+    campaign = submissions[0].get("campaign")
+    report = Report(
+        name=f"Incident Report - {campaign or key} - {published.strftime('%Y-%m-%d %H:%M')}",
+        description=f"{len(submissions)} indicator(s) reported by analysts ({key}).",
+        published=published,
+        object_refs=[i.id for i in indicators],
+    )
+    bundle = Bundle(objects=indicators + [report])
+    return bundle.id, report.id, json.loads(bundle.serialize())
+
+
+class ReportArchive:
+    """Append-only, rotating gzip NDJSON segments in `directory`."""
+
+    def __init__(self, directory, rotate_bytes):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._current = segments[-1] if segments else None
+        self._read_lock = threading.Lock()
+        self._last_member = (None, None, None)
+
+    def segments(self):
+        return sorted(f for f in os.listdir(self.directory)
+                      if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX))
+
+    def _segment_for_write(self):
+        path = os.path.join(self.directory, self._current) if self._current else None
+        if path is None or os.path.getsize(path) >= self.rotate_bytes:
+            self._current = f"{SEGMENT_PREFIX}{datetime.now():%Y%m%d-%H%M%S-%f}{SEGMENT_SUFFIX}"
+        return self._current
+
+    def append(self, records):
+        """Writes `records` (dicts) as one gzip member. Returns (segment, offset)."""
+        segment = self._segment_for_write()
+        data = gzip.compress("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode("utf-8"))
+        with open(os.path.join(self.directory, segment), "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, offset
+
+    def read_member(self, segment, offset):
+        """Records of the gzip member starting at `offset`. The last member read is
+        cached, since exports walk bundles in archive order."""
+        with self._read_lock:
+            cached_segment, cached_offset, records = self._last_member
+            if (cached_segment, cached_offset) == (segment, offset):
+                return records
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            # GzipFile would read on through the following members; decode just this one
+            decompressor = zlib.decompressobj(wbits=31)
+            chunks = []
+            while not decompressor.eof:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                chunks.append(decompressor.decompress(block))
+        records = [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines() if line]
+        with self._read_lock:
+            self._last_member = (segment, offset, records)
+        return records
+
+    def read_bundle(self, segment, offset, bundle_id):
+        for record in self.read_member(segment, offset):
+            if record["bundle_id"] == bundle_id:
+                return record
+        return None
+
+
+class ReportPipeline:
+    """
+    Queues CERT report submissions and archives them in grouped STIX bundles
+    from a background writer; `index_model` is the SQLAlchemy model of the
+    submission index (see app.CertSubmission).
+    """
+
+    _STOP = object()
+
+    def __init__(self, app, db, index_model, directory=None, window_seconds=None,
+                 max_bundle_indicators=None, rotate_mb=None, max_queue=None, retries=None):
+        self.app = app
+        self.db = db
+        self.index_model = index_model
+        self.window = config.REPORT_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self.max_bundle_indicators = max_bundle_indicators or config.REPORT_MAX_BUNDLE_INDICATORS
+        self.retries = config.REPORT_RETRIES if retries is None else retries
+        directory = directory or config.REPORT_ARCHIVE_DIR or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "submitted_reports")
+        self.archive = ReportArchive(directory, (rotate_mb or config.REPORT_ARCHIVE_ROTATE_MB) * 2 ** 20)
+
+        self._queue = queue.Queue(maxsize=max_queue or config.REPORT_QUEUE_MAX)
+        self._pending = {}  # submission_id -> submission, until archived
+        self._pending_lock = threading.Lock()
+        # Held to check _stopped and enqueue as one step, so nothing lands behind _STOP
+        self._queue_lock = threading.Lock()
+
+        self.submitted = registry.counter("cert_reports_submitted_total", help_text="Indicators reported to CERT.")
+        self.bundles = registry.counter("cert_bundles_written_total", help_text="STIX bundles archived.")
+        self.retried = registry.counter("cert_report_retries_total",
+                                        help_text="Submissions queued again after their batch failed to archive.")
+        self.failed = registry.counter("cert_reports_failed_total", help_text="Submissions dropped without being archived.")
+        self.rejected = registry.counter("cert_reports_rejected_total", help_text="Submissions refused with the queue full.")
+        self.flush_latency = registry.histogram("cert_report_flush_ms", help_text="Time to build and archive one batch.")
+
+        self._stopped = False
+        self._writer = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, threat_type, content, campaign=None):
+        """Queues one indicator and returns its submission record (status 'queued').
+        Raises queue.Full, without queuing it, when the queue is at capacity."""
+        submission = {
+            "submission_id": str(uuid.uuid4()),
+            "indicator_id": f"indicator--{uuid.uuid4()}",
+            "type": threat_type,
+            "content": content,
+            "campaign": campaign or None,
+            "group": group_key(threat_type, content, campaign),
+            "submitted_at": datetime.now(),
+            "status": "queued",
+            "attempts": 0,
+        }
+        with self._pending_lock:
+            self._pending[submission["submission_id"]] = submission
+        with self._queue_lock:
+            stopped = self._stopped
+            if not stopped:
+                try:
+                    self._queue.put_nowait(submission)
+                except queue.Full:
+                    with self._pending_lock:
+                        self._pending.pop(submission["submission_id"], None)
+                    self.rejected.inc()
+                    raise
+        if stopped:
+            # Late submissions during shutdown are archived synchronously
+            self._flush([submission])
+        self.submitted.inc()
+        return self.describe(submission)
+
+    @staticmethod
+    def describe(submission):
+        described = dict(submission, submitted_at=submission["submitted_at"].strftime("%Y-%m-%d %H:%M:%S"))
+        described.pop("record", None)  # the built bundle, kept for retries
+        return described
+
+    def pending(self, submission_id):
+        """The queued (not yet archived) submission with this ID, if any."""
+        with self._pending_lock:
+            submission = self._pending.get(submission_id)
+        return self.describe(submission) if submission else None
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is self._STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_bundle_indicators:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                self._queue.put(self._STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        # Retried submissions keep the bundle built for them the first time, so an
+        # archive member written before a failed commit is only ever repeated verbatim
+        records, built, groups = {}, [], {}
+        for submission in batch:
+            record = submission.get("record")
+            if record is not None:
+                records[record["bundle_id"]] = record
+                built.append(submission)
+            else:
+                groups.setdefault(submission["group"], []).append(submission)
+        for key, submissions in groups.items():
+            # A bad indicator only costs its own group; rebuilding it would fail the same way
+            try:
+                bundle_id, report_id, bundle = build_bundle(submissions, key)
+            except Exception as e:
+                self._give_up(submissions, f"bundle for {key} could not be built: {e}")
+                continue
+            record = {
+                "bundle_id": bundle_id,
+                "report_id": report_id,
+                "group": key,
+                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "submissions": [s["submission_id"] for s in submissions],
+                "bundle": bundle,
+            }
+            for s in submissions:
+                s["bundle_id"] = bundle_id
+                s["record"] = record
+            records[bundle_id] = record
+            built.extend(submissions)
+        if not records:
+            return
+        batch = built
+        records = list(records.values())
+        with self.app.app_context():
+            try:
+                archived_at = datetime.now()
+                rows = [self.index_model(
+                    submission_id=s["submission_id"], indicator_id=s["indicator_id"], bundle_id=s["bundle_id"],
+                    type=s["type"], content=s["content"][:500], campaign=s["campaign"], group_key=s["group"],
+                    submitted_at=s["submitted_at"], archived_at=archived_at, segment="", offset=0,
+                ) for s in batch]
+                # Index rows go in first, so a row the database refuses fails the batch
+                # before anything reaches the append-only archive; the location follows
+                self.db.session.add_all(rows)
+                self.db.session.flush()
+                segment, offset = self.archive.append(records)
+                for row in rows:
+                    row.segment, row.offset = segment, offset
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"CERT report batch of {len(batch)} submissions failed: {e}")
+                self._retry(batch, e)
+                return
+            finally:
+                self.flush_latency.observe((time.perf_counter() - started) * 1000.0)
+        self.bundles.inc(len(records))
+        with self._pending_lock:
+            for s in batch:
+                self._pending.pop(s["submission_id"], None)
+        print(f"[CERT] Archived {len(batch)} indicator(s) in {len(records)} STIX bundle(s) to {segment}")
+
+    def _retry(self, submissions, error):
+        """Queues failed submissions again, dropping those out of attempts. Once stopping,
+        or with the queue full, the next attempt is made here instead."""
+        again = []
+        for s in submissions:
+            s["attempts"] += 1
+            if s["attempts"] > self.retries:
+                self._give_up([s], f"not archived after {s['attempts']} attempts: {error}")
+            else:
+                again.append(s)
+        self.retried.inc(len(again))
+        inline = []
+        with self._queue_lock:
+            for s in again:
+                try:
+                    if self._stopped:
+                        raise queue.Full
+                    self._queue.put_nowait(s)
+                except queue.Full:
+                    inline.append(s)
+        if inline:
+            self._flush(inline)
+
+    def _give_up(self, submissions, reason):
+        self.failed.inc(len(submissions))
+        print(f"CERT report: dropping {len(submissions)} submission(s), {reason}")
+        with self._pending_lock:
+            for s in submissions:
+                self._pending.pop(s["submission_id"], None)
+
+    def shutdown(self, timeout=10.0):
+        """Archives everything queued and stops the writer. Safe to call more than once."""
+        with self._queue_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        # Outside the lock: the writer may need it to requeue while draining a full queue
+        self._queue.put(self._STOP)
+        self._writer.join(timeout)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending": len(self._pending),
+            "submitted": self.submitted.value,
+            "bundles": self.bundles.value,
+            "retried": self.retried.value,
+            "failed": self.failed.value,
+            "rejected": self.rejected.value,
+            "segments": len(self.archive.segments()),
+            "flush_ms": self.flush_latency.snapshot(),
+        }
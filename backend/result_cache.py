@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from metrics import registry
+
+
+def normalize_text(text):
+    """
+    Canonical form of a model input used for cache keys.
+    Both tokenizers lowercase and split on whitespace, so case and
+    whitespace runs never change the model's view of the input.
+    """
+    return " ".join(text.split()).lower()
+
+
+class ResultCache:
+    """
+    Content-addressed cache for model outputs.
+
+    Entries are keyed by model identity plus a hash of the normalized input.
+    The memory tier is an LRU bounded by an approximate byte budget, with a
+    TTL on every entry. An optional SQLite tier keeps entries across restarts.
+    """
+
+    # Purge expired disk rows once every this many writes
+    DISK_PURGE_INTERVAL = 500
+
+    def __init__(self, max_bytes=None, ttl_seconds=None, disk_path=None, name="results"):
+        self.max_bytes = int((config.RESULT_CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes)
+        self.ttl = config.RESULT_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.name = name
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        labels = {"cache": name}
+        self.hits_memory = registry.counter("result_cache_hits_total", dict(labels, tier="memory"))
+        self.hits_disk = registry.counter("result_cache_hits_total", dict(labels, tier="disk"))
+        self.misses = registry.counter("result_cache_misses_total", labels)
+        self.evictions = registry.counter("result_cache_evictions_total", labels)
+
+        disk_path = config.RESULT_CACHE_DISK_PATH if disk_path is None else disk_path
+        self._disk = None
+        self._disk_writes = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @staticmethod
+    def make_key(model_id, text):
+        """Key for `text` as seen by the model identified by `model_id`."""
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalize_text(text).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _open_disk(self, path):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._disk = conn
+            self._disk_lock = threading.Lock()
+        except sqlite3.Error as e:
+            print(f"Result cache disk tier disabled ({path}): {e}")
+
+    def get(self, key):
+        """Returns the cached value or None. Disk hits are promoted to memory."""
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, size, value = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits_memory.inc()
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+
+        if self._disk is not None:
+            value, expires_at = self._disk_get(key, now)
+            if value is not None:
+                self.hits_disk.inc()
+                self._memory_put(key, value, expires_at)
+                return value
+
+        self.misses.inc()
+        return None
+
+    def put(self, key, value):
+        """Stores a JSON-serializable value in every enabled tier."""
+        expires_at = time.time() + self.ttl
+        serialized = json.dumps(value)
+        self._memory_put(key, value, expires_at, size=len(serialized))
+        if self._disk is not None:
+            self._disk_put(key, serialized, expires_at)
+
+    def _memory_put(self, key, value, expires_at, size=None):
+        if size is None:
+            size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions.inc()
+
+    def _disk_get(self, key, now):
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Result cache disk read failed: {e}")
+            return None, None
+        if row is None or row[1] <= now:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _disk_put(self, key, serialized, expires_at):
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, serialized, expires_at)
+                )
+                self._disk_writes += 1
+                if self._disk_writes % self.DISK_PURGE_INTERVAL == 0:
+                    self._disk.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+                self._disk.commit()
+        except sqlite3.Error as e:
+            print(f"Result cache disk write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            entries, used = len(self._entries), self._bytes
+        hits = self.hits_memory.value + self.hits_disk.value
+        lookups = hits + self.misses.value
+        return {
+            "entries": entries,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "disk_tier": self._disk is not None,
+            "hits": {"memory": self.hits_memory.value, "disk": self.hits_disk.value},
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Singleton instance
+result_cache = ResultCache()
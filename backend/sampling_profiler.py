@@ -0,0 +1,111 @@
+"""Opt-in sampling profiler for slow requests.
+
+While enabled (PROFILE_SLOW_REQUEST_MS > 0) a daemon thread samples the stack
+of every thread serving a traced request every PROFILE_SAMPLE_INTERVAL_MS.
+Stacks of the shared helper threads (micro-batchers, forensics probes) are
+sampled too and added to every in-flight request under their thread name, so
+time spent waiting on them can be attributed; with concurrent requests those
+samples are shared.
+
+When a request finishes above the threshold its samples are written in the
+folded-stack format ("frame;frame;frame count" per line) read by
+flamegraph.pl, speedscope and inferno; faster requests are discarded.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import config
+
+HELPER_THREAD_PREFIXES = ("batcher-", "forensics")
+
+
+def _fold(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms=None, interval_ms=None, output_dir=None, keep=None):
+        self.threshold_ms = config.PROFILE_SLOW_REQUEST_MS if threshold_ms is None else threshold_ms
+        self.interval = (interval_ms or config.PROFILE_SAMPLE_INTERVAL_MS) / 1000.0
+        self.output_dir = output_dir or config.PROFILE_DIR or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "profiles")
+        self.keep = keep or config.PROFILE_KEEP
+        self._active = {}  # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dumped = 0
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def begin(self):
+        """Starts sampling the calling thread."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._active[threading.get_ident()] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, label, elapsed_ms):
+        """Stops sampling the calling thread; writes its samples if the request
+        took at least the threshold. Returns the file written, if any."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or elapsed_ms < self.threshold_ms:
+            return None
+        return self._dump(label, elapsed_ms, stacks)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                helpers = [f"[{t.name}];{_fold(frames[t.ident])}" for t in threading.enumerate()
+                           if t.name.startswith(HELPER_THREAD_PREFIXES) and t.ident in frames]
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+                    for helper in helpers:
+                        stacks[helper] += 1
+
+    def _dump(self, label, elapsed_ms, stacks):
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "request"
+        name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{safe_label}-{elapsed_ms:.0f}ms.folded"
+        path = os.path.join(self.output_dir, name)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumped += 1
+        self._prune()
+        print(f"Slow request ({elapsed_ms:.0f} ms, {label}): profile written to {path}")
+        return path
+
+    def _prune(self):
+        dumps = sorted(f for f in os.listdir(self.output_dir) if f.endswith(".folded"))
+        for stale in dumps[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.output_dir, stale))
+            except OSError:
+                pass
+
+
+# Singleton instance
+slow_request_profiler = SlowRequestProfiler()
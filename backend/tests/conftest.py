@@ -0,0 +1,102 @@
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+import zlib
+
+import pytest
+
+# The backend modules import each other by their flat names (`import config`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# Self-signed for CN/SAN localhost, valid until 2126
+TLS_CERT = os.path.join(DATA_DIR, "localhost-cert.pem")
+TLS_KEY = os.path.join(DATA_DIR, "localhost-key.pem")
+
+
+# --- Stub DNS ---
+
+class _StubRecord:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def to_text(self):
+        return self.ip
+
+
+class _StubAnswer(list):
+    def __init__(self, ip, ttl):
+        super().__init__([_StubRecord(ip)])
+        self.rrset = type("RRset", (), {"ttl": ttl})()
+
+
+class StubResolver:
+    """Stands in for dns.resolver.Resolver: answers every name after `latency_ms`."""
+
+    def __init__(self, latency_ms=0, ttl=300):
+        self.latency = latency_ms / 1000.0
+        self.ttl = ttl
+        self.queries = []
+
+    def resolve(self, domain, rdtype="A", lifetime=None):
+        self.queries.append(domain)
+        time.sleep(self.latency)
+        return _StubAnswer("203.0.113.%d" % (zlib.crc32(domain.encode()) >> 24), self.ttl)
+
+
+def stub_certificate_fetch(latency_ms):
+    """Replacement for ThreatIntel._fetch_certificate that sleeps instead of handshaking."""
+    def fetch(domain):
+        time.sleep(latency_ms / 1000.0)
+        return {"valid": True, "issuer": "Stub CA", "subject": domain, "expiry": "Jan  1 00:00:00 2030 GMT"}
+    return fetch
+
+
+@pytest.fixture
+def stub_resolver():
+    return StubResolver()
+
+
+# --- Local TLS server ---
+
+class LocalTLSServer:
+    """Completes TLS handshakes on 127.0.0.1 with the test certificate, counting connections."""
+
+    def __init__(self):
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(TLS_CERT, TLS_KEY)
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.connections = 0
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            try:
+                with self.context.wrap_socket(conn, server_side=True):
+                    pass
+            except (OSError, ssl.SSLError):
+                conn.close()
+
+    def client_context(self):
+        """A client context trusting only the test certificate."""
+        return ssl.create_default_context(cafile=TLS_CERT)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def tls_server():
+    server = LocalTLSServer()
+    yield server
+    server.close()
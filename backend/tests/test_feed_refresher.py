@@ -0,0 +1,155 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from threat_intel import ThreatIntel
+
+HEADER = "# id,dateadded,url,url_status,last_online,threat,tags,urlhaus_link,reporter\n"
+
+
+def feed_csv(*rows):
+    lines = [f'"{row_id}","2026-10-01 10:00:00","{url}","online","2026-10-01 10:00:00",'
+             f'"malware_download","elf,mirai","https://urlhaus.abuse.ch/url/{row_id}/","x"\n'
+             for row_id, url in rows]
+    return (HEADER + "".join(lines)).encode("utf-8")
+
+
+class FeedServer:
+    """Serves `body` with `etag`, answering 304 when the client already has that ETag."""
+
+    def __init__(self):
+        self.body = b""
+        self.etag = None
+        self.requests = []
+        feed = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                feed.requests.append(dict(self.headers))
+                if feed.etag and self.headers.get("If-None-Match") == feed.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(feed.body)))
+                if feed.etag:
+                    self.send_header("ETag", feed.etag)
+                self.end_headers()
+                self.wfile.write(feed.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/csv_recent/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def serve(self, body, etag):
+        self.body, self.etag = body, etag
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def feed_server():
+    server = FeedServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def intel(feed_server, tmp_path):
+    return ThreatIntel(load_feed=False, feed_url=feed_server.url, snapshot_path=str(tmp_path / "snapshot.bin"))
+
+
+def test_updates_then_not_modified(feed_server, intel):
+    feed_server.serve(feed_csv((1, "http://a.example.test/x"), (2, "http://b.example.test/y")), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+    assert len(intel.urlhaus_index) == 2
+    assert intel.urlhaus_index.lookup("http://a.example.test/x") == "url"
+    assert intel.feed.row(0)["url"] == "http://b.example.test/y"
+
+    assert intel.refresher.refresh_once() == "not_modified"
+    assert feed_server.requests[-1].get("If-None-Match") == '"v1"'
+    assert len(intel.urlhaus_index) == 2
+
+
+def test_rejects_empty_feed(feed_server, intel):
+    feed_server.serve(feed_csv((1, "http://a.example.test/x")), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+
+    feed_server.serve(b"", '"v2"')
+    assert intel.refresher.refresh_once() == "rejected"
+    assert len(intel.urlhaus_index) == 1
+    stats = intel.refresher.stats()
+    assert stats["last_result"] == "rejected"
+    assert "no indicators" in stats["last_rejection"]["reason"]
+    # The rejected download's validators are not kept, so the next poll fetches it again
+    assert intel.refresher.etag == '"v1"'
+
+
+def test_rejects_mass_removal(feed_server, intel):
+    intel.refresher.max_removed_fraction = 0.5
+    urls = [(i, f"http://host{i}.example.test/p") for i in range(1, 5)]
+    feed_server.serve(feed_csv(*urls), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+
+    feed_server.serve(feed_csv(*urls[:1]), '"v2"')
+    assert intel.refresher.refresh_once() == "rejected"
+    assert len(intel.urlhaus_index) == 4
+
+    feed_server.serve(feed_csv(*urls[:2]), '"v3"')
+    assert intel.refresher.refresh_once() == "updated"
+    assert len(intel.urlhaus_index) == 2
+
+
+def test_snapshot_round_trip(feed_server, intel):
+    feed_server.serve(feed_csv((1, "http://a.example.test/x"), (2, "http://b.example.test/é")), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+
+    restarted = ThreatIntel(load_feed=False, feed_url=feed_server.url, snapshot_path=intel.refresher.snapshot_path)
+    assert restarted.load_snapshot()
+    assert restarted.refresher.etag == '"v1"'
+    assert len(restarted.urlhaus_index) == 2
+    assert restarted.feed.version == intel.feed.version
+    assert restarted.feed.facets() == intel.feed.facets()
+    assert [restarted.feed.row(r) for r in range(2)] == [intel.feed.row(r) for r in range(2)]
+    assert restarted.feed.row(0)["url"] == "http://b.example.test/é"
+    assert list(restarted.feed.select(tag="mirai")) == [0, 1]
+
+
+def test_live_feed_replaces_stale_local_csv(feed_server, intel, tmp_path):
+    stale = tmp_path / "urlhaus_online.csv"
+    stale.write_bytes(feed_csv(*[(i, f"http://old{i}.example.test/p") for i in range(1, 11)]))
+    intel.load_local_cache(str(stale))
+    assert len(intel.urlhaus_index) == 10
+
+    # Removes every bundled indicator, but the bundled CSV is no baseline for the guard
+    feed_server.serve(feed_csv((11, "http://new.example.test/p")), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+    assert len(intel.urlhaus_index) == 1
+
+
+def test_accepts_repeated_identical_mass_removal(feed_server, intel):
+    intel.refresher.reject_confirmations = 3
+    urls = [(i, f"http://host{i}.example.test/p") for i in range(1, 5)]
+    feed_server.serve(feed_csv(*urls), '"v1"')
+    assert intel.refresher.refresh_once() == "updated"
+
+    # e.g. a snapshot older than the feed's window: the same content keeps coming back
+    feed_server.serve(feed_csv(*urls[:1]), '"v2"')
+    assert [intel.refresher.refresh_once() for _ in range(3)] == ["rejected", "rejected", "updated"]
+    assert len(intel.urlhaus_index) == 1
+
+
+def test_negative_interval_never_fetches(feed_server, intel):
+    feed_server.serve(feed_csv((1, "http://a.example.test/x")), '"v1"')
+    intel.refresher.interval = -1
+    intel.refresher.start()
+    assert intel.refresher._thread is None
+    assert feed_server.requests == []
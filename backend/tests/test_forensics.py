@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import config
+from conftest import StubResolver, stub_certificate_fetch
+from threat_intel import ThreatIntel
+
+
+@pytest.fixture
+def deadlines(monkeypatch):
+    monkeypatch.setattr(config, "DNS_DEADLINE_SECONDS", 0.3)
+    monkeypatch.setattr(config, "TLS_DEADLINE_SECONDS", 0.5)
+
+
+def stub_intel(dns_ms, tls_ms):
+    intel = ThreatIntel(resolver=StubResolver(dns_ms), load_feed=False, snapshot_path="")
+    intel._fetch_certificate = stub_certificate_fetch(tls_ms)
+    return intel
+
+
+def timed_forensics(intel, domain):
+    started = time.monotonic()
+    result = intel.run_forensics(domain)
+    return result, time.monotonic() - started
+
+
+def test_both_probes_answer_within_deadlines(deadlines):
+    result, _ = timed_forensics(stub_intel(dns_ms=10, tls_ms=10), "fast.example.test")
+    assert result["dns"]["status"] == "Active"
+    assert result["ssl"]["valid"] is True
+
+
+def test_both_deadlines_time_out(deadlines):
+    result, elapsed = timed_forensics(stub_intel(dns_ms=2000, tls_ms=2000), "slow.example.test")
+    assert result["dns"]["status"] == "Timeout"
+    assert result["ssl"] == {"valid": False, "error": "TLS handshake exceeded its deadline."}
+    # Both deadlines run from submission, so the scan waits for the longer one, not their sum
+    assert 0.45 <= elapsed < 0.75
+
+
+def test_tls_deadline_counts_from_submission(deadlines):
+    # TLS answers after 0.6s: past its 0.5s deadline from submission, but well within
+    # 0.5s of the DNS deadline expiring
+    result, elapsed = timed_forensics(stub_intel(dns_ms=2000, tls_ms=600), "slow-dns.example.test")
+    assert result["dns"]["status"] == "Timeout"
+    assert result["ssl"]["valid"] is False
+    assert elapsed < 0.6
+
+
+def test_dns_timeout_leaves_tls_result(deadlines):
+    result, _ = timed_forensics(stub_intel(dns_ms=2000, tls_ms=100), "dns-only-slow.example.test")
+    assert result["dns"]["status"] == "Timeout"
+    assert result["ssl"]["valid"] is True
+
+
+def test_check_url_against_local_resolver_and_tls_server(stub_resolver, tls_server):
+    intel = ThreatIntel(resolver=stub_resolver, tls_port=tls_server.port, ssl_context=tls_server.client_context(),
+                        load_feed=False, snapshot_path="")
+
+    result = intel.check_url("https://localhost/account/verify")
+    assert result["forensics"]["dns"]["status"] == "Active"
+    assert result["forensics"]["ssl"] == {
+        "valid": True, "issuer": "Cerebro Test CA", "subject": "localhost", "expiry": "Sep 24 05:36:52 2126 GMT"}
+    assert tls_server.connections == 1
+    assert stub_resolver.queries == ["localhost"]
+
+    # A second scan of the host is answered from the DNS and TLS caches
+    again = intel.check_url("https://localhost/other")
+    assert again["forensics"]["ssl"]["cached"] is True
+    assert again["forensics"]["dns"]["cached"] is True
+    assert tls_server.connections == 1
+    assert stub_resolver.queries == ["localhost"]
+
+
+def test_untrusted_certificate_is_reported_invalid(stub_resolver, tls_server):
+    # The stock context does not trust the self-signed test certificate
+    intel = ThreatIntel(resolver=stub_resolver, tls_port=tls_server.port, load_feed=False, snapshot_path="")
+    result = intel.check_url("https://localhost/")
+    assert result["forensics"]["ssl"]["valid"] is False
+    assert "certificate verify failed" in result["forensics"]["ssl"]["error"]
@@ -0,0 +1,41 @@
+import pytest
+
+import config
+from feed_table import FeedTable
+from indicator_index import DomainTrie
+from threat_intel import ThreatIntel
+
+LISTED = "https://sites.google.com/view/payroll-update/login"
+
+
+@pytest.fixture
+def intel(monkeypatch):
+    monkeypatch.setattr(config, "FORENSICS_ON_LIST_HIT", "skip")
+    intel = ThreatIntel(load_feed=False, snapshot_path="")
+    intel._load_feed(FeedTable.from_urls([LISTED, "http://malware.example.test/bot.elf"]))
+    return intel
+
+
+def test_listed_url_on_allowlisted_domain_is_malicious(intel):
+    result = intel.check_url(LISTED)
+    assert result["source"] == "URLHaus (Abuse.ch)"
+    assert result["status"] == "Malicious"
+
+
+def test_allowlist_still_covers_unlisted_urls_on_listed_hosts(intel):
+    # Other pages on a host with a listed URL are not suspect when the domain is allowlisted
+    result = intel.check_url("https://sites.google.com/view/team-calendar")
+    assert result["source"] == "Allowed List"
+    assert result["status"] == "Clean"
+
+
+def test_host_match_is_suspicious(intel):
+    result = intel.check_url("http://malware.example.test/other")
+    assert result["status"] == "Suspicious"
+
+
+def test_blocklist_overrides_allowlist(intel):
+    intel.blocklist = DomainTrie(["sites.google.com"])
+    result = intel.check_url("https://sites.google.com/view/anything")
+    assert result["source"] == "Domain Blocklist"
+    assert result["status"] == "Malicious"
@@ -1,183 +1,416 @@
-import csv
+import asyncio
+import functools
 import os
-import requests
 import socket
 import ssl
-import json
+import threading
+import time
+import dns.asyncresolver
 import dns.resolver
-from urllib.parse import urlparse
-from stix2 import Indicator, Bundle, Report, TLP_WHITE
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import config
+import timing
+from feed_table import FeedTable, page_query
+from feed_refresher import FeedRefresher
+from indicator_index import IndicatorIndex, DomainTrie, host_of, load_domain_list, load_snapshot as load_index_snapshot
+
+class _TTLCache:
+    """Small thread-safe dict with a per-entry expiry, used for forensics results."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def put(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                # Drop expired entries first, then the oldest insertion
+                now = time.monotonic()
+                for k in [k for k, (exp, _) in self._data.items() if exp <= now]:
+                    del self._data[k]
+                if len(self._data) >= self.max_entries:
+                    del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + ttl, value)
 
 class ThreatIntel:
-    def __init__(self):
-        self.urlhaus_db = set()
-        self.whitelist = {
-            'google.com', 'www.google.com', 'youtube.com', 'facebook.com', 
-            'amazon.com', 'wikipedia.org', 'bnymellon.com', 'www.bnymellon.com',
+    # Verdict sources for which forensics are optional (see FORENSICS_ON_LIST_HIT)
+    LIST_SOURCES = ("Allowed List", "Domain Blocklist", "URLHaus (Abuse.ch)")
+
+    def __init__(self, resolver=None, tls_port=443, ssl_context=None, load_feed=True,
+                 feed_url=None, snapshot_path=None, async_resolver=None):
+        """`resolver`, `tls_port` and `ssl_context` let the forensics probes be pointed
+        at a local stub resolver / TLS server, `feed_url` and `snapshot_path` at a local
+        feed stand-in; `load_feed=False` skips loading and refreshing the URLHaus feed.
+        `async_resolver` (awaitable `resolve`) serves check_dns_async."""
+        self.resolver = resolver or dns.resolver.Resolver()
+        self.async_resolver = async_resolver
+        self.tls_port = tls_port
+        self.ssl_context = ssl_context
+        self._forensics_pool = ThreadPoolExecutor(
+            max_workers=config.FORENSICS_WORKERS, thread_name_prefix="forensics")
+        self._dns_cache = _TTLCache(config.FORENSICS_CACHE_ENTRIES)
+        self._ssl_cache = _TTLCache(config.FORENSICS_CACHE_ENTRIES)
+
+        self.urlhaus_index = IndicatorIndex()
+        self.feed = FeedTable.from_urls([])
+        # Allowlisted domains also cover their subdomains
+        self.whitelist = DomainTrie([
+            'google.com', 'youtube.com', 'facebook.com',
+            'amazon.com', 'wikipedia.org', 'bnymellon.com',
             'microsoft.com', 'apple.com', 'linkedin.com'
-        }
-        self.load_urlhaus()
+        ])
+        self.blocklist = DomainTrie()
+        if config.DOMAIN_BLOCKLIST_PATH and os.path.exists(config.DOMAIN_BLOCKLIST_PATH):
+            self.blocklist = load_domain_list(config.DOMAIN_BLOCKLIST_PATH)
+            print(f"Loaded {len(self.blocklist)} blocklisted domains.")
+
+        self.refresher = FeedRefresher(self, url=feed_url, snapshot_path=snapshot_path)
+        if load_feed:
+            # Serve immediately from the snapshot (or local CSV); the live feed
+            # is fetched and kept current in the background.
+            if not self.load_snapshot():
+                self.load_local_cache()
+            self.refresher.start()
 
     def load_urlhaus(self):
         """Loads URLHaus CSV from online source or local fallback."""
-        url = "https://urlhaus.abuse.ch/downloads/csv_recent/"
-        print(f"Fetching Live Threat Feed from {url}...")
-        
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                content = response.content.decode('utf-8', errors='ignore').splitlines()
-                self._parse_csv(content)
-                print(f"Successfully loaded {len(self.urlhaus_db)} threats from Live Feed.")
-                return
-        except Exception as e:
-            print(f"Live Feed Fetch Failed: {e}. Falling back to local cache.")
+        print(f"Fetching Live Threat Feed from {self.refresher.url}...")
+        if self.refresher.refresh_once() != "failed":
+            print(f"Successfully loaded {len(self.urlhaus_index)} threats from Live Feed.")
+            return
+        print("Live Feed Fetch Failed. Falling back to local cache.")
+        self.load_local_cache()
 
-        # Fallback to local
-        csv_path = os.path.join(os.path.dirname(__file__), 'urlhaus_online.csv')
+    def load_local_cache(self, csv_path=None):
+        """Loads the bundled URLHaus CSV (or the export at `csv_path`)."""
+        csv_path = csv_path or os.path.join(os.path.dirname(__file__), 'urlhaus_online.csv')
         if os.path.exists(csv_path):
             with open(csv_path, 'r', encoding='utf-8', errors='ignore') as f:
-                self._parse_csv(f)
-            print(f"Loaded {len(self.urlhaus_db)} threats from Local Cache.")
+                self._load_feed(self._parse_csv(f))
+            # An older export than the live feed: its first fetch may replace most of it
+            self.refresher.baseline_source = None
+            print(f"Loaded {len(self.urlhaus_index)} threats from Local Cache.")
+
+    def load_snapshot(self):
+        """Memory-maps the persisted indicator snapshot. Returns True on success."""
+        path = self.refresher.snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            index, metadata, columns = load_index_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable threat feed snapshot {path}: {e}")
+            return False
+        if "feed_table" in metadata:
+            feed = FeedTable.from_snapshot(columns, metadata["feed_table"])
+        elif "feed" in metadata:
+            # Snapshots that kept the table as JSON in the header lack its binary
+            # columns; serve the index but refetch the whole feed for its rows
+            print(f"Threat feed snapshot {path} predates the binary feed table; refetching the feed.")
+            self.swap_index(index, FeedTable.from_urls([]))
+            return True
+        else:
+            # Snapshots from before the feed table only kept the most recent URLs
+            feed = FeedTable.from_urls(metadata.get("recent", []))
+        self.swap_index(index, feed)
+        self.refresher.restore_validators(metadata)
+        print(f"Loaded {len(self.urlhaus_index)} threats from snapshot saved {metadata.get('saved_at')}.")
+        return True
 
     def _parse_csv(self, iterable):
-        """Helper to parse CSV lines."""
-        reader = csv.reader(iterable)
-        count = 0
-        for row in reader:
-            if row and not row[0].startswith('#'):
-                if len(row) > 2:
-                    self.urlhaus_db.add(row[2].strip())
-                    count += 1
-        return count
+        """Helper to parse CSV lines into a FeedTable (rows with their metadata, newest first)."""
+        return FeedTable.parse_csv(iterable)
+
+    def _load_feed(self, feed):
+        """Replaces the indicator index with one built from the rows of `feed`."""
+        self.swap_index(IndicatorIndex.build(feed.urls), feed)
+
+    def swap_index(self, index, feed):
+        """Publishes a new index and feed table. Readers pick up whichever reference
+        they load; nothing is mutated in place, so no locking is needed."""
+        # Render the dashboard's default page now rather than on the next poll
+        feed.page(page_query())
+        self.feed = feed
+        self.urlhaus_index = index
 
     def check_dns_live(self, domain):
-        """Performs a real DNS lookup (Forensics)."""
+        """Performs a real DNS lookup (Forensics).
+        Answers are cached for their record TTL, NXDOMAIN is negatively cached."""
+        cached = self._dns_cache.get(domain)
+        if cached is not None:
+            return dict(cached, cached=True)
+
         try:
-            answers = dns.resolver.resolve(domain, 'A')
-            ip = answers[0].to_text()
-            return {"status": "Active", "ip": ip, "details": "Domain resolves to IP."}
-        except dns.resolver.NXDOMAIN:
-            return {"status": "NXDOMAIN", "ip": "N/A", "details": "Domain does not exist."}
+            with timing.stage("dns"):
+                answers = self.resolver.resolve(domain, 'A', lifetime=config.DNS_TIMEOUT_SECONDS)
+            return self._dns_answer(domain, answers)
         except Exception as e:
-            return {"status": "Error", "ip": "N/A", "details": str(e)}
+            return self._dns_failure(domain, e)
+
+    async def check_dns_async(self, domain):
+        """check_dns_live for asyncio callers, using `async_resolver`. Without one, the
+        stock resolver is mirrored by dnspython's asyncio resolver (same nameservers)
+        and a custom synchronous resolver runs on the forensics pool."""
+        cached = self._dns_cache.get(domain)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+        try:
+            with timing.stage("dns"):
+                if self.async_resolver is None and type(self.resolver) is dns.resolver.Resolver:
+                    self.async_resolver = dns.asyncresolver.Resolver(configure=False)
+                    self.async_resolver.nameservers = self.resolver.nameservers
+                    self.async_resolver.port = self.resolver.port
+                if self.async_resolver is not None:
+                    answers = await self.async_resolver.resolve(domain, 'A', lifetime=config.DNS_TIMEOUT_SECONDS)
+                else:
+                    resolve = functools.partial(self.resolver.resolve, domain, 'A', lifetime=config.DNS_TIMEOUT_SECONDS)
+                    answers = await asyncio.get_running_loop().run_in_executor(self._forensics_pool, resolve)
+            return self._dns_answer(domain, answers)
+        except Exception as e:
+            return self._dns_failure(domain, e)
+
+    def _dns_answer(self, domain, answers):
+        result = {"status": "Active", "ip": answers[0].to_text(), "details": "Domain resolves to IP."}
+        ttl = min(max(answers.rrset.ttl, config.DNS_MIN_TTL_SECONDS), config.DNS_MAX_TTL_SECONDS)
+        self._dns_cache.put(domain, result, ttl)
+        return result
+
+    def _dns_failure(self, domain, error):
+        if isinstance(error, dns.resolver.NXDOMAIN):
+            result = {"status": "NXDOMAIN", "ip": "N/A", "details": "Domain does not exist."}
+            self._dns_cache.put(domain, result, config.DNS_NEGATIVE_TTL_SECONDS)
+            return result
+        return {"status": "Error", "ip": "N/A", "details": str(error)}
 
     def check_ssl_live(self, domain):
-        """Fetches SSL Certificate details (Forensics)."""
+        """Fetches SSL Certificate details (Forensics). Results are cached per domain."""
+        cache_key = (domain, self.tls_port)
+        cached = self._ssl_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
         try:
-            ctx = ssl.create_default_context()
-            with socket.create_connection((domain, 443), timeout=3) as sock:
-                with ctx.wrap_socket(sock, server_hostname=domain) as ssock:
-                    cert = ssock.getpeercert()
-                    subject = dict(x[0] for x in cert['subject'])
-                    issuer = dict(x[0] for x in cert['issuer'])
-                    return {
-                        "valid": True,
-                        "issuer": issuer.get('organizationName', 'Unknown'),
-                        "subject": subject.get('commonName', 'Unknown'),
-                        "expiry": cert['notAfter']
-                    }
+            with timing.stage("tls"):
+                result = self._fetch_certificate(domain)
         except Exception as e:
-             return {"valid": False, "error": str(e)}
+            return self._ssl_failure(cache_key, e)
+        self._ssl_cache.put(cache_key, result, config.TLS_CACHE_TTL_SECONDS)
+        return result
 
-    def check_url(self, url):
-        """Checks URL against local DB, online services, and performs forensics."""
+    async def check_ssl_async(self, domain):
+        """check_ssl_live for asyncio callers; the handshake is awaited on the event loop."""
+        cache_key = (domain, self.tls_port)
+        cached = self._ssl_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+        try:
+            with timing.stage("tls"):
+                result = await self._fetch_certificate_async(domain)
+        except Exception as e:
+            return self._ssl_failure(cache_key, e)
+        self._ssl_cache.put(cache_key, result, config.TLS_CACHE_TTL_SECONDS)
+        return result
+
+    def _ssl_failure(self, cache_key, error):
+        result = {"valid": False, "error": str(error) or type(error).__name__}
+        # Failures are cached briefly so retries of the same scan don't re-pay the timeout
+        self._ssl_cache.put(cache_key, result, config.TLS_FAILURE_CACHE_TTL_SECONDS)
+        return result
+
+    def _fetch_certificate(self, domain):
+        """TLS handshake with `domain`; returns the certificate summary or raises."""
+        ctx = self.ssl_context or ssl.create_default_context()
+        with socket.create_connection((domain, self.tls_port), timeout=config.TLS_TIMEOUT_SECONDS) as sock:
+            with ctx.wrap_socket(sock, server_hostname=domain) as ssock:
+                return self._certificate_summary(ssock.getpeercert())
+
+    async def _fetch_certificate_async(self, domain):
+        ctx = self.ssl_context or ssl.create_default_context()
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(domain, self.tls_port, ssl=ctx, server_hostname=domain),
+            timeout=config.TLS_TIMEOUT_SECONDS)
+        try:
+            return self._certificate_summary(writer.get_extra_info("peercert"))
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _certificate_summary(cert):
+        subject = dict(x[0] for x in cert['subject'])
+        issuer = dict(x[0] for x in cert['issuer'])
+        return {
+            "valid": True,
+            "issuer": issuer.get('organizationName', 'Unknown'),
+            "subject": subject.get('commonName', 'Unknown'),
+            "expiry": cert['notAfter']
+        }
+
+    def run_forensics(self, domain):
+        """Runs the DNS and TLS probes concurrently on the shared pool.
+        Each probe gets its own deadline; a probe that misses it keeps running in
+        the background and fills the cache for later scans."""
+        # Probes run on pool threads but report their timings to this request
+        start = time.monotonic()
+        dns_future = self._forensics_pool.submit(timing.propagate(self.check_dns_live), domain)
+        ssl_future = self._forensics_pool.submit(timing.propagate(self.check_ssl_live), domain)
+
+        # Both deadlines count from submission, not from the end of the other wait
+        def remaining(deadline):
+            return max(0.0, start + deadline - time.monotonic())
+
+        try:
+            dns_data = dns_future.result(timeout=remaining(config.DNS_DEADLINE_SECONDS))
+        except FutureTimeout:
+            dns_data = {"status": "Timeout", "ip": "N/A", "details": "DNS lookup exceeded its deadline."}
         try:
-            parsed = urlparse(url)
-            domain = parsed.netloc
-            if not domain: 
-                 # Handle cases where user might enter google.com without https://
-                 domain = url.split('/')[0]
-        except:
-             domain = url
-
-        # 0. Real-time Forensics
-        dns_data = self.check_dns_live(domain)
-        ssl_data = self.check_ssl_live(domain)
-
-        forensics = {
+            ssl_data = ssl_future.result(timeout=remaining(config.TLS_DEADLINE_SECONDS))
+        except FutureTimeout:
+            ssl_data = {"valid": False, "error": "TLS handshake exceeded its deadline."}
+
+        return {
+            "dns": dns_data,
+            "ssl": ssl_data
+        }
+
+    async def run_forensics_async(self, domain):
+        """run_forensics for asyncio callers: both probes are awaited concurrently
+        without holding a thread. A probe that misses its deadline is shielded from
+        cancellation, so it still completes and fills the cache."""
+        dns_task = asyncio.ensure_future(self.check_dns_async(domain))
+        ssl_task = asyncio.ensure_future(self.check_ssl_async(domain))
+        dns_data, ssl_data = await asyncio.gather(
+            asyncio.wait_for(asyncio.shield(dns_task), config.DNS_DEADLINE_SECONDS),
+            asyncio.wait_for(asyncio.shield(ssl_task), config.TLS_DEADLINE_SECONDS),
+            return_exceptions=True)
+        if isinstance(dns_data, BaseException):
+            dns_data = {"status": "Timeout", "ip": "N/A", "details": "DNS lookup exceeded its deadline."}
+        if isinstance(ssl_data, BaseException):
+            ssl_data = {"valid": False, "error": "TLS handshake exceeded its deadline."}
+        return {
             "dns": dns_data,
             "ssl": ssl_data
         }
 
-        # 1. Whitelist Check
+    def defer_forensics(self, domain):
+        """Schedules the probes without waiting, so a later scan hits a warm cache."""
+        self._forensics_pool.submit(self.check_dns_live, domain)
+        self._forensics_pool.submit(self.check_ssl_live, domain)
+
+    def check_url(self, url):
+        """Checks URL against local DB, online services, and performs forensics."""
+        domain = host_of(url) or url
+        with timing.stage("intel_lookup"):
+            result = self._lookup_verdict(url, domain)
+
+        # Real-time Forensics (optional for list hits, see FORENSICS_ON_LIST_HIT)
+        if not self._skip_forensics(result, domain):
+            with timing.stage("forensics"):
+                result["forensics"] = self.run_forensics(domain)
+        return result
+
+    async def check_url_async(self, url):
+        """check_url for asyncio servers: the forensics probes are awaited instead of
+        blocking a thread (see asgi.py)."""
+        domain = host_of(url) or url
+        with timing.stage("intel_lookup"):
+            result = self._lookup_verdict(url, domain)
+
+        if not self._skip_forensics(result, domain):
+            with timing.stage("forensics"):
+                result["forensics"] = await self.run_forensics_async(domain)
+        return result
+
+    def _skip_forensics(self, result, domain):
+        """Applies FORENSICS_ON_LIST_HIT to a verdict; True when the probes are not run inline."""
+        policy = config.FORENSICS_ON_LIST_HIT
+        if result["source"] not in self.LIST_SOURCES or policy not in ("skip", "defer"):
+            return False
+        if policy == "defer":
+            self.defer_forensics(domain)
+        result["forensics"] = None
+        result["forensics_status"] = "deferred" if policy == "defer" else "skipped"
+        return True
+
+    def _lookup_verdict(self, url, domain):
+        """List and heuristic checks for a URL, without forensics."""
+        # 1. Domain Blocklist
+        blocked = self.blocklist.match(domain)
+        if blocked:
+            return {
+                "source": "Domain Blocklist",
+                "status": "Malicious",
+                "details": f"Domain falls under blocklisted domain {blocked}."
+            }
+
+        # 2. URLHaus lists this exact URL (canonicalized). Checked before the allowlist:
+        # allowlisted domains also cover user-hosted content (sites.google.com, ...)
+        match = self.urlhaus_index.lookup(url)
+        if match == "url":
+            return {
+                "source": "URLHaus (Abuse.ch)",
+                "status": "Malicious",
+                "details": "Listed in URLHaus database as online malware URL."
+            }
+
+        # 3. Whitelist Check (domain or any parent domain)
         if domain in self.whitelist:
              return {
                 "source": "Allowed List",
                 "status": "Clean",
-                "details": "Domain is in the trusted whitelist.",
-                "forensics": forensics
+                "details": "Domain is in the trusted whitelist."
             }
 
-        # 2. Check URLHaus
-        if url in self.urlhaus_db:
+        # 4. Other URLHaus matches (host, then registered domain)
+        # Only the listed URL itself is malicious: URLHaus lists URLs on shared hosts
+        # (github.com, cdn.discordapp.com, ...) whose other URLs are mostly benign
+        if match == "host":
             return {
                 "source": "URLHaus (Abuse.ch)",
-                "status": "Malicious",
-                "details": "Listed in URLHaus database as online malware URL.",
-                "forensics": forensics
+                "status": "Suspicious",
+                "details": "Host serves other URLs listed in URLHaus database."
+            }
+        if match == "domain":
+            return {
+                "source": "URLHaus (Abuse.ch)",
+                "status": "Suspicious",
+                "details": "Registered domain has hosts listed in URLHaus database."
             }
         
-        # 3. PhishTank / OpenPhish / Heuristics
+        # 5. PhishTank / OpenPhish / Heuristics
         if "login" in url and "verification" in url:
              return {
                 "source": "Heuristic Analysis",
                 "status": "Suspicious",
-                "details": "URL pattern matches common phishing attacks.",
-                "forensics": forensics
+                "details": "URL pattern matches common phishing attacks."
              }
         
         return {
             "source": "Global Threat Database",
             "status": "Clean",
-            "details": "No threat found in known databases.",
-            "forensics": forensics
+            "details": "No threat found in known databases."
         }
 
     def get_recent_threats(self, limit=50):
-        """Returns a list of recent threats from the loaded database."""
-        # Convert set to list and slice. In a real app, this would query a DB with timestamps.
-        # generating dummy mock metadata for the demo since CSV is just URLs
-        return [
-            {
-                "id": i,
-                "url": url,
-                "type": "Malicious URL",
-                "source": "URLHaus",
-                "severity": "High",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            for i, url in enumerate(list(self.urlhaus_db)[:limit])
-        ]
-
-    def generate_stix_report(self, threat_type, content):
-        """Generates a STIX 2.1 Bundle for the threat."""
-        try:
-            timestamp = datetime.now()
-            
-            # Create Indicator
-            indicator = Indicator(
-                pattern=f"[url:value = '{content}']" if threat_type == 'Malicious URL' else f"[email-message:body_multipart.body_raw.content MATCHES '{content[:50]}...']",
-                pattern_type="stix",
-                valid_from=timestamp,
-                name=f"Phishing Indicator: {threat_type}",
-                description=f"Detected by GuardAI Phishing Defense. Type: {threat_type}",
-                labels=["phishing", "malicious-activity"]
-            )
-
-            # Create Report
-            report = Report(
-                name=f"Incident Report - {timestamp.strftime('%Y-%m-%d %H:%M')}",
-                description=f"User reported {threat_type}. Content: {content}",
-                published=timestamp,
-                object_refs=[indicator]
-            )
-
-            bundle = Bundle(objects=[indicator, report])
-            return json.loads(bundle.serialize())
-        except Exception as e:
-            return {"error": str(e)}
+        """Returns the newest `limit` feed rows with their URLHaus metadata."""
+        feed = self.feed
+        return [feed.row(i) for i in range(min(limit, len(feed)))]
 
 # Singleton instance
 threat_intel = ThreatIntel()
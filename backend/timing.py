@@ -0,0 +1,93 @@
+"""Per-request stage timing.
+
+`stage(name)` times a block of code. Every call feeds the process-wide
+`stage_duration_ms{stage=...}` histogram; while a request trace is active
+(see `begin`) the duration is also added to that request's breakdown, which
+the app returns as a Server-Timing header and, on request, a `timings` field.
+
+Traces live in a ContextVar. Work handed to another thread keeps reporting to
+the originating request when the callable is wrapped with `propagate`.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import registry
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """Accumulated milliseconds per stage for one request, in first-seen order."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def as_dict(self):
+        with self._lock:
+            timings = {stage: round(ms, 3) for stage, ms in self.stages.items()}
+        timings["total"] = round(self.elapsed_ms(), 3)
+        return timings
+
+    def server_timing(self):
+        """The breakdown as a Server-Timing header value."""
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.as_dict().items())
+
+
+def begin(name):
+    """Starts a trace for the current request; pass the returned token to `end`."""
+    return _current.set(RequestTrace(name))
+
+
+def end(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Streamed responses may finish in a different context than they started in
+        _current.set(None)
+
+
+def current():
+    """The active RequestTrace, or None outside a traced request."""
+    return _current.get()
+
+
+def record(stage, ms):
+    """Adds `ms` to the current request's breakdown only (no histogram), for
+    durations measured elsewhere, e.g. by the batcher thread."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, ms)
+
+
+def _histogram(stage):
+    return registry.histogram("stage_duration_ms", {"stage": stage}, help_text="Time spent in each pipeline stage.")
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - started) * 1000.0
+        _histogram(name).observe(ms)
+        record(name, ms)
+
+
+def propagate(fn):
+    """Wraps `fn` to run in a copy of the caller's context, so stages timed on a
+    pool thread are attributed to the calling request."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
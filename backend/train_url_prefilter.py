@@ -0,0 +1,194 @@
+"""Trains the lexical URL prefilter (url_prefilter.LexicalModel).
+
+    python train_url_prefilter.py
+    python train_url_prefilter.py --input urls.csv --url-column url --label-column label --phishing-label 1
+    python train_url_prefilter.py --teacher --limit 50000
+
+Labels come from the dataset (PhiUSIIL by default: label 0 = phishing) or,
+with --teacher, from the URL transformer itself, which trains the prefilter to
+agree with the tier it stands in for. After training, the safe and phishing
+thresholds are picked on a held-out split as the widest band edges whose
+verdicts still reach --target-precision; the report shows how much traffic
+they settle.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Only the model class is needed here, not the serving singleton
+os.environ.setdefault("CEREBRO_URL_PREFILTER_MODE", "off")
+
+import model_utils
+from url_prefilter import DENSE_FEATURES, PHISHING_CLASS, LexicalModel, _sigmoid, featurize
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATASET = os.path.join(PROJECT_ROOT, "dataset", "PhiUSIIL_Phishing_URL_Dataset.csv")
+
+
+def read_dataset(path, url_column, label_column, phishing_label, limit=None):
+    """(urls, is_phishing) from a CSV."""
+    urls, labels = [], []
+    with open(path, newline='', encoding='utf-8', errors='ignore') as f:
+        for row in csv.DictReader(f):
+            url = (row.get(url_column) or "").strip()
+            if not url:
+                continue
+            urls.append(url)
+            labels.append(row.get(label_column, "").strip() == phishing_label)
+            if limit and len(urls) >= limit:
+                break
+    return urls, np.array(labels, dtype=np.float32)
+
+
+def teacher_labels(urls, batch_size):
+    """Phishing labels assigned by the URL transformer."""
+    model, tokenizer = model_utils.load_model(os.path.join(PROJECT_ROOT, "url"))
+    if not model:
+        sys.exit(2)
+    labels = []
+    for start in range(0, len(urls), batch_size):
+        labels.extend(pred == PHISHING_CLASS for pred, _ in
+                      model_utils.predict_batch(urls[start:start + batch_size], model, tokenizer))
+    return np.array(labels, dtype=np.float32)
+
+
+def train(batches, n_buckets, epochs, lr, l2, seed):
+    """Mini-batch Adam on the logistic loss. `batches` is a list of (Features, labels)."""
+    dense = np.concatenate([f.dense for f, _ in batches])
+    mean, std = dense.mean(axis=0), dense.std(axis=0) + 1e-6
+    params = {
+        "hash": np.zeros(n_buckets, dtype=np.float64),
+        "dense": np.zeros(len(DENSE_FEATURES), dtype=np.float64),
+        "bias": np.zeros(1, dtype=np.float64),
+    }
+    moments = {name: (np.zeros_like(p), np.zeros_like(p)) for name, p in params.items()}
+    beta1, beta2, step = 0.9, 0.999, 0
+    rng = np.random.default_rng(seed)
+
+    for epoch in range(epochs):
+        loss = 0.0
+        for b in rng.permutation(len(batches)):
+            features, y = batches[b]
+            x = (features.dense - mean) / std
+            z = (np.bincount(features.rows, weights=params["hash"][features.buckets] * features.values,
+                             minlength=len(y)) + x @ params["dense"] + params["bias"][0])
+            p = _sigmoid(z)
+            loss += float(-(y * np.log(p + 1e-9) + (1 - y) * np.log(1 - p + 1e-9)).sum())
+            error = (p - y) / len(y)
+            grads = {
+                "hash": np.bincount(features.buckets, weights=error[features.rows] * features.values,
+                                    minlength=n_buckets) + l2 * params["hash"],
+                "dense": x.T @ error + l2 * params["dense"],
+                "bias": np.array([error.sum()]),
+            }
+            step += 1
+            for name, grad in grads.items():
+                m, v = moments[name]
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad * grad
+                params[name] -= lr * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-8)
+        print(f"epoch {epoch + 1}/{epochs}: loss {loss / sum(len(y) for _, y in batches):.4f}")
+    return LexicalModel(params["hash"], params["dense"], mean, std, params["bias"][0])
+
+
+def pick_thresholds(scores, is_phishing, target_precision):
+    """Widest (safe, phishing) thresholds whose settled verdicts reach `target_precision`."""
+    order = np.argsort(scores)
+    sorted_scores, sorted_labels = scores[order], is_phishing[order]
+    n = len(scores)
+
+    # Safe: the lowest k scores, precision = fraction of them that are not phishing
+    safe_precision = np.cumsum(1 - sorted_labels) / np.arange(1, n + 1)
+    ok = np.nonzero(safe_precision >= target_precision)[0]
+    safe = float(sorted_scores[ok.max()]) if len(ok) else 0.0
+
+    # Phishing: the highest k scores
+    phishing_precision = np.cumsum(sorted_labels[::-1]) / np.arange(1, n + 1)
+    ok = np.nonzero(phishing_precision >= target_precision)[0]
+    phishing = float(sorted_scores[::-1][ok.max()]) if len(ok) else 1.0
+    return min(safe, 0.5), max(phishing, 0.5)
+
+
+def evaluate(scores, is_phishing, safe, phishing):
+    settled_safe, settled_phishing = scores <= safe, scores >= phishing
+    settled = settled_safe | settled_phishing
+    wrong = (settled_safe & (is_phishing == 1)) | (settled_phishing & (is_phishing == 0))
+    return {
+        "samples": int(len(scores)),
+        "settled_fraction": round(float(settled.mean()), 4),
+        "settled_safe": int(settled_safe.sum()),
+        "settled_phishing": int(settled_phishing.sum()),
+        "settled_error_rate": round(float(wrong.sum() / max(settled.sum(), 1)), 5),
+        "accuracy_at_0.5": round(float(((scores >= 0.5) == (is_phishing == 1)).mean()), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=DEFAULT_DATASET, help="CSV with a URL column and a label column")
+    parser.add_argument("--url-column", default="URL")
+    parser.add_argument("--label-column", default="label")
+    parser.add_argument("--phishing-label", default="0", help="value of the label column marking phishing")
+    parser.add_argument("--teacher", action="store_true", help="label URLs with the URL transformer instead")
+    parser.add_argument("--limit", type=int, help="only use the first N rows")
+    parser.add_argument("--buckets", type=int, default=2 ** 18, help="hash buckets for the character n-grams")
+    parser.add_argument("--epochs", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=2048)
+    parser.add_argument("--lr", type=float, default=0.05)
+    parser.add_argument("--l2", type=float, default=1e-6)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--target-precision", type=float, default=0.995,
+                        help="precision required of the settled verdicts on the held-out split")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", default=os.path.join(PROJECT_ROOT, "url", "prefilter.npz"))
+    args = parser.parse_args(argv)
+
+    urls, labels = read_dataset(args.input, args.url_column, args.label_column, args.phishing_label, args.limit)
+    if not urls:
+        print(f"No URLs read from {args.input}")
+        return 2
+    if args.teacher:
+        labels = teacher_labels(urls, 64)
+    print(f"{len(urls)} URLs, {int(labels.sum())} phishing ({'transformer' if args.teacher else 'dataset'} labels)")
+
+    order = np.random.default_rng(args.seed).permutation(len(urls))
+    n_val = int(len(urls) * args.val_fraction)
+    val, fit = order[:n_val], order[n_val:]
+
+    started = time.perf_counter()
+    batches = [(featurize([urls[i] for i in chunk], args.buckets), labels[chunk])
+               for chunk in np.array_split(fit, max(len(fit) // args.batch_size, 1))]
+    print(f"featurized {len(fit)} URLs in {time.perf_counter() - started:.1f}s")
+    model = train(batches, args.buckets, args.epochs, args.lr, args.l2, args.seed)
+
+    val_urls, val_labels = [urls[i] for i in val], labels[val]
+    started = time.perf_counter()
+    scores = model.scores(val_urls)
+    us_per_url = (time.perf_counter() - started) * 1e6 / max(len(val_urls), 1)
+    safe, phishing = pick_thresholds(scores, val_labels, args.target_precision)
+    report = evaluate(scores, val_labels, safe, phishing)
+    report.update(us_per_url=round(us_per_url, 2), safe_threshold=safe, phishing_threshold=phishing)
+
+    model.safe_threshold, model.phishing_threshold = safe, phishing
+    model.info = {
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "dataset": os.path.basename(args.input),
+        "labels": "transformer" if args.teacher else "dataset",
+        "target_precision": args.target_precision,
+        "validation": report,
+    }
+    model.save(args.output)
+    print(json.dumps(report, indent=2))
+    print(f"Saved prefilter to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
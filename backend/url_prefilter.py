@@ -0,0 +1,347 @@
+"""
+Lexical URL pre-classifier: the first tier of the URL cascade.
+
+A logistic regression over features computed with NumPy for a whole batch of
+URLs at once:
+
+* hashed character 3- and 5-grams of the lowercased URL (plus its TLD), each
+  row L2-normalized, scored as a sparse dot product with `np.bincount`;
+* dense lexical features: length, character entropy, digit and special
+  character counts, host length/dots/hyphens/digits, IP or punycode hosts,
+  scheme, path depth and phishing keywords.
+
+Scores at or above the phishing threshold, or at or below the safe threshold,
+settle the URL without the transformer; the band in between is escalated.
+A fraction of settled URLs (URL_PREFILTER_AUDIT_RATE) is escalated anyway, and
+`shadow` mode escalates everything, so the disagreement rate between the two
+tiers is measured on live traffic. Weights and the thresholds picked on
+held-out data come from train_url_prefilter.py; without a weights file every
+URL goes to the transformer.
+"""
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import config
+import timing
+from indicator_index import host_of, is_ip_address
+from metrics import registry
+
+PREFILTER_MODES = ("off", "shadow", "cascade")
+PHISHING_CLASS = 0  # label of the URL model (0 = Phishing, 1 = Safe)
+
+NGRAM_SIZES = (3, 5)
+MAX_URL_BYTES = 512
+KEYWORDS = ("login", "signin", "logon", "verify", "verification", "account", "update", "secure", "confirm",
+            "password", "banking", "webscr", "wallet", "billing", "suspend", "unlock", "support")
+SPECIAL_CHARS = ".-@%=?&_~/:+!*,;$#"
+SEGMENT_DELIMITERS = b"/.?=&-_:@#"
+
+DENSE_FEATURES = (
+    ("url_length", "log1p"), ("entropy", None), ("digit_ratio", None), ("non_ascii", "log1p"),
+    *((f"count[{c}]", "log1p") for c in SPECIAL_CHARS),
+    ("host_length", "log1p"), ("host_dots", None), ("host_hyphens", None), ("host_digits", None),
+    ("host_is_ip", None), ("host_punycode", None), ("https", None), ("path_depth", "log1p"), ("keywords", None),
+)
+
+# Byte -> column of the per-row character counts: digits, non-ASCII, then each special character
+_DIGIT, _NON_ASCII = 0, 1
+_CHAR_CLASS = np.full(256, -1, dtype=np.int64)
+_CHAR_CLASS[ord("0"):ord("9") + 1] = _DIGIT
+_CHAR_CLASS[128:] = _NON_ASCII
+for _i, _c in enumerate(SPECIAL_CHARS):
+    _CHAR_CLASS[ord(_c)] = 2 + _i
+_CHAR_CLASSES = 2 + len(SPECIAL_CHARS)
+
+
+def _byte_layout(texts):
+    """All texts as one uint8 array plus, per byte, its row; and per row its start and length."""
+    encoded = [t.encode("utf-8", "ignore")[:MAX_URL_BYTES] for t in texts]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.int64)
+    rows = np.repeat(np.arange(len(encoded)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    return data, rows, starts, lengths
+
+
+def _char_counts(data, rows, n):
+    classes = _CHAR_CLASS[data]
+    mask = classes >= 0
+    return np.bincount(rows[mask] * _CHAR_CLASSES + classes[mask], minlength=n * _CHAR_CLASSES).reshape(n, _CHAR_CLASSES)
+
+
+def _ngram_positions(data, rows, starts, lengths, size):
+    """Start offsets (into `data`) of every `size`-gram and their hashed values."""
+    within = np.arange(len(data)) - starts[rows]
+    idx = np.nonzero(within <= lengths[rows] - size)[0]
+    h = np.full(len(idx), 0xCBF29CE484222325 ^ size, dtype=np.uint64)
+    for j in range(size):
+        h = (h ^ data[idx + j].astype(np.uint64)) * np.uint64(0x100000001B3)  # FNV-1a
+    return idx, h ^ (h >> np.uint64(29))
+
+
+class Features:
+    """Hashed n-gram features (as row, bucket, value triples) and the dense feature matrix of a batch."""
+
+    def __init__(self, rows, buckets, values, dense, ngram_starts=None):
+        self.rows = rows
+        self.buckets = buckets
+        self.values = values
+        self.dense = dense
+        self.ngram_starts = ngram_starts
+
+    def __len__(self):
+        return len(self.dense)
+
+
+def featurize(urls, n_buckets, keep_positions=False):
+    """Features of `urls` for a model with `n_buckets` hash buckets."""
+    n = len(urls)
+    lowered = [u.strip().lower() for u in urls]
+    data, rows, starts, lengths = _byte_layout(lowered)
+
+    # Hashed character n-grams, plus one token for the TLD
+    gram_rows, gram_buckets, gram_starts = [], [], []
+    for size in NGRAM_SIZES:
+        idx, h = _ngram_positions(data, rows, starts, lengths, size)
+        gram_rows.append(rows[idx])
+        gram_buckets.append((h % np.uint64(n_buckets)).astype(np.int64))
+        if keep_positions:
+            gram_starts.append(np.stack([idx, np.full(len(idx), size)], axis=1))
+    hosts = [host_of(u) for u in lowered]
+    tlds = [h.rsplit(".", 1)[-1] if h and not is_ip_address(h) else "<ip>" for h in hosts]
+    gram_rows.append(np.arange(n))
+    gram_buckets.append(np.fromiter((zlib.crc32(f"tld:{t}".encode()) % n_buckets for t in tlds),
+                                    dtype=np.int64, count=n))
+    if keep_positions:
+        gram_starts.append(np.full((n, 2), -1))
+    f_rows = np.concatenate(gram_rows)
+    f_buckets = np.concatenate(gram_buckets)
+    per_row = np.bincount(f_rows, minlength=n)
+    f_values = (1.0 / np.sqrt(np.maximum(per_row, 1)))[f_rows].astype(np.float32)
+
+    # Dense lexical features
+    counts = _char_counts(data, rows, n)
+    histogram = np.bincount(rows * 256 + data, minlength=n * 256).reshape(n, 256).astype(np.float32)
+    p = histogram / np.maximum(lengths, 1)[:, None]
+    entropy = -(p * np.log2(np.where(p > 0, p, 1.0))).sum(axis=1)
+
+    h_data, h_rows, _, h_lengths = _byte_layout(hosts)
+    h_counts = _char_counts(h_data, h_rows, n)
+    dot, hyphen = 2 + SPECIAL_CHARS.index("."), 2 + SPECIAL_CHARS.index("-")
+    slash = 2 + SPECIAL_CHARS.index("/")
+    keywords = np.fromiter((sum(k in u for k in KEYWORDS) for u in lowered), dtype=np.float32, count=n)
+    has_scheme = np.fromiter(("://" in u for u in lowered), dtype=bool, count=n)
+
+    columns = [
+        lengths, entropy, counts[:, _DIGIT] / np.maximum(lengths, 1), counts[:, _NON_ASCII],
+        *(counts[:, 2 + i] for i in range(len(SPECIAL_CHARS))),
+        h_lengths, h_counts[:, dot], h_counts[:, hyphen], h_counts[:, _DIGIT],
+        np.fromiter((bool(h) and is_ip_address(h) for h in hosts), dtype=bool, count=n),
+        np.fromiter(("xn--" in h for h in hosts), dtype=bool, count=n),
+        np.fromiter((u.startswith("https:") for u in lowered), dtype=bool, count=n),
+        np.maximum(counts[:, slash] - 2 * has_scheme, 0), keywords,
+    ]
+    dense = np.empty((n, len(DENSE_FEATURES)), dtype=np.float32)
+    for j, ((_, transform), column) in enumerate(zip(DENSE_FEATURES, columns)):
+        column = np.asarray(column, dtype=np.float32)
+        dense[:, j] = np.log1p(column) if transform == "log1p" else column
+
+    positions = np.concatenate(gram_starts) if keep_positions else None
+    return Features(f_rows, f_buckets, f_values, dense, positions)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30.0, 30.0)))
+
+
+class LexicalModel:
+    """Logistic regression weights over `featurize` output; `scores` are P(phishing)."""
+
+    def __init__(self, hash_weights, dense_weights, dense_mean, dense_std, bias,
+                 safe_threshold=0.02, phishing_threshold=0.98, info=None):
+        self.hash_weights = np.asarray(hash_weights, dtype=np.float32)
+        self.dense_weights = np.asarray(dense_weights, dtype=np.float32)
+        self.dense_mean = np.asarray(dense_mean, dtype=np.float32)
+        self.dense_std = np.asarray(dense_std, dtype=np.float32)
+        self.bias = float(bias)
+        self.safe_threshold = float(safe_threshold)
+        self.phishing_threshold = float(phishing_threshold)
+        self.info = info or {}
+
+    @property
+    def n_buckets(self):
+        return len(self.hash_weights)
+
+    def logits(self, features):
+        hashed = np.bincount(features.rows, weights=self.hash_weights[features.buckets] * features.values,
+                             minlength=len(features))
+        dense = (features.dense - self.dense_mean) / self.dense_std
+        return hashed + dense @ self.dense_weights + self.bias
+
+    def scores(self, urls):
+        if not urls:
+            return np.zeros(0)
+        return _sigmoid(self.logits(featurize(urls, self.n_buckets)))
+
+    def save(self, path):
+        np.savez_compressed(
+            path, hash_weights=self.hash_weights, dense_weights=self.dense_weights,
+            dense_mean=self.dense_mean, dense_std=self.dense_std, bias=self.bias,
+            safe_threshold=self.safe_threshold, phishing_threshold=self.phishing_threshold,
+            dense_features=np.array([name for name, _ in DENSE_FEATURES]), info=json.dumps(self.info))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            if tuple(f["dense_features"]) != tuple(name for name, _ in DENSE_FEATURES):
+                raise ValueError("feature layout differs from this version; retrain with train_url_prefilter.py")
+            return cls(f["hash_weights"], f["dense_weights"], f["dense_mean"], f["dense_std"], f["bias"],
+                       f["safe_threshold"], f["phishing_threshold"], json.loads(str(f["info"])))
+
+    def explain(self, url, target_class):
+        """[segment, score] pairs for `url`: n-gram contributions summed per character,
+        then per URL segment (split at / . ? = & - _ : @ #); positive supports `target_class`."""
+        features = featurize([url], self.n_buckets, keep_positions=True)
+        contributions = self.hash_weights[features.buckets] * features.values
+        encoded = url.strip().lower().encode("utf-8", "ignore")[:MAX_URL_BYTES]
+        per_char = np.zeros(len(encoded))
+        for (start, size), value in zip(features.ngram_starts, contributions):
+            if start >= 0:
+                per_char[start:start + size] += value / size
+        sign = 1.0 if target_class == PHISHING_CLASS else -1.0
+
+        attributions, segment_start = [], 0
+        for i in range(len(encoded) + 1):
+            if i == len(encoded) or encoded[i] in SEGMENT_DELIMITERS:
+                if i > segment_start:
+                    segment = encoded[segment_start:i].decode("utf-8", "replace")
+                    attributions.append([segment, round(float(sign * per_char[segment_start:i].sum()), 4)])
+                segment_start = i + 1
+        return attributions
+
+
+class URLPrefilter:
+    """
+    Routes URLs between the lexical model and the transformer and counts, per
+    tier, how many verdicts each served and how often they disagree.
+    """
+
+    def __init__(self, path=None, mode=None, safe_threshold=None, phishing_threshold=None, audit_rate=None):
+        self.path = path or config.URL_PREFILTER_PATH or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "url", "prefilter.npz")
+        self.mode = (mode or config.URL_PREFILTER_MODE).lower()
+        if self.mode not in PREFILTER_MODES:
+            print(f"Warning: unknown URL prefilter mode '{self.mode}', using 'off'")
+            self.mode = "off"
+        self.audit_rate = config.URL_PREFILTER_AUDIT_RATE if audit_rate is None else audit_rate
+        self.model = None
+        self.error = None
+        if self.mode != "off":
+            try:
+                self.model = LexicalModel.load(self.path)
+            except FileNotFoundError:
+                self.error = f"no weights at {self.path}"
+            except (OSError, KeyError, ValueError) as e:
+                self.error = f"could not load {self.path}: {e}"
+            if self.error:
+                print(f"URL prefilter disabled ({self.error}); run train_url_prefilter.py to enable it")
+        # Explicit thresholds override the ones picked when the weights were trained
+        self.safe_threshold = self._threshold(safe_threshold, config.URL_PREFILTER_SAFE_THRESHOLD, "safe_threshold")
+        self.phishing_threshold = self._threshold(
+            phishing_threshold, config.URL_PREFILTER_PHISHING_THRESHOLD, "phishing_threshold")
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+        self.handled = {tier: registry.counter("url_cascade_verdicts_total", {"tier": tier},
+                                               help_text="URL verdicts served, per cascade tier.")
+                        for tier in ("prefilter", "transformer")}
+        self.settled = registry.counter("url_prefilter_settled_total",
+                                        help_text="URLs the prefilter was confident about (served or audited).")
+        self.audited = registry.counter("url_cascade_audits_total",
+                                        help_text="Prefilter verdicts also checked by the transformer.")
+        self.disagreed = registry.counter("url_cascade_disagreements_total",
+                                          help_text="Audited prefilter verdicts the transformer disagreed with.")
+        self.cost = registry.histogram("url_prefilter_us_per_url", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+                                       help_text="Prefilter scoring time per URL, in microseconds.")
+
+    def _threshold(self, explicit, configured, trained):
+        if explicit is not None:
+            return explicit
+        if configured is not None:
+            return configured
+        return getattr(self.model, trained) if self.model else None
+
+    @property
+    def enabled(self):
+        return self.model is not None and self.mode != "off"
+
+    def plan(self, urls):
+        """Per URL, (verdict, escalate): `verdict` is the prefilter's (pred_idx, confidence)
+        when it is confident, else None; `escalate` says whether the transformer must run."""
+        if not self.enabled or not urls:
+            self.handled["transformer"].inc(len(urls))
+            return [(None, True)] * len(urls)
+
+        started = time.perf_counter()
+        with timing.stage("prefilter"):
+            scores = self.model.scores(urls)
+        self.cost.observe((time.perf_counter() - started) * 1e6 / len(urls))
+
+        plan = []
+        for score in scores:
+            if score >= self.phishing_threshold:
+                verdict = (PHISHING_CLASS, float(score))
+            elif score <= self.safe_threshold:
+                verdict = (1 - PHISHING_CLASS, float(1.0 - score))
+            else:
+                plan.append((None, True))
+                continue
+            self.settled.inc()
+            with self._lock:
+                audit = self._random.random() < self.audit_rate
+            plan.append((verdict, self.mode == "shadow" or audit))
+        escalated = sum(1 for _, escalate in plan if escalate)
+        self.handled["transformer"].inc(escalated)
+        self.handled["prefilter"].inc(len(plan) - escalated)
+        return plan
+
+    def observe(self, verdict, pred_idx):
+        """Records the transformer's answer for an escalated URL the prefilter had a verdict for."""
+        if verdict is None:
+            return
+        self.audited.inc()
+        if verdict[0] != pred_idx:
+            self.disagreed.inc()
+
+    def explain(self, url, target_class):
+        return self.model.explain(url, target_class)
+
+    def stats(self):
+        served = {tier: counter.value for tier, counter in self.handled.items()}
+        total = sum(served.values())
+        audited = self.audited.value
+        return {
+            "mode": self.mode,
+            "enabled": self.enabled,
+            "error": self.error,
+            "thresholds": {"safe": self.safe_threshold, "phishing": self.phishing_threshold},
+            "audit_rate": self.audit_rate,
+            "served": served,
+            "fraction": {tier: round(n / total, 4) if total else 0.0 for tier, n in served.items()},
+            "settled": self.settled.value,
+            "audited": audited,
+            "disagreements": self.disagreed.value,
+            "disagreement_rate": round(self.disagreed.value / audited, 4) if audited else None,
+            "us_per_url": self.cost.snapshot(),
+            "model": self.model.info if self.model else None,
+        }
+
+
+# Singleton instance
+url_prefilter = URLPrefilter()
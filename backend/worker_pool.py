@@ -0,0 +1,344 @@
+"""Multi-process inference: a pool of worker processes serving predict/explain.
+
+The Flask process stays thin: it tokenizes, batches and forwards work over a
+local authenticated socket (multiprocessing.connection) to worker processes,
+each pinned to its own slice of CPU cores. Workers map the models'
+safetensors files copy-on-write (see model_utils.share_safetensors_weights),
+so N workers hold one copy of the weights in the page cache, not N.
+
+Workers are plain subprocesses running this file, not multiprocessing
+children, so they never re-import app.py. A health loop restarts any worker
+that exits; requests it had in flight fail with WorkerCrashed. A worker that
+leaves a request unanswered past its deadline is killed and restarted the
+same way, failing its requests with WorkerTimeout.
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Client, Listener
+
+import config
+from metrics import registry
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+AUTHKEY_ENV = "CEREBRO_WORKER_AUTHKEY"
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker handling a request died before answering."""
+
+
+class WorkerTimeout(WorkerCrashed):
+    """The worker handling a request did not answer before the request deadline."""
+
+
+class NoWorkersAvailable(RuntimeError):
+    """No worker is ready; callers fall back to in-process inference."""
+
+
+def partition_cores(workers):
+    """Splits the CPUs this process may use into `workers` contiguous slices.
+    Returns empty slices (no pinning) when pinning is off or there are fewer CPUs than workers."""
+    if hasattr(os, "sched_getaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    if not config.WORKER_PIN_CORES or len(available) < workers:
+        return [[] for _ in range(workers)]
+    size, extra = divmod(len(available), workers)
+    slices, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(available[start:end])
+        start = end
+    return slices
+
+
+class _WorkerSlot:
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.conn = None
+        self.state = "starting"
+        self.error = None
+        self.inflight = {}  # request_id -> (future, deadline)
+        self.served = 0
+        self.restarts = 0
+        self.consecutive_failures = 0
+        self.restart_at = 0.0
+        self.send_lock = threading.Lock()
+
+
+class InferenceWorkerPool:
+    """
+    Dispatches predict/explain requests to the least-loaded ready worker.
+    `model_paths` maps model names (as used in requests) to model directories.
+    """
+
+    def __init__(self, model_paths, workers=None, health_interval=None, request_timeout=None):
+        self.model_paths = dict(model_paths)
+        self.workers = workers or config.INFERENCE_WORKERS
+        self.health_interval = health_interval or config.WORKER_HEALTH_INTERVAL_SECONDS
+        self.request_timeout = request_timeout or config.WORKER_REQUEST_TIMEOUT_SECONDS
+        self._authkey = os.urandom(16)
+        self._listener = Listener(("127.0.0.1", 0), authkey=self._authkey)
+        self._slots = [_WorkerSlot(i, cores) for i, cores in enumerate(partition_cores(self.workers))]
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self.restarts_total = registry.counter("inference_worker_restarts_total", help_text="Worker processes restarted.")
+        self.timeouts_total = registry.counter("inference_worker_timeouts_total",
+                                               help_text="Workers killed for leaving a request unanswered past its deadline.")
+        self.ready_gauge = registry.gauge("inference_workers_ready", help_text="Worker processes accepting requests.")
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="worker-accept", daemon=True).start()
+        for slot in self._slots:
+            self._spawn(slot)
+        threading.Thread(target=self._health_loop, name="worker-health", daemon=True).start()
+
+    def _spawn(self, slot):
+        host, port = self._listener.address
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--address", f"{host}:{port}", "--index", str(slot.index),
+                   "--cores", ",".join(str(c) for c in slot.cores)]
+        command += [f"--model={name}={path}" for name, path in self.model_paths.items()]
+        env = dict(os.environ, **{AUTHKEY_ENV: self._authkey.hex()})
+        slot.state = "starting"
+        slot.conn = None
+        slot.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn = self._listener.accept()
+                _, index, pid = conn.recv()
+            except Exception:
+                if self._stopped.is_set():
+                    return
+                continue
+            slot = self._slots[index]
+            if slot.process is None or slot.process.pid != pid:
+                conn.close()  # a worker that was already replaced
+                continue
+            slot.conn = conn
+            threading.Thread(target=self._read_loop, args=(slot, conn), name=f"worker-{index}-reader", daemon=True).start()
+
+    def _read_loop(self, slot, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "ready":
+                slot.state = "ready"
+                slot.consecutive_failures = 0
+                self._update_ready_gauge()
+                print(f"Inference worker {slot.index} ready (pid {slot.process.pid}, cores {slot.cores or 'all'}).")
+                continue
+            if message[0] == "failed":
+                slot.error = message[1]
+                continue
+            request_id, ok, payload = message
+            with self._lock:
+                future, _ = slot.inflight.pop(request_id, (None, None))
+                slot.served += 1
+            if future is not None:
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RuntimeError(payload))
+        if conn is slot.conn:
+            self._fail_inflight(slot, "connection to worker lost")
+
+    def _fail_inflight(self, slot, reason, error=WorkerCrashed):
+        with self._lock:
+            pending, slot.inflight = slot.inflight, {}
+            if slot.state == "ready":
+                slot.state = "down"
+        self._update_ready_gauge()
+        for future, _ in pending.values():
+            future.set_exception(error(f"inference worker {slot.index}: {reason}"))
+
+    def _schedule_restart(self, slot, now):
+        slot.state = "restarting"
+        slot.consecutive_failures += 1
+        # Back off when a worker keeps dying, e.g. because its model fails to load
+        slot.restart_at = now + min(60.0, self.health_interval * 2 ** (slot.consecutive_failures - 1))
+
+    def _overdue(self, slot, now):
+        """Seconds the slot's oldest unanswered request is past its deadline, or None."""
+        with self._lock:
+            deadlines = [deadline for _, deadline in slot.inflight.values()]
+        late = now - min(deadlines) if deadlines else 0.0
+        return late if late > 0 else None
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            now = time.monotonic()
+            for slot in self._slots:
+                code = slot.process.poll() if slot.process else None
+                if code is None:
+                    late = self._overdue(slot, now)
+                    if late is not None and slot.state != "restarting":
+                        # Hung or wedged: its requests would otherwise wait forever
+                        print(f"Inference worker {slot.index} left a request unanswered {late:.1f}s past "
+                              f"its deadline; restarting it.")
+                        self._fail_inflight(slot, f"no answer within {self.request_timeout}s", WorkerTimeout)
+                        self._schedule_restart(slot, now)
+                        self.timeouts_total.inc()
+                        slot.process.kill()
+                    continue
+                if slot.state != "restarting":
+                    print(f"Inference worker {slot.index} exited with code {code}.")
+                    self._fail_inflight(slot, f"exited with code {code}")
+                    self._schedule_restart(slot, now)
+                if now >= slot.restart_at:
+                    slot.restarts += 1
+                    self.restarts_total.inc()
+                    self._spawn(slot)
+
+    def _update_ready_gauge(self):
+        self.ready_gauge.set(sum(1 for slot in self._slots if slot.state == "ready"))
+
+    def ready_workers(self):
+        return sum(1 for slot in self._slots if slot.state == "ready")
+
+    def submit(self, op, model_name, *args):
+        """Sends one request to the least-loaded ready worker and returns a Future.
+        Raises NoWorkersAvailable if none is ready."""
+        with self._lock:
+            ready = [slot for slot in self._slots if slot.state == "ready" and slot.conn is not None]
+            if not ready:
+                raise NoWorkersAvailable("no inference worker is ready")
+            slot = min(ready, key=lambda s: len(s.inflight))
+            request_id = next(self._ids)
+            future = Future()
+            slot.inflight[request_id] = (future, time.monotonic() + self.request_timeout)
+        try:
+            with slot.send_lock:
+                slot.conn.send((request_id, op, model_name, args))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                slot.inflight.pop(request_id, None)
+            future.set_exception(WorkerCrashed(f"inference worker {slot.index}: {e}"))
+        return future
+
+    def result(self, future):
+        """Waits for a `submit` future. The health loop fails overdue requests, so this
+        only backstops it: the wait never outlasts the deadline plus one health check."""
+        try:
+            return future.result(timeout=self.request_timeout + 2 * self.health_interval)
+        except FutureTimeout:
+            raise WorkerTimeout(f"no answer from an inference worker within {self.request_timeout}s") from None
+
+    def stop(self, timeout=5.0):
+        """Asks every worker to exit, then terminates stragglers. Safe to call more than once."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        for slot in self._slots:
+            try:
+                with slot.send_lock:
+                    if slot.conn is not None:
+                        slot.conn.send((None, "stop", None, ()))
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        for slot in self._slots:
+            if slot.process is None:
+                continue
+            try:
+                slot.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                slot.process.terminate()
+        self._listener.close()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "ready": self.ready_workers(),
+            "restarts": self.restarts_total.value,
+            "timeouts": self.timeouts_total.value,
+            "request_timeout_seconds": self.request_timeout,
+            "slots": [{
+                "index": slot.index,
+                "pid": slot.process.pid if slot.process else None,
+                "state": slot.state,
+                "cores": slot.cores,
+                "inflight": len(slot.inflight),
+                "served": slot.served,
+                "restarts": slot.restarts,
+                "error": slot.error,
+            } for slot in self._slots],
+        }
+
+
+def worker_main(argv=None):
+    """Entry point of a worker process (started by InferenceWorkerPool._spawn)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--index", type=int, required=True)
+    parser.add_argument("--cores", default="")
+    parser.add_argument("--model", action="append", default=[], help="name=path")
+    args = parser.parse_args(argv)
+
+    cores = [int(c) for c in args.cores.split(",") if c]
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    # Imported after pinning so PyTorch sizes its thread pools for this worker's cores
+    import inference_backends
+    import model_utils
+    if cores:
+        inference_backends.configure_threads(intra_op=len(cores), inter_op=1)
+    else:
+        inference_backends.configure_threads()
+
+    host, port = args.address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    conn.send(("hello", args.index, os.getpid()))
+
+    models = {}
+    for spec in args.model:
+        name, path = spec.split("=", 1)
+        model, tokenizer = model_utils.load_model(path)
+        if model is None:
+            conn.send(("failed", f"could not load {path}"))
+            return 1
+        backend = inference_backends.create_backend(model, tokenizer, path, model_utils.model_fingerprint(path))
+        models[name] = (model, tokenizer, backend)
+    conn.send(("ready",))
+
+    while True:
+        try:
+            request_id, op, name, payload = conn.recv()
+        except (EOFError, OSError):
+            return 0  # the HTTP process went away
+        if op == "stop":
+            return 0
+        try:
+            model, tokenizer, backend = models[name]
+            if op == "predict":
+                result = model_utils.predict_encoded(payload[0], model, tokenizer, backend)
+            elif op == "explain":
+                text, target_class, mode, encoding = payload
+                result = model_utils.explain_prediction(
+                    text, model, tokenizer, target_class=target_class, mode=mode, encoding=encoding)
+            else:
+                raise ValueError(f"Unknown worker operation '{op}'")
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+        else:
+            conn.send((request_id, True, result))
+
+
+if __name__ == "__main__":
+    sys.exit(worker_main())
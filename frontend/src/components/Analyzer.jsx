@@ -22,7 +22,8 @@ const Analyzer = ({ mode }) => {
     setResult(null);
     setError(null);
     try {
-      const payload = mode === 'email' ? { text: input } : { url: input };
+      // Verdict comes back immediately; ExplanationViz fetches the attributions once ready
+      const payload = mode === 'email' ? { text: input, explain: 'deferred' } : { url: input, explain: 'deferred' };
       const response = await axios.post(endpoint, payload);
       setResult(response.data);
     } catch (err) {
@@ -113,7 +114,15 @@ const Analyzer = ({ mode }) => {
                             <span>Confidence Signal</span>
                             <span>{(result.confidence * 100).toFixed(2)}%</span>
                         </div>
-                        
+
+                        {/* Long emails are scored in overlapping windows */}
+                        {result.windows && (
+                            <div className="mt-2 text-xs text-gray-500 font-mono">
+                                Scanned {result.windows.evaluated} of {result.windows.total} windows ({result.windows.aggregation})
+                                {result.windows.stopped_early && ' · stopped early on a high-confidence window'}
+                            </div>
+                        )}
+
                         {/* Threat Intel Widget */}
                         {result.third_party_analysis && (
                             <div className="mt-6 pt-6 border-t border-gray-800">
@@ -181,7 +190,11 @@ const Analyzer = ({ mode }) => {
 
                 {/* Explanation Viz */}
                 <div className="lg:col-span-2">
-                    <ExplanationViz attributions={result.attributions} prediction={result.prediction} />
+                    <ExplanationViz
+                        attributions={result.attributions}
+                        prediction={result.prediction}
+                        explanationId={result.explanation?.status === 'pending' ? result.explanation.id : null}
+                    />
                 </div>
 
             </Motion.div>
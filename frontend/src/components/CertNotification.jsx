@@ -1,20 +1,41 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import axios from 'axios';
 import { ShieldAlert } from 'lucide-react';
 
+const API_URL = 'http://localhost:5000/api';
+// Reports are archived in batches; poll until ours has been written to a STIX bundle
+const STATUS_POLL_MS = 2000;
+
 const CertNotification = ({ type, content }) => {
   const [loading, setLoading] = useState(false);
   const [reported, setReported] = useState(false);
   const [reportId, setReportId] = useState(null);
+  const [report, setReport] = useState(null);
+
+  useEffect(() => {
+    if (!reportId || report?.status === 'archived' || report?.status === 'failed') return undefined;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API_URL}/cert-reports/${reportId}`);
+        setReport(response.data);
+      } catch (error) {
+        // Submissions the pipeline gave up on are no longer known to it
+        if (error.response?.status === 404) setReport({ status: 'failed' });
+        else console.error("Failed to fetch report status", error);
+      }
+    }, STATUS_POLL_MS);
+    return () => clearTimeout(timer);
+  }, [reportId, report]);
 
   const handleReport = async () => {
     setLoading(true);
     try {
-      const response = await axios.post('http://localhost:5000/api/notify-cert', {
+      const response = await axios.post(`${API_URL}/notify-cert`, {
         type,
         content
       });
       setReportId(response.data.report_id);
+      setReport(response.data);
       setReported(true);
     } catch (error) {
       console.error("Failed to report", error);
@@ -32,6 +53,11 @@ const CertNotification = ({ type, content }) => {
            <div className="text-xs text-gray-400 font-mono ml-7">
                 Ref ID: {reportId || 'PENDING-ACK'}
            </div>
+           <div className="text-xs text-gray-500 font-mono ml-7">
+                {report?.status === 'archived'
+                  ? `STIX ${report.bundle_id}`
+                  : report?.status === 'failed' ? 'Archiving failed' : 'Queued for STIX bundle...'}
+           </div>
         </div>
      );
   }
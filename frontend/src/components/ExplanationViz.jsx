@@ -1,7 +1,52 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
+import axios from 'axios';
 import { motion } from 'framer-motion';
+import { Loader2 } from 'lucide-react';
+
+const POLL_INTERVAL_MS = 1000;
+
+const ExplanationViz = ({ attributions: initialAttributions, prediction, explanationId }) => {
+  const [deferred, setDeferred] = useState({ id: null, status: null, attributions: [] });
+
+  // Deferred explanations are computed in the background; poll until they are ready
+  useEffect(() => {
+    if (!explanationId) return undefined;
+    let cancelled = false;
+    let timer = null;
+
+    const poll = async () => {
+      try {
+        const response = await axios.get(`http://localhost:5000/api/explanations/${explanationId}`);
+        if (cancelled) return;
+        const { status, attributions } = response.data;
+        setDeferred({ id: explanationId, status, attributions: attributions || [] });
+        if (status === 'pending') {
+          timer = setTimeout(poll, POLL_INTERVAL_MS);
+        }
+      } catch {
+        if (!cancelled) setDeferred({ id: explanationId, status: 'failed', attributions: [] });
+      }
+    };
+
+    poll();
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [explanationId]);
+
+  const pending = explanationId && (deferred.id !== explanationId || deferred.status === 'pending');
+  const attributions = explanationId && deferred.id === explanationId ? deferred.attributions : initialAttributions;
+
+  if (pending) {
+    return (
+      <div className="mt-6 p-4 bg-gray-800 rounded-lg shadow-lg border border-gray-700 flex items-center gap-3 text-gray-400">
+        <Loader2 className="animate-spin" size={18} />
+        <span>Computing explanation...</span>
+      </div>
+    );
+  }
 
-const ExplanationViz = ({ attributions, prediction }) => {
   if (!attributions || attributions.length === 0) return null;
 
   // Normalize scores for color intensity if needed, but assuming captum scores are raw
@@ -1,18 +1,32 @@
-import React, { useEffect, useState } from 'react';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
 import { Activity, Loader2, AlertTriangle, CheckCircle, Mail, Globe, Clock, Search } from 'lucide-react';
 import { motion as Motion } from 'framer-motion';
 import axios from 'axios';
 
+const API_URL = 'http://localhost:5000/api/incident-logs';
+const PAGE_SIZE = 50;
+const EVENTS_URL = 'http://localhost:5000/api/events?types=incidents';
+
 const IncidentLogs = () => {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
   const [selectedLog, setSelectedLog] = useState(null);
+  const latestIdRef = useRef(null);
+
+  const rememberLatest = (items) => {
+    const newest = items.reduce((max, item) => Math.max(max, item.id), latestIdRef.current ?? 0);
+    if (newest) latestIdRef.current = newest;
+  };
 
   useEffect(() => {
     const fetchLogs = async () => {
       try {
-        const response = await axios.get('http://localhost:5000/api/incident-logs');
-        setLogs(response.data);
+        const response = await axios.get(API_URL, { params: { limit: PAGE_SIZE } });
+        setLogs(response.data.items);
+        setNextCursor(response.data.next_cursor);
+        rememberLatest(response.data.items);
       } catch {
         console.error('Failed to load incident history.');
       } finally {
@@ -23,6 +37,52 @@ const IncidentLogs = () => {
     fetchLogs();
   }, []);
 
+  // Live updates: each committed batch of incidents is pushed over Server-Sent Events.
+  // EventSource reconnects on its own and resumes from the last event it saw. Whenever the
+  // stream (re)opens, or after a `reset` (too far behind to replay), catch up with one query
+  // for rows past the newest on screen.
+  useEffect(() => {
+    const prepend = (items) => {
+      if (items.length === 0) return;
+      rememberLatest(items);
+      setLogs((current) => {
+        const seen = new Set(current.map((log) => log.id));
+        return [...items.filter((log) => !seen.has(log.id)), ...current];
+      });
+    };
+
+    const catchUp = async () => {
+      try {
+        const params = { limit: PAGE_SIZE };
+        if (latestIdRef.current) params.since = latestIdRef.current;
+        const response = await axios.get(API_URL, { params });
+        prepend(response.data.items);
+      } catch {
+        console.error('Failed to refresh incident history.');
+      }
+    };
+
+    const events = new EventSource(EVENTS_URL);
+    events.addEventListener('incidents', (event) => prepend(JSON.parse(event.data).items));
+    events.addEventListener('open', catchUp);
+    events.addEventListener('reset', catchUp);
+    return () => events.close();
+  }, []);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(API_URL, { params: { limit: PAGE_SIZE, cursor: nextCursor } });
+      setLogs((current) => [...current, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch {
+      console.error('Failed to load older incidents.');
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [nextCursor]);
+
   if (loading) {
     return (
       <div className="flex flex-col items-center justify-center p-12 text-gray-500">
@@ -55,7 +115,7 @@ const IncidentLogs = () => {
                 key={log.id}
                 initial={{ opacity: 0, y: 10 }}
                 animate={{ opacity: 1, y: 0 }}
-                transition={{ delay: index * 0.05 }}
+                transition={{ delay: Math.min(index, 20) * 0.05 }}
                 className="bg-bny-card border border-gray-800 p-4 rounded-xl flex items-center justify-between hover:border-gray-700 transition-all group"
             >
                 <div className="flex items-center gap-4">
@@ -93,6 +153,19 @@ const IncidentLogs = () => {
                 </div>
             </Motion.div>
           ))}
+
+          {nextCursor && (
+            <div className="flex justify-center pt-2">
+                <button
+                    onClick={loadMore}
+                    disabled={loadingMore}
+                    className="flex items-center gap-2 px-4 py-2 bg-gray-800 hover:bg-gray-700 text-gray-300 rounded-lg transition-colors border border-gray-700 disabled:opacity-50"
+                >
+                    {loadingMore && <Loader2 className="animate-spin" size={14} />}
+                    Load older incidents
+                </button>
+            </div>
+          )}
         </div>
       )}
 
@@ -1,27 +1,52 @@
 import React, { useEffect, useState } from 'react';
-import { Shield, ExternalLink, Loader2, AlertTriangle, CheckCircle } from 'lucide-react';
+import { Shield, Loader2, AlertTriangle, ChevronLeft, ChevronRight } from 'lucide-react';
 import { motion as Motion } from 'framer-motion';
 import axios from 'axios';
 
+const API_URL = 'http://localhost:5000/api/threat-feed';
+const PAGE_SIZE = 50;
+// The backend pushes a `feed` event whenever the feed changes; pages are only re-fetched then
+const EVENTS_URL = 'http://localhost:5000/api/events?types=feed';
+
 const ThreatFeed = () => {
-  const [threats, setThreats] = useState([]);
+  const [page, setPage] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [offset, setOffset] = useState(0);
+  const [filters, setFilters] = useState({ threat: '', tag: '', status: '' });
 
   useEffect(() => {
+    let cancelled = false;
     const fetchThreats = async () => {
       try {
-        const response = await axios.get('http://localhost:5000/api/threat-feed');
-        setThreats(response.data);
+        const params = { limit: PAGE_SIZE, offset };
+        Object.entries(filters).forEach(([name, value]) => { if (value) params[name] = value; });
+        const response = await axios.get(API_URL, { params });
+        if (!cancelled) {
+          setPage(response.data);
+          setError(null);
+        }
       } catch {
-        setError('Failed to load threat feed. Ensure backend is running.');
+        if (!cancelled) setError('Failed to load threat feed. Ensure backend is running.');
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
     };
 
     fetchThreats();
-  }, []);
+    const events = new EventSource(EVENTS_URL);
+    events.addEventListener('feed', fetchThreats);
+    events.addEventListener('reset', fetchThreats);
+    return () => {
+      cancelled = true;
+      events.close();
+    };
+  }, [offset, filters]);
+
+  const setFilter = (name, value) => {
+    setFilters((current) => ({ ...current, [name]: value }));
+    setOffset(0);
+  };
 
   if (loading) {
     return (
@@ -32,7 +57,7 @@ const ThreatFeed = () => {
     );
   }
 
-  if (error) {
+  if (error && !page) {
     return (
       <div className="p-6 bg-red-900/20 border-l-4 border-red-500 text-red-200 rounded flex items-center gap-3">
         <AlertTriangle size={20} /> {error}
@@ -40,6 +65,10 @@ const ThreatFeed = () => {
     );
   }
 
+  const threats = page.items;
+  const facets = page.facets;
+  const selectClass = "bg-black/40 border border-gray-800 rounded-lg px-3 py-2 text-xs text-gray-300 focus:border-bny-gold focus:ring-0";
+
   return (
     <div className="w-full max-w-6xl mx-auto space-y-6">
       <div className="flex items-center justify-between">
@@ -47,7 +76,10 @@ const ThreatFeed = () => {
             <h2 className="text-2xl font-bold text-white flex items-center gap-2">
                 <Shield className="text-bny-gold" /> Global Threat Intelligence
             </h2>
-            <p className="text-gray-400 text-sm mt-1">Real-time feed from URLHaus & Global Defense Network</p>
+            <p className="text-gray-400 text-sm mt-1">
+              Real-time feed from URLHaus & Global Defense Network
+              {page.latest && <span className="text-gray-600"> · newest entry {page.latest} UTC</span>}
+            </p>
          </div>
          <div className="px-4 py-1 bg-green-900/30 text-green-400 rounded-full text-xs font-mono border border-green-800 flex items-center gap-2">
             <span className="relative flex h-2 w-2">
@@ -58,6 +90,29 @@ const ThreatFeed = () => {
          </div>
       </div>
 
+      {/* Filters */}
+      <div className="flex flex-wrap items-center gap-3">
+        <select className={selectClass} value={filters.threat} onChange={(e) => setFilter('threat', e.target.value)}>
+          <option value="">All threat types</option>
+          {Object.entries(facets.threats).map(([value, count]) => (
+            <option key={value} value={value}>{value} ({count})</option>
+          ))}
+        </select>
+        <select className={selectClass} value={filters.tag} onChange={(e) => setFilter('tag', e.target.value)}>
+          <option value="">All tags</option>
+          {Object.entries(facets.tags).map(([value, count]) => (
+            <option key={value} value={value}>{value} ({count})</option>
+          ))}
+        </select>
+        <select className={selectClass} value={filters.status} onChange={(e) => setFilter('status', e.target.value)}>
+          <option value="">Any status</option>
+          {Object.entries(facets.statuses).map(([value, count]) => (
+            <option key={value} value={value}>{value} ({count})</option>
+          ))}
+        </select>
+        <span className="text-xs text-gray-500 ml-auto">{page.total} indicators</span>
+      </div>
+
       <div className="bg-bny-card border border-gray-800 rounded-xl overflow-hidden shadow-2xl">
         <div className="overflow-x-auto">
           <table className="w-full text-left text-sm text-gray-400">
@@ -66,17 +121,18 @@ const ThreatFeed = () => {
                 <th className="px-6 py-4">Threat Source</th>
                 <th className="px-6 py-4">Indicator (URL/Hash)</th>
                 <th className="px-6 py-4">Type</th>
-                <th className="px-6 py-4">Severity</th>
-                <th className="px-6 py-4">Timestamp</th>
+                <th className="px-6 py-4">Tags</th>
+                <th className="px-6 py-4">Status</th>
+                <th className="px-6 py-4">Date Added (UTC)</th>
               </tr>
             </thead>
             <tbody className="divide-y divide-gray-800">
               {threats.map((threat, index) => (
-                <Motion.tr 
-                    key={index}
+                <Motion.tr
+                    key={threat.id}
                     initial={{ opacity: 0, x: -20 }}
                     animate={{ opacity: 1, x: 0 }}
-                    transition={{ delay: index * 0.05 }}
+                    transition={{ delay: Math.min(index, 20) * 0.05 }}
                     className="hover:bg-white/5 transition-colors"
                 >
                   <td className="px-6 py-4 font-medium text-white">{threat.source}</td>
@@ -85,17 +141,53 @@ const ThreatFeed = () => {
                   </td>
                   <td className="px-6 py-4">
                     <span className="inline-flex items-center gap-1.5 px-2.5 py-1 rounded-full text-xs font-medium bg-red-900/20 text-red-400 border border-red-900/30">
-                        <AlertTriangle size={10} /> {threat.type}
+                        <AlertTriangle size={10} /> {threat.threat}
                     </span>
                   </td>
-                  <td className="px-6 py-4 text-red-500 font-bold">{threat.severity}</td>
-                  <td className="px-6 py-4 text-gray-500 text-xs">{threat.timestamp}</td>
+                  <td className="px-6 py-4">
+                    <div className="flex flex-wrap gap-1">
+                      {threat.tags.map((tag) => (
+                        <button
+                          key={tag}
+                          onClick={() => setFilter('tag', tag)}
+                          className="px-2 py-0.5 rounded bg-gray-800 text-gray-400 text-[10px] font-mono hover:text-bny-gold"
+                        >
+                          {tag}
+                        </button>
+                      ))}
+                    </div>
+                  </td>
+                  <td className={`px-6 py-4 text-xs font-bold uppercase ${threat.status === 'online' ? 'text-red-500' : 'text-gray-500'}`}>
+                    {threat.status}
+                  </td>
+                  <td className="px-6 py-4 text-gray-500 text-xs">{threat.date_added || '—'}</td>
                 </Motion.tr>
               ))}
             </tbody>
           </table>
         </div>
       </div>
+
+      {/* Pagination */}
+      <div className="flex items-center justify-end gap-3 text-xs text-gray-500">
+        <span>
+          {page.total === 0 ? 0 : offset + 1}–{Math.min(offset + PAGE_SIZE, page.total)} of {page.total}
+        </span>
+        <button
+          onClick={() => setOffset(Math.max(offset - PAGE_SIZE, 0))}
+          disabled={offset === 0}
+          className="p-1 rounded border border-gray-800 hover:border-bny-gold disabled:opacity-30 disabled:cursor-not-allowed"
+        >
+          <ChevronLeft size={14} />
+        </button>
+        <button
+          onClick={() => setOffset(offset + PAGE_SIZE)}
+          disabled={offset + PAGE_SIZE >= page.total}
+          className="p-1 rounded border border-gray-800 hover:border-bny-gold disabled:opacity-30 disabled:cursor-not-allowed"
+        >
+          <ChevronRight size={14} />
+        </button>
+      </div>
     </div>
   );
 };
@@ -1,36 +1,34 @@
 import requests
 import json
-import os
+import time
 
-url = 'http://localhost:5000/api/notify-cert'
+base_url = 'http://localhost:5000/api'
 data = {
     'type': 'Malicious URL',
     'content': 'http://test-phishing-site.com'
 }
 
 try:
-    print(f"Sending POST request to {url}...")
-    response = requests.post(url, json=data)
+    print(f"Sending POST request to {base_url}/notify-cert...")
+    response = requests.post(f"{base_url}/notify-cert", json=data)
     print(f"Status Code: {response.status_code}")
     print(f"Response Body: {json.dumps(response.json(), indent=2)}")
-    
-    # Check if file exists
-    if response.status_code == 200 and 'file_saved' in response.json():
-        filename = response.json()['file_saved']
-        # Assuming script is run from project root
-        filepath = os.path.join('backend', 'submitted_reports', filename)
-        if os.path.exists(filepath):
-            print(f"SUCCESS: File created at {filepath}")
+
+    # Reports are queued; wait for the pipeline to archive it in a STIX bundle
+    if response.status_code == 202 and 'report_id' in response.json():
+        report_id = response.json()['report_id']
+        for _ in range(30):
+            report = requests.get(f"{base_url}/cert-reports/{report_id}").json()
+            if report.get('status') != 'queued':
+                break
+            time.sleep(1)
+        if report.get('status') == 'archived' and report.get('bundle'):
+            print(f"SUCCESS: Report archived in {report['bundle_id']}")
+            print(json.dumps(report['bundle'], indent=2))
         else:
-            print(f"FAILURE: File {filename} reported saved but not found at {filepath}")
-            # Try absolute path based on user structure
-            abs_path = os.path.join(r'c:\Users\jaisu\Projects\BNY\backend\submitted_reports', filename)
-            if os.path.exists(abs_path):
-                 print(f"SUCCESS: File found at absolute path {abs_path}")
-            else:
-                 print("File definitely not found.")
+            print(f"FAILURE: Report status is {report.get('status')}")
     else:
-        print("Response did not indicate success or file_saved.")
+        print("Response did not indicate the report was queued.")
 
 except Exception as e:
     print(f"Error: {e}")